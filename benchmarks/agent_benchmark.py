@@ -0,0 +1,260 @@
+"""Benchmarks of the agent's own overhead, run offline against a fake LLM
+
+Every LLM call is answered by `FakeLLM`, so the timings only contain prompt
+formatting, parsing, file I/O, sandbox and pytest runs plus the configured latency.
+
+    python benchmarks/agent_benchmark.py --iterations 5
+    python benchmarks/agent_benchmark.py --suite tdd --latency 0.2 --output tdd.json
+
+Each suite reports its wall time, the time spent in each traced stage (see
+`prompt_to_code.tracing`) and its peak Python allocations and process RSS.
+Replay a real run with `--transcripts ./logs` to use recorded responses.
+"""
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable
+
+from typer import Option, Typer
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "examples"))
+
+from prompt_to_code.agents.agents import run_agent  # noqa: E402
+from prompt_to_code.agents.async_agents import arun_agent  # noqa: E402
+from prompt_to_code.agents.basic_linear import build_agent_executor  # noqa: E402
+from prompt_to_code.agents.fake_llm import FakeLLM  # noqa: E402
+from prompt_to_code.config import PromptToCodeConfig  # noqa: E402
+from prompt_to_code.tools.file_list import list_file_tool  # noqa: E402
+from prompt_to_code.tools.file_reader import read_file_tool  # noqa: E402
+from prompt_to_code.tools.file_writer import write_to_file_tool  # noqa: E402
+from prompt_to_code.tracing import (  # noqa: E402
+    Tracer,
+    set_tracer,
+    span,
+    summarize_trace,
+)
+
+SUITES = ["tdd", "async-tdd", "basic-linear", "human-eval"]
+
+TASK = '''
+def add(x: int, y: int) -> int:
+    """Add two numbers x and y
+    >>> add(2, 3)
+    5
+    >>> add(5, 7)
+    12
+    """
+'''.lstrip()
+
+BASIC_LINEAR_RESPONSES = [
+    "Thought: I need to write the code\n"
+    "Action: Write code to file\n"
+    "Action Input: add.py\ndef add(x, y):\n    return x + y\n",
+    "Thought: I should check the file was written\n"
+    "Action: List files\n"
+    "Action Input: .",
+    'Thought: I now know the final answer\nFinal Answer: ["add.py"]',
+]
+
+
+@dataclass
+class BenchmarkResult:
+    suite: str
+    iterations: int
+    seconds: float
+    stages: dict[str, dict[str, float]] = field(default_factory=dict)
+    peak_allocated: int = 0  # bytes allocated by Python at peak, one iteration
+    peak_rss: int = 0  # bytes, for the whole process so far
+
+    @property
+    def seconds_per_iteration(self) -> float:
+        return self.seconds / self.iterations if self.iterations else 0.0
+
+
+def _peak_rss() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def measure(
+    suite: str, iterations: int, run: Callable[[int], None], quiet: bool = True
+) -> BenchmarkResult:
+    """Times `run` over the iterations, then repeats one under tracemalloc"""
+    output = contextlib.redirect_stdout(io.StringIO()) if quiet else None
+    with output or contextlib.nullcontext():
+        # Warm up the sandbox pool, pytest service and imports
+        run(-1)
+
+        tracer = Tracer()
+        set_tracer(tracer)
+        try:
+            start = time.perf_counter()
+            for i in range(iterations):
+                with span("iteration", suite=suite):
+                    run(i)
+            seconds = time.perf_counter() - start
+        finally:
+            set_tracer(None)
+
+        # Allocation tracking slows everything down, so it is measured separately
+        tracemalloc.start()
+        try:
+            run(iterations)
+            _, peak_allocated = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    stages = summarize_trace([s.to_event() for s in tracer.spans])
+    return BenchmarkResult(
+        suite=suite,
+        iterations=iterations,
+        seconds=seconds,
+        stages=stages,
+        peak_allocated=peak_allocated,
+        peak_rss=_peak_rss(),
+    )
+
+
+def tdd_suite(workdir: Path):
+    def run(i: int):
+        llm = FakeLLM.from_env()
+        run_agent("fake", f"tdd-{i}", workdir / f"tdd_{i:04}.py", TASK, llm=llm)
+
+    return run
+
+
+def async_tdd_suite(workdir: Path, concurrency: int):
+    async def run_all(i: int):
+        llm = FakeLLM.from_env()
+        await asyncio.gather(
+            *(
+                arun_agent(
+                    "fake",
+                    f"async-{i}-{j}",
+                    workdir / f"async_{i:04}_{j}.py",
+                    TASK,
+                    llm=llm,
+                )
+                for j in range(concurrency)
+            )
+        )
+
+    return lambda i: asyncio.run(run_all(i))
+
+
+def basic_linear_suite(workdir: Path, latency: float):
+    config = PromptToCodeConfig()
+    config.output_directory = workdir / "basic_linear"
+    logger = logging.getLogger("agent_benchmark")
+    tools = [
+        write_to_file_tool(config=config, logger=logger),
+        list_file_tool(config=config, logger=logger),
+        read_file_tool(config=config, logger=logger),
+    ]
+
+    def run(i: int):
+        llm = FakeLLM(responses=BASIC_LINEAR_RESPONSES, latency=latency)
+        executor = build_agent_executor(llm, tools, verbose=False)
+        executor.run("write a python function that adds two numbers")
+
+    return run
+
+
+def human_eval_suite(workdir: Path, problems: int, workers: int):
+    from human_eval_script import run_human_eval
+
+    tasks = {
+        f"HumanEval/{i}": {"task_id": f"HumanEval/{i}", "prompt": TASK}
+        for i in range(problems)
+    }
+
+    def run(i: int):
+        run_human_eval(
+            agent="fake",
+            outdir=workdir / f"human_eval_{i}",
+            workers=workers,
+            problems=tasks,
+        )
+
+    return run
+
+
+def format_result(result: BenchmarkResult) -> str:
+    lines = [
+        f"{result.suite}: {result.iterations} iterations in {result.seconds:.3f}s "
+        f"({result.seconds_per_iteration:.3f}s each), "
+        f"peak allocated {result.peak_allocated / 2**20:.1f} MiB, "
+        f"peak RSS {result.peak_rss / 2**20:.1f} MiB",
+        f"    {'stage':<24} {'calls':>6} {'seconds':>9} {'per call':>9}",
+    ]
+    for name, total in sorted(result.stages.items(), key=lambda x: -x[1]["seconds"]):
+        per_call = total["seconds"] / total["calls"]
+        lines.append(
+            f"    {name:<24} {total['calls']:>6} {total['seconds']:>9.3f} {per_call:>9.4f}"
+        )
+    return "\n".join(lines)
+
+
+app = Typer(name="Prompt-to-code: Agent Benchmark")
+
+
+@app.command()
+def benchmark(
+    suite: list[str] = Option(SUITES, help=f"One or more of {SUITES}"),
+    iterations: int = 3,
+    latency: float = 0.0,
+    transcripts: str = None,
+    concurrency: int = 4,
+    problems: int = 4,
+    workers: int = 1,
+    output: str = None,
+    verbose: bool = False,
+):
+    unknown = set(suite) - set(SUITES)
+    if unknown:
+        raise ValueError(f"Unknown suites: {unknown}")
+
+    # Read by FakeLLM.from_env, also in the HumanEval worker processes
+    os.environ["P2C_FAKE_LLM_LATENCY"] = str(latency)
+    if transcripts:
+        os.environ["P2C_FAKE_LLM_TRANSCRIPTS"] = str(Path(transcripts).resolve())
+
+    cwd = os.getcwd()
+    results = []
+    with tempfile.TemporaryDirectory(prefix="p2c-benchmark-") as tmpdir:
+        # Agents write their files, transcripts and logs relative to the working directory
+        os.chdir(tmpdir)
+        try:
+            workdir = Path(tmpdir)
+            runners = {
+                "tdd": lambda: tdd_suite(workdir),
+                "async-tdd": lambda: async_tdd_suite(workdir, concurrency),
+                "basic-linear": lambda: basic_linear_suite(workdir, latency),
+                "human-eval": lambda: human_eval_suite(workdir, problems, workers),
+            }
+            for name in suite:
+                result = measure(name, iterations, runners[name](), quiet=not verbose)
+                print(format_result(result))
+                results.append(result)
+        finally:
+            os.chdir(cwd)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump([asdict(r) for r in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    app()
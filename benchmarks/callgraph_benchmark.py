@@ -0,0 +1,117 @@
+"""Scale benchmark of the project-wide `CallGraph` on a generated codebase
+
+Generates `modules` files of `functions` functions, each calling functions imported
+from other modules, then reports the cold build time, the time to update one file,
+query latency and the memory of the graph next to the same edges in a networkx
+DiGraph.
+
+    python benchmarks/callgraph_benchmark.py --modules 1000 --functions 100
+"""
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import networkx as nx
+from typer import Typer
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from prompt_to_code.callgraph import CallGraph  # noqa: E402
+
+
+def generate(root: Path, modules: int, functions: int, calls: int, seed: int = 0):
+    rng = random.Random(seed)
+    (root / "gen").mkdir()
+    (root / "gen" / "__init__.py").write_text("")
+    for m in range(modules):
+        imported = rng.sample(range(modules), min(4, modules))
+        lines = [f"from gen import m{i}" for i in imported]
+        for f in range(functions):
+            lines.append(f"\n\ndef f{f}(x):")
+            for _ in range(calls):
+                lines.append(
+                    f"    m{rng.choice(imported)}.f{rng.randrange(functions)}(x)"
+                )
+        (root / "gen" / f"m{m}.py").write_text("\n".join(lines) + "\n")
+
+
+def _traced(func):
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+app = Typer(name="Prompt-to-code: Call Graph Benchmark")
+
+
+@app.command()
+def benchmark(
+    modules: int = 200, functions: int = 50, calls: int = 3, workers: int = None
+):
+    with tempfile.TemporaryDirectory(prefix="p2c-callgraph-") as tmpdir:
+        root = Path(tmpdir)
+        generate(root, modules, functions, calls)
+
+        graph = CallGraph(root, workers=workers)
+        start = time.perf_counter()
+        graph.update()
+        _ = graph.csr
+        build = time.perf_counter() - start
+        forward, reverse = graph.csr
+        array_bytes = sum(a.nbytes for a in (*forward, *reverse))
+        print(
+            f"{modules * functions} functions, {graph.number_of_nodes()} nodes, "
+            f"{graph.number_of_edges()} edges: built in {build:.2f}s, "
+            f"CSR arrays {array_bytes / 2**20:.1f} MiB"
+        )
+        # Everything the graph keeps, including the per-file imports and calls
+        _, _, peak = _traced(lambda: CallGraph(root, workers=1).update())
+        print(f"Peak allocated while building in-process: {peak / 2**20:.1f} MiB")
+
+        changed = root / "gen" / "m0.py"
+        changed.write_text(changed.read_text() + "\n\ndef extra():\n    f0(1)\n")
+        start = time.perf_counter()
+        graph.update([changed])
+        _ = graph.csr
+        print(f"One file updated in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+        names = graph.names[:: max(1, len(graph.names) // 1000)]
+        start = time.perf_counter()
+        for name in names:
+            graph.callers(name, k=10)
+        per_query = (time.perf_counter() - start) / len(names)
+        print(f"Top-10 callers in {per_query * 1e6:.1f}us per query")
+
+        forward, _reverse = graph.csr
+        edges = [
+            (graph.names[s], graph.names[d], int(w))
+            for s in range(graph.number_of_nodes())
+            for d, w in zip(
+                forward[1][forward[0][s] : forward[0][s + 1]],
+                forward[2][forward[0][s] : forward[0][s + 1]],
+            )
+        ]
+
+        def build_networkx():
+            G = nx.DiGraph()
+            G.add_weighted_edges_from(edges)
+            return G
+
+        _G, seconds, peak = _traced(build_networkx)
+        print(
+            f"networkx DiGraph of the same edges: {seconds:.2f}s, "
+            f"{peak / 2**20:.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    app()
@@ -0,0 +1,111 @@
+"""Micro-benchmark of `extract_function_definitions` on large real-world modules
+
+Reports the cold (uncached) and warm (cached) cost of analysing standard library
+modules, and the cold cost per line as a module is repeated to grow its size, which
+should stay flat.
+
+    python benchmarks/parser_benchmark.py --repeat 20
+"""
+import importlib
+import inspect
+import json
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+from typer import Typer
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from prompt_to_code.parsers import (  # noqa: E402
+    clear_cache,
+    extract_function_definitions,
+)
+
+MODULES = ["argparse", "inspect", "typing", "pathlib", "email.message", "ast"]
+
+
+@dataclass
+class ParserResult:
+    module: str
+    lines: int
+    functions: int
+    edges: int
+    cold_ms: float
+    warm_us: float
+
+    @property
+    def cold_us_per_line(self) -> float:
+        return self.cold_ms * 1000 / self.lines
+
+
+def _time(func, repeat: int) -> float:
+    """The median seconds of `repeat` calls"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def measure(module: str, content: str, repeat: int) -> ParserResult:
+    def cold():
+        clear_cache()
+        return extract_function_definitions(content, filename=module)
+
+    functions, G = cold()
+    cold_seconds = _time(cold, repeat)
+    warm_seconds = _time(
+        lambda: extract_function_definitions(content, filename=module), repeat
+    )
+    return ParserResult(
+        module=module,
+        lines=content.count("\n") + 1,
+        functions=len(functions),
+        edges=G.number_of_edges(),
+        cold_ms=cold_seconds * 1000,
+        warm_us=warm_seconds * 1e6,
+    )
+
+
+def format_results(results: list[ParserResult]) -> str:
+    lines = [
+        f"{'module':<28} {'lines':>7} {'functions':>9} {'edges':>7} "
+        f"{'cold ms':>9} {'us/line':>8} {'warm us':>9}"
+    ]
+    for r in results:
+        lines.append(
+            f"{r.module:<28} {r.lines:>7} {r.functions:>9} {r.edges:>7} "
+            f"{r.cold_ms:>9.2f} {r.cold_us_per_line:>8.2f} {r.warm_us:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+app = Typer(name="Prompt-to-code: Parser Benchmark")
+
+
+@app.command()
+def benchmark(repeat: int = 10, scale: int = 8, output: str = None):
+    results = []
+    for name in MODULES:
+        content = inspect.getsource(importlib.import_module(name))
+        results.append(measure(name, content, repeat))
+
+    # The same module repeated, to check that the cost per line does not grow
+    content = inspect.getsource(importlib.import_module(MODULES[0]))
+    size = 1
+    while size <= scale:
+        results.append(measure(f"{MODULES[0]} x{size}", content * size, repeat))
+        size *= 2
+
+    print(format_results(results))
+    if output:
+        with open(output, "w") as f:
+            json.dump([asdict(r) for r in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    app()
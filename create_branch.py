@@ -1,51 +1,60 @@
 import re
+from pathlib import Path
 
 import requests
 
-from prompt_to_code.tools.execution import run_shell_command
+from prompt_to_code.tools.file_writer import forget_written, written_files
+from prompt_to_code.tools.git import GitRepository
 
 
 class GitBranchCRUD:
-    def __init__(self):
-        pass
+    def __init__(self, cwd: Path | str | None = None):
+        # The working tree the commands run in, the current directory if None
+        self.cwd = cwd
+        self.repo = GitRepository(cwd)
 
     def create_branch(self, branch_name: str | None):
-        # Check if in a git repo
-        run_shell_command("git rev-parse --is-inside-work-tree")
-
         # Check if branch name is valid and provided
         if not branch_name:
             raise RuntimeError("Branch name is required")
         if not re.match(r"^(?!\.)[a-zA-Z0-9\-\._]+(?<!\.)$", branch_name):
             raise RuntimeError("Invalid branch name")
 
-        (status, failed) = run_shell_command("git status --porcelain")
-        if status or failed:
+        # Check if in a git repo and if uncommitted changes exist, in one status
+        status = self.repo.status()
+        if not status.inside:
+            raise RuntimeError("Not in a git repository")
+        if status.dirty:
             raise RuntimeError(
                 "You have uncommitted changes. Commit or stash your changes before creating a new branch"
             )
 
         # Check if branch exists
-        branches, failed = run_shell_command("git branch --list")
-        if branch_name in branches.split("\n"):
+        if branch_name in self.repo.branches():
             raise RuntimeError(f"Branch {branch_name} already exists")
 
         # Check out branch
-        run_shell_command(f"git checkout -b {branch_name}")
+        self.repo.create_branch(branch_name)
         print(f"Switched to a new branch: {branch_name}")
 
-    def commit_changes(self, commit_message: str):
+    def commit_changes(
+        self, commit_message: str, paths: list[Path | str] | None = None
+    ):
+        """Commits paths, by default the files the agents wrote here
+
+        When no written files were recorded every change in the directory is
+        committed.
+        """
         if not commit_message:
             raise RuntimeError("Commit message is required")
 
-        # Check if uncommitted changes exist
-        status, failed = run_shell_command("git status --porcelain")
-        if not status:
-            raise RuntimeError("No changes to commit")
-
-        # Add changes and create a commit
-        run_shell_command("git add .")
-        run_shell_command(f'git commit -m "{commit_message}"')
+        root = Path(self.cwd or ".")
+        if paths is None:
+            paths = written_files(root) or None
+        # Raises if there are no changes to commit
+        self.repo.commit(commit_message, paths)
+        if paths is not None:
+            forget_written(root, paths)
         print(f"Changes committed with message: {commit_message}")
 
     def create_pull_request(
@@ -68,10 +77,8 @@ class GitBranchCRUD:
             raise RuntimeError("Missing required information to create a pull request")
 
         # Check if the branches exist
-        branches, failed = run_shell_command("git branch --list")
-        if base_branch not in branches.split("\n") or head_branch not in branches.split(
-            "\n"
-        ):
+        branches = self.repo.branches()
+        if base_branch not in branches or head_branch not in branches:
             raise RuntimeError("One or both branches do not exist")
 
         # Create a pull request using GitHub API
@@ -6,12 +6,28 @@ Paper: https://arxiv.org/pdf/2107.03374.pdf
 
 import glob
 import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 import tqdm
 from typer import Typer
 
-from prompt_to_code.agents.agents import run_agent
+from prompt_to_code.agents.agents import (
+    DEFAULT_SHARE_STAGES,
+    SHARE_STAGES,
+    run_agent,
+    run_agent_samples,
+)
+from prompt_to_code.agents.cache import CacheStats, get_default_cache
+from prompt_to_code.agents.journal import RunJournal
+from prompt_to_code.agents.metering import (
+    format_summary,
+    get_meter,
+    read_ledger,
+    summarize,
+)
 from prompt_to_code.config import PromptToCodeConfig
 
 # requires human-eval is installed
@@ -20,6 +36,13 @@ try:
     from human_eval.data import HUMAN_EVAL, read_problems
     from human_eval.evaluation import evaluate_functional_correctness
 except ImportError:
+    # Only needed for the dataset and scoring, not for running given problems
+    HUMAN_EVAL = read_problems = evaluate_functional_correctness = None
+
+
+def _require_human_eval():
+    if read_problems is not None:
+        return
     print("=" * 80)
     print("Install human-eval from: https://github.com/openai/human-eval")
     print("$ git clone https://github.com/openai/human-eval")
@@ -30,28 +53,208 @@ except ImportError:
     raise ImportError("human-eval required")
 
 
+def _iter_jobs(
+    problem_names: list[str],
+    num_samples_per_task: int,
+    start_question: int = 0,
+    start_ittr: int = 0,
+):
+    """Yields the (question index, task id, sample index) triplets still to be run"""
+    for i, example_id in enumerate(problem_names):
+        if i < start_question:
+            continue
+        for loop_cnt in range(start_ittr, num_samples_per_task):
+            yield i, example_id, loop_cnt
+
+
+def _cache_stats() -> CacheStats:
+    cache = get_default_cache()
+    return CacheStats() + cache.stats if cache is not None else CacheStats()
+
+
+def _run_sample(agent, name, filename, prompt, journal: RunJournal, sample: int):
+    """Runs one sample, resuming after the steps the journal has for it"""
+    _test_results, failed = run_agent(
+        agent, name, filename, prompt, store=journal.store(name, sample)
+    )
+    journal.mark_complete(name, sample, failed)
+
+
+def _run_samples(agent, name, filenames, prompt, journal, samples, share):
+    """Runs the samples of a task together, sharing the steps chosen by share"""
+    results = run_agent_samples(
+        agent, name, filenames, prompt, share=share, store=journal.shared_store(name)
+    )
+    for sample, (_test_results, failed) in zip(samples, results):
+        journal.mark_complete(name, sample, failed)
+
+
+def _run_job(run, *args) -> CacheStats:
+    """Runs one job in a worker process and returns its cache usage"""
+    before = _cache_stats()
+    run(*args)
+    return _cache_stats() - before
+
+
+def _update_throughput(ittr, started: float, completed: int):
+    elapsed = time.time() - started
+    if elapsed > 0:
+        ittr.set_postfix(tasks_per_min=f"{completed * 60 / elapsed:.2f}")
+
+
+def _plan_jobs(
+    problems: dict[str, dict],
+    num_samples_per_task: int,
+    start_question: int,
+    start_ittr: int,
+    journal: RunJournal,
+    share: str,
+) -> tuple[list[tuple], int]:
+    """The (question index, task id, samples, samples to run) of each job, and the
+    number of samples still to run
+
+    Each job is a task's samples to run together, sharing some steps, or a single one.
+    """
+    tasks = {}
+    for i, example_id, loop_cnt in _iter_jobs(
+        sorted(problems.keys()), num_samples_per_task, start_question, start_ittr
+    ):
+        tasks.setdefault((i, example_id), []).append(loop_cnt)
+    jobs = []
+    pending = 0
+    for (i, example_id), samples in tasks.items():
+        task_id = problems[example_id]["task_id"]
+        todo = [s for s in samples if not journal.is_complete(task_id, s)]
+        pending += len(todo)
+        if share != "none" and len(samples) > 1:
+            # Completed samples are loaded from the shared steps
+            if todo:
+                jobs.append((i, example_id, samples, len(todo)))
+        else:
+            jobs += [(i, example_id, [sample], 1) for sample in todo]
+    return jobs, pending
+
+
+def _job(
+    agent, example: dict, i: int, samples: list[int], outdir: Path, journal, share
+):
+    """The function running a job and its arguments, to run here or in a worker"""
+    filenames = [outdir / f"human_eval_{i:04}_{s:04}.py" for s in samples]
+    if len(samples) > 1:
+        return (
+            _run_samples,
+            agent,
+            example["task_id"],
+            filenames,
+            example["prompt"],
+            journal,
+            samples,
+            share,
+        )
+    return (
+        _run_sample,
+        agent,
+        example["task_id"],
+        filenames[0],
+        example["prompt"],
+        journal,
+        samples[0],
+    )
+
+
 def run_human_eval(
     agent="tdd",
     outdir: Path | str = "./examples/human_eval",
     num_samples_per_task=1,
     start_question: int = 0,
     start_ittr: int = 0,
+    workers: int = 1,
+    cache: Path | str | None = None,
+    cache_sampled: bool = False,
+    ledger: Path | str | None = None,
+    trace: Path | str | None = None,
+    problems: dict[str, dict] | None = None,
+    journal: Path | str | None = None,
+    share: str = DEFAULT_SHARE_STAGES,
 ):
-    problems = read_problems(HUMAN_EVAL)
+    """Runs the agent on every HumanEval problem, or on `problems` keyed by task id
+
+    The steps finished for every sample are kept in `journal` (`.journal` in
+    outdir by default), so a restarted run skips the completed samples and resumes
+    the others after their last finished step.  With several samples per task and
+    `share` "stub" or "red", the samples of a task run together: its stub (and with
+    "red" its tests) are written once and only the code is sampled again.
+    """
+    if share not in SHARE_STAGES:
+        raise ValueError(f"share must be one of {SHARE_STAGES}, not {share}")
+    if trace is not None:
+        os.environ["P2C_TRACE_FILE"] = str(trace)
+    if ledger is not None:
+        os.environ["P2C_USAGE_LEDGER"] = str(ledger)
+    # Every worker process tags its usage with the same run id
+    os.environ["P2C_RUN_ID"] = get_meter().run_id
+
+    if cache is not None:
+        # Set through the environment so that worker processes open their own connection
+        os.environ["P2C_LLM_CACHE"] = str(cache)
+        if cache_sampled:
+            os.environ["P2C_LLM_CACHE_SAMPLED"] = "1"
+
+    if problems is None:
+        _require_human_eval()
+        problems = read_problems(HUMAN_EVAL)
     outdir = Path(outdir)
+    journal = RunJournal(journal if journal is not None else outdir / ".journal")
+    jobs, pending = _plan_jobs(
+        problems, num_samples_per_task, start_question, start_ittr, journal, share
+    )
+    resumed = journal.summary()
+    if resumed.complete or resumed.in_progress:
+        print(f"Resuming from {journal.root}: {resumed}")
     ittr = tqdm.tqdm(total=len(problems) * num_samples_per_task)
-    problem_names = sorted(problems.keys())
-    for i, example_id in enumerate(problem_names):
-        if i < start_question:
-            ittr.update(num_samples_per_task - start_ittr)
-            continue
-        example = problems[example_id]
-        for loop_cnt in range(start_ittr, num_samples_per_task):
-            filename = outdir / f"human_eval_{i:04}_{loop_cnt:04}.py"
-            name = example["task_id"]
-            prompt = example["prompt"]
-            run_agent(agent, name, filename, prompt)
-            ittr.update(1)
+    ittr.update(len(problems) * num_samples_per_task - pending)
+
+    def job(i, example_id, samples):
+        return _job(agent, problems[example_id], i, samples, outdir, journal, share)
+
+    started = time.time()
+    completed = 0
+    if workers <= 1:
+        for i, example_id, samples, count in jobs:
+            run, *args = job(i, example_id, samples)
+            run(*args)
+            completed += count
+            ittr.update(count)
+            _update_throughput(ittr, started, completed)
+        if cache is not None:
+            print(_cache_stats())
+        print(get_meter().report(by="step"))
+        return
+
+    # Each (task, sample) pair writes to its own file, so they can run in parallel.
+    # Each worker process gets its own LLM cache connection and sandbox pool
+    cache_stats = CacheStats()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_run_job, *job(i, example_id, samples)): (i, samples, count)
+            for i, example_id, samples, count in jobs
+        }
+        for future in as_completed(futures):
+            i, samples, count = futures[future]
+            try:
+                cache_stats += future.result()
+            except Exception as e:
+                print(f"Question {i} samples {samples} failed: {e}")
+            completed += count
+            ittr.update(count)
+            _update_throughput(ittr, started, completed)
+    if cache is not None:
+        print(cache_stats)
+    ledger = os.environ.get("P2C_USAGE_LEDGER")
+    if ledger and Path(ledger).exists():
+        run_id = os.environ["P2C_RUN_ID"]
+        records = [r for r in read_ledger(ledger) if r.run_id == run_id]
+        print(format_summary(summarize(records, by="step"), by="step"))
 
 
 def aggregate_outputs(outdir: Path | str = "./examples/human_eval"):
@@ -73,6 +276,7 @@ def aggregate_outputs(outdir: Path | str = "./examples/human_eval"):
         for problem in results:
             f.write(json.dumps(problem) + "\n")
 
+    _require_human_eval()
     problems = read_problems(HUMAN_EVAL)
     with open(outdir / "human_eval_problems.jsonl", "w") as f:
         for problem in problems.values():
@@ -91,6 +295,7 @@ def eval_tests(
     outdir = Path(outdir)
     sample_file = outdir / "human_eval_samples.jsonl"
     problem_file = outdir / "human_eval_problems.jsonl"
+    _require_human_eval()
     return evaluate_functional_correctness(
         str(sample_file), k, n_workers, timeout, str(problem_file)
     )
@@ -122,6 +327,13 @@ def human_eval(
     just_score: bool = False,
     start_question: int = 0,
     start_ittr: int = 0,
+    workers: int = 1,
+    cache: str = None,
+    cache_sampled: bool = False,
+    ledger: str = None,
+    trace: str = None,
+    journal: str = None,
+    share: str = DEFAULT_SHARE_STAGES,
 ):
     PromptToCodeConfig()
     outdir = Path(outdir_root) / f"./human_eval_{agent}"
@@ -136,6 +348,13 @@ def human_eval(
             num_samples_per_task=num_samples_per_task,
             start_question=start_question,
             start_ittr=start_ittr,
+            workers=workers,
+            cache=cache,
+            cache_sampled=cache_sampled,
+            ledger=ledger,
+            trace=trace,
+            journal=journal,
+            share=share,
         )
     score(num_samples_per_task=num_samples_per_task, outdir=outdir)
 
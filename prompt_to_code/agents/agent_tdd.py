@@ -1,6 +1,6 @@
-from langchain.chat_models import ChatOpenAI
 from statemachine import State, StateMachine
 
+from prompt_to_code.agents.clients import get_client
 from prompt_to_code.agents.models import TaskDefinition
 
 
@@ -33,14 +33,18 @@ class PromptState(State):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        default_llm = {
+        self.llm_config = {
             "temperature": 0.7,
             "model": "gpt-4",
             "max_tokens": 3000,
             "request_timeout": 180,
         }
-        default_llm |= kwargs.get("llm", {})
-        self.llm = ChatOpenAI(**default_llm)
+        self.llm_config |= kwargs.get("llm", {})
+
+    @property
+    def llm(self):
+        # States are created with the class, their client only when first used
+        return get_client(**self.llm_config)
 
 
 def create_branch(self, branch_name: str = ""):
@@ -4,14 +4,20 @@ Dataset from: https://github.com/openai/human-eval/tree/master
 Paper: https://arxiv.org/pdf/2107.03374.pdf
 """
 
+import os
 import re
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
+from dataclasses import dataclass
 from pathlib import Path
 
-from langchain.chat_models import ChatOpenAI
-from langchain.llms.openai import OpenAI
-
-from create_branch import run_shell_command
+from prompt_to_code.agents.cache import LLMCache, get_default_cache
+from prompt_to_code.agents.clients import get_client
+from prompt_to_code.agents.context import ContextPacker, Piece, summarize_test_output
+from prompt_to_code.agents.metering import UsageRecord, get_meter
+from prompt_to_code.agents.models import AvailableMethods
 from prompt_to_code.agents.prompts import (
     ERROR_PROMPT,
     FUNCTION_MENTION,
@@ -20,8 +26,68 @@ from prompt_to_code.agents.prompts import (
     RED_STEP_PROMPT,
     STUB_STEP_PROMPT,
 )
+from prompt_to_code.agents.streaming import (
+    CodeBlockExtractor,
+    StreamCancelled,
+    StreamResult,
+    stream_llm,
+)
+from prompt_to_code.agents.transcripts import (
+    flush_transcripts,
+    get_transcript_store,
+    transcript_from_usage,
+)
+from prompt_to_code.agents.workflow import Node, NodeStore, Workflow
+from prompt_to_code.callgraph import CallGraph, get_default_callgraph
+from prompt_to_code.embeddings import rank_functions
+from prompt_to_code.indexer import FunctionIndex, get_default_index
 from prompt_to_code.parsers import extract_function_definitions
-from prompt_to_code.tools.execution import run_code
+from prompt_to_code.tools.execution import run_code, run_shell_command
+from prompt_to_code.tools.file_writer import forget_written, record_written
+from prompt_to_code.tools.git import NothingToCommit
+from prompt_to_code.tools.sandbox import get_default_pool
+from prompt_to_code.tools.test_runner import run_pytest
+from prompt_to_code.tracing import current_span, span, traced
+
+# How run_and_fix searches for a fix, see `run_and_fix`
+FIX_STRATEGIES = ("sequential", "parallel-k", "race")
+DEFAULT_FIX_STRATEGY = os.environ.get("P2C_FIX_STRATEGY", "sequential")
+DEFAULT_FIX_CANDIDATES = int(os.environ.get("P2C_FIX_CANDIDATES", 3))
+# Stream completions and stop them once the code block is closed
+DEFAULT_STREAM = bool(os.environ.get("P2C_STREAM", ""))
+# The most functions listed in a prompt, the most relevant to the task first
+DEFAULT_CONTEXT_TOP_K = int(os.environ.get("P2C_CONTEXT_TOP_K", 10))
+# The most callers and callees listed with each of those functions
+USAGES_PER_FUNCTION = 5
+# Saves the results of every TDD step, so that runs resume (disabled when unset)
+DEFAULT_WORKFLOW_DIR = os.environ.get("P2C_WORKFLOW_DIR")
+# The steps samples of a task share: none, the stub, or the stub and tests (red)
+SHARE_STAGES = ("none", "stub", "red")
+DEFAULT_SHARE_STAGES = os.environ.get("P2C_SHARE_STAGES", "none")
+
+
+@dataclass
+class FixMetrics:
+    """Counts of fix candidates requested from the LLM and how many went unused"""
+
+    rounds: int = 0
+    candidates: int = 0
+    validated: int = 0
+    wasted: int = 0
+    # Unused candidates whose request was closed mid-stream, their prompt and the
+    # tokens streamed before the cancel are still billed
+    cancelled: int = 0
+
+    def __str__(self):
+        return (
+            f"Fixes: {self.rounds} rounds, {self.candidates} candidates, "
+            f"{self.validated} validated, {self.wasted} wasted "
+            f"({self.cancelled} cancelled mid-stream)"
+        )
+
+
+# Totals for this process
+fix_metrics = FixMetrics()
 
 
 def extract_code_from_response(code) -> str:
@@ -33,78 +99,594 @@ def extract_code_from_response(code) -> str:
     return code.strip()
 
 
-def call_llm(llm, prompt, prefix="any", log_dir="./logs"):
-    token_length = llm.get_num_tokens(prompt)
+@traced(attributes=("prefix", "task", "step"))
+def call_llm(
+    llm,
+    prompt,
+    prefix="any",
+    log_dir: str | None = None,
+    cache: LLMCache | None = None,
+    use_cache: bool = True,
+    task: str | None = None,
+    step: str | None = None,
+    stream: bool | None = None,
+    cancel: threading.Event | None = None,
+):
+    """Completes prompt, from the cache when possible
+
+    Setting `cancel` stops the request at its next streamed chunk and raises
+    `StreamCancelled`, the tokens used until then are still metered.
+    """
+    if not use_cache:
+        cache = None
+    elif cache is None:
+        cache = get_default_cache()
+    if stream is None:
+        # Only a streamed request can be stopped before it completes
+        stream = DEFAULT_STREAM or cancel is not None
+
     cur_time = time.time()
-    if hasattr(llm, "call_as_llm"):
+    result = cached_completion(llm, prompt, prefix, log_dir, cache, task, step)
+    if result is not None:
+        return result
+
+    streamed = None
+    if stream:
+        extractor = CodeBlockExtractor.for_prompt(prompt)
+        try:
+            streamed = stream_llm(llm, prompt, extractor, cancel)
+        except StreamCancelled as e:
+            record_cancelled(
+                llm, prompt, e.partial, cur_time, prefix, log_dir, task, step
+            )
+            raise
+        result = streamed.text
+    elif hasattr(llm, "call_as_llm"):
         result = llm.call_as_llm(prompt)
     else:
         result = llm(prompt)
-    duration = time.time() - cur_time
-
-    fname = Path(log_dir) / f"{prefix}-{round(cur_time*1000)}.log"
-    if not fname.parent.exists():
-        fname.parent.mkdir(parents=True, exist_ok=True)
-    with open(fname, "w") as f:
-        f.write(prompt)
-        f.write("\n\n" + "=" * 80 + "\n\n")
-        f.write(result)
-    cost = token_length * 0.06 / 1000
-    print(f"\tLLM {token_length} tokens, {duration:1f} seconds, ${cost:04f} - {fname}")
+    record_completion(
+        llm, prompt, result, cur_time, prefix, log_dir, cache, task, step, streamed
+    )
+    return result
+
+
+def cached_completion(llm, prompt, prefix, log_dir, cache, task, step) -> str | None:
+    """The cached completion of prompt, metered and logged as a cache hit"""
+    result = cache.get(llm, prompt) if cache is not None else None
+    if result is not None:
+        usage = get_meter().record(
+            llm, prompt, result, 0.0, task=task, step=step, cached=True
+        )
+        current_span().set(model=usage.model, cached=True)
+        log_llm_call(prompt, result, prefix, log_dir, usage)
     return result
 
 
-def run_agent(agent, name, filename, task: str, request_timeout=180):
+def record_completion(
+    llm,
+    prompt,
+    result,
+    started: float,
+    prefix,
+    log_dir,
+    cache,
+    task,
+    step,
+    streamed: StreamResult | None = None,
+):
+    """Caches, meters and logs a completion requested at started"""
+    duration = time.time() - started
+    if cache is not None:
+        cache.put(llm, prompt, result)
+
+    first_token = None
+    if streamed is not None:
+        first_token = streamed.first_token
+        current_span().set(
+            first_token=first_token, stopped_early=streamed.stopped_early
+        )
+    usage = get_meter().record(
+        llm, prompt, result, duration, task=task, step=step, first_token=first_token
+    )
+    current_span().set(
+        model=usage.model,
+        prompt_tokens=usage.prompt_tokens,
+        completion_tokens=usage.completion_tokens,
+    )
+    log_llm_call(prompt, result, prefix, log_dir, usage)
+
+
+def record_cancelled(
+    llm,
+    prompt,
+    partial: StreamResult | None,
+    started: float,
+    prefix,
+    log_dir,
+    task,
+    step,
+):
+    """Meters and logs the tokens a cancelled request streamed before it stopped"""
+    current_span().set(cancelled=True)
+    if partial is not None:
+        usage = get_meter().record(
+            llm,
+            prompt,
+            partial.text,
+            time.time() - started,
+            task=task,
+            step=step,
+            first_token=partial.first_token,
+        )
+        log_llm_call(prompt, partial.text, f"{prefix}-cancelled", log_dir, usage)
+
+
+def log_llm_call(prompt, result, prefix, log_dir, usage: UsageRecord):
+    """Queues the transcript of a call for the run's transcript store"""
+    store = get_transcript_store(log_dir)
+    store.append(transcript_from_usage(usage, prefix, prompt, result))
+    if usage.cached:
+        print(f"\tLLM cache hit {usage.prompt_tokens} tokens")
+        return
+    first_token = ""
+    if usage.first_token is not None:
+        first_token = f" (first token {usage.first_token:.2f}s)"
+    print(
+        f"\tLLM {usage.prompt_tokens}+{usage.completion_tokens} tokens, "
+        f"{usage.duration:1f} seconds{first_token}, ${usage.cost:04f} - {prefix}"
+    )
+
+
+def build_llm(agent: str, request_timeout=180):
+    """Creates the LLM used by the TDD steps for the given agent name"""
     default_llm = {
         "temperature": 0.2,
         "max_tokens": 2000,
         "request_timeout": request_timeout,
     }
-    Model = OpenAI
+    chat = False
+    if agent == "fake":
+        # Offline and deterministic, for measuring the agent's own overhead
+        from prompt_to_code.agents.fake_llm import FakeLLM
+
+        return FakeLLM.from_env()
     if agent == "tdd3":
-        Model = ChatOpenAI
+        chat = True
         default_llm["model_name"] = "gpt-3.5-turbo"
     elif agent in ["tdd", "tdd-chat", "tdd4"]:
-        Model = ChatOpenAI
+        chat = True
         default_llm["model_name"] = "gpt-4"
     elif agent.startswith("tdd-"):
         default_llm["model_name"] = "-".join(agent.split("-")[1:])
     else:
         raise NotImplementedError(f"Agent {agent} not implemented")
 
-    llm = Model(**default_llm)
+    return get_client(chat=chat, **default_llm)
+
+
+@traced(attributes=("agent", "name"))
+def run_agent(
+    agent,
+    name,
+    filename,
+    task: str,
+    request_timeout=180,
+    llm=None,
+    workspace=None,
+    store: NodeStore | None = None,
+):
+    """Runs the TDD workflow for task, writing its code to filename
+
+    With a `workspace` (see `prompt_to_code.workspaces`) filename is relative to
+    the task's worktree, where the code and tests are committed on its branch.  With
+    a `store` (by default under P2C_WORKFLOW_DIR when set) each step's results are
+    saved, and running the task again resumes after the last finished step.
+    """
+    if llm is None:
+        llm = build_llm(agent, request_timeout=request_timeout)
     print(f"Running {agent}: {name} {llm}")
+    if workspace is not None:
+        filename = Path(workspace.path) / filename
+    if store is None and DEFAULT_WORKFLOW_DIR:
+        store = NodeStore(workflow_directory(DEFAULT_WORKFLOW_DIR, name, filename))
 
-    # Run the steps
-    _stub_code, functions_section = stub_step(filename, task, llm, name=name)
-    test_code, test_results = red_step(
-        filename, task, llm, functions_section, name=name
-    )
-    test_results, failed = green_step(
-        filename, task, llm, functions_section, test_code, test_results, name=name
-    )
+    workflow = build_tdd_workflow(filename, llm, name, workspace=workspace, store=store)
+    values = workflow.run(task=task)
+    test_results, failed = values["test_results"], values["failed"]
     # TODO: REFACTOR STEP
     print(test_results, failed)
+    if fix_metrics.candidates:
+        print(fix_metrics)
+    print(get_meter().report(by="step", task=name))
+    if any(result.loaded for result in workflow.results.values()):
+        print(workflow.report())
+    # Worker processes may exit without running atexit handlers
+    flush_transcripts()
+    return test_results, failed
+
+
+@traced(attributes=("agent", "name"))
+def run_agent_samples(
+    agent,
+    name,
+    filenames: list[Path],
+    task: str,
+    share: str = DEFAULT_SHARE_STAGES,
+    request_timeout=180,
+    llm=None,
+    store: NodeStore | None = None,
+) -> list[tuple[str, bool]]:
+    """Runs the TDD workflow for several samples of task, one per filename
 
+    The samples share the stages chosen by `share` (see `build_tdd_workflow`), which
+    run once, and then write their code concurrently.  Returns the (test_results,
+    failed) of every sample, in the order of filenames.
+    """
+    if llm is None:
+        llm = build_llm(agent, request_timeout=request_timeout)
+    print(f"Running {agent}: {name} {llm}, {len(filenames)} samples sharing {share}")
+    first, *samples = [Path(filename) for filename in filenames]
+    if store is None and DEFAULT_WORKFLOW_DIR:
+        store = NodeStore(workflow_directory(DEFAULT_WORKFLOW_DIR, name, first))
+
+    workflow = build_tdd_workflow(
+        first, llm, name, store=store, samples=samples, share=share
+    )
+    values = workflow.run(task=task)
+    suffixes = [""] + [f"_{i}" for i in range(1, len(filenames))]
+    results = [(values["test_results" + s], values["failed" + s]) for s in suffixes]
+    print(get_meter().report(by="step", task=name))
+    if any(result.loaded for result in workflow.results.values()):
+        print(workflow.report())
+    flush_transcripts()
+    return results
+
+
+def workflow_directory(root: Path | str, name: str, filename: Path) -> Path:
+    """Where the steps of task name writing filename are saved"""
+    return Path(root) / re.sub(r"[^\w.\-]+", "_", name) / Path(filename).stem
+
+
+def tdd_nodes(filename: Path, llm, name="tdd") -> dict[str, Node]:
+    """The steps of the TDD agent writing filename, by name
+
+    Each LLM completion is its own step, saved before it is fixed, so a resumed run
+    does not prompt for it again.  The tests are generated speculatively from the
+    stub's first draft while the stub is fixed, and only generated again if fixing
+    it changed its functions.
+    """
+    filename = Path(filename)
+
+    def context(task):
+        # The stub only sees the repository's functions
+        return {"context": create_function_list_for_prompts(filename, "", query=task)}
+
+    def stub_draft(task, context):
+        print("STUB STEP")
+        draft = generate_stub(filename, task, llm, name, context)
+        functions = create_function_list_for_prompts(filename, draft, query=task)
+        return {"stub_draft": draft, "draft_functions": functions}
+
+    def stub(task, context, stub_draft):
+        stub_code, functions_section = fix_stub(
+            filename, task, llm, stub_draft, name, context
+        )
+        return {"stub_code": stub_code, "functions_section": functions_section}
+
+    def red_draft(task, draft_functions):
+        print("RED STEP")
+        test_code = generate_tests(filename, task, llm, draft_functions, name=name)
+        return {"test_draft": test_code}
+
+    def red(task, test_draft, draft_functions, functions_section):
+        test_code = test_draft
+        if functions_section != draft_functions:
+            print("The stub's functions changed, generating the tests again")
+            test_code = generate_tests(filename, task, llm, functions_section, name)
+        red_results, _failed = run_red_tests(filename, test_code)
+        return {"test_code": test_code, "red_results": red_results}
+
+    def green_draft(task, functions_section, test_code, red_results):
+        print("GREEN STEP")
+        code = generate_code(
+            filename, task, llm, functions_section, test_code, red_results, name
+        )
+        return {"code_draft": code}
+
+    def green(task, functions_section, code_draft):
+        test_results, failed = fix_code(
+            filename, task, llm, code_draft, functions_section, name
+        )
+        return {
+            "code": filename.read_text(),
+            "test_results": test_results,
+            "failed": failed,
+        }
+
+    nodes = [
+        Node("context", context, ("task",), ("context",)),
+        Node(
+            "stub_draft",
+            stub_draft,
+            ("task", "context"),
+            ("stub_draft", "draft_functions"),
+        ),
+        Node(
+            "stub",
+            stub,
+            ("task", "context", "stub_draft"),
+            ("stub_code", "functions_section"),
+            restore=_save_output("stub_code", filename),
+        ),
+        Node("red_draft", red_draft, ("task", "draft_functions"), ("test_draft",)),
+        Node(
+            "red",
+            red,
+            ("task", "test_draft", "draft_functions", "functions_section"),
+            ("test_code", "red_results"),
+            restore=_save_output("test_code", get_test_filename(filename)),
+        ),
+        Node(
+            "green_draft",
+            green_draft,
+            ("task", "functions_section", "test_code", "red_results"),
+            ("code_draft",),
+        ),
+        Node(
+            "green",
+            green,
+            ("task", "functions_section", "code_draft"),
+            ("code", "test_results", "failed"),
+            restore=_save_output("code", filename),
+        ),
+    ]
+    return {node.name: node for node in nodes}
+
+
+def _save_output(key: str, path: Path):
+    def restore(outputs):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(outputs[key])
+        record_written(path)
+
+    return restore
+
+
+def _retarget(text: str, source: Path, target: Path) -> str:
+    """text of the sample writing source, for the sample writing target
+
+    Only its paths and imports of source's module change, not the names it defines.
+    """
+    text = text.replace(str(source), str(target))
+    module = rf"(?m)^(\s*(?:from|import)\s+(?:[\w.]+\.)?){re.escape(source.stem)}\b"
+    return re.sub(module, rf"\g<1>{target.stem}", text)
+
+
+def build_tdd_workflow(
+    filename: Path,
+    llm,
+    name="tdd",
+    workspace=None,
+    store: NodeStore | None = None,
+    samples: list[Path] = (),
+    share: str = DEFAULT_SHARE_STAGES,
+) -> Workflow:
+    """The stub, red, green (and commit) steps of the TDD agent as a workflow
+
+    `samples` are the files of more samples of the task, run concurrently with the
+    first.  They copy its stub when `share` is "stub", its stub and tests when it is
+    "red", and write their own code.  With "none" every sample runs every step.
+    """
+    if share not in SHARE_STAGES:
+        raise ValueError(f"share must be one of {SHARE_STAGES}, not {share}")
+    filename = Path(filename)
+    nodes = list(tdd_nodes(filename, llm, name).values())
+    if workspace is not None:
+        if samples:
+            raise ValueError("Samples can not share a workspace")
+
+        def commit(code, failed):
+            commit_workspace(workspace, name, failed)
+            return {"committed": True}
+
+        nodes.append(Node("commit", commit, ("code", "failed"), ("committed",)))
+
+    for i, sample in enumerate(samples, start=1):
+        sample = Path(sample)
+        suffix = f"_{i}"
+        own = tdd_nodes(sample, llm, name)
+        if share == "none":
+            nodes += [node.branch(suffix, ("task",)) for node in own.values()]
+            continue
+
+        def share_stub(stub_code, functions_section, sample=sample):
+            _save_output("stub_code", sample)({"stub_code": stub_code})
+            functions = _retarget(functions_section, filename, sample)
+            return {
+                "stub_code": stub_code,
+                "functions_section": functions,
+                "draft_functions": functions,
+            }
+
+        nodes.append(
+            Node(
+                "share_stub",
+                share_stub,
+                ("stub_code", "functions_section"),
+                ("stub_code", "functions_section", "draft_functions"),
+                restore=_save_output("stub_code", sample),
+            ).branch(suffix, ("stub_code", "functions_section"))
+        )
+        steps = ["green_draft", "green"]
+        if share == "red":
+
+            def share_red(test_code, functions_section, sample=sample):
+                # Runs the shared tests against this sample's copy of the stub
+                test_code = _retarget(test_code, filename, sample)
+                red_results, _failed = run_red_tests(sample, test_code)
+                return {"test_code": test_code, "red_results": red_results}
+
+            nodes.append(
+                Node(
+                    "share_red",
+                    share_red,
+                    ("test_code", "functions_section"),
+                    ("test_code", "red_results"),
+                    restore=_save_output("test_code", get_test_filename(sample)),
+                )
+                # The sample's functions section, which is written after its stub
+                .branch(suffix, ("test_code",))
+            )
+        else:
+            steps = ["red_draft", "red"] + steps
+        nodes += [own[step].branch(suffix, ("task",)) for step in steps]
+    return Workflow(nodes, store=store)
+
+
+def commit_workspace(workspace, name, failed):
+    """Commits the task's code and tests on its branch, passing or not, so the
+    work survives the worktree's reuse"""
+    outcome = "tests fail" if failed else "tests pass"
+    with span("commit", name=name):
+        try:
+            workspace.git.commit_changes(f"{name}: {outcome}")
+        except NothingToCommit:
+            # A re-run or resumed task wrote the code already on its branch
+            forget_written(workspace.path)
+            print(f"{name}: the branch {workspace.branch} is up to date")
+
+
+def _clean_prompt(prompt: str) -> str:
+    return re.sub(r"\n\n\n([\n]+)", "\n\n\n", prompt)
+
+
+def _pack(template: str, pieces: list[Piece], llm=None, **fields) -> str:
+    """Formats template, shortening the pieces that do not fit llm's context"""
+    packed = ContextPacker.for_llm(llm).format(template, pieces, **fields)
+    if packed.dropped:
+        print(packed.report())
+        current_span().set(
+            prompt_tokens=packed.tokens,
+            context_dropped=[f"{o.name}:{o.action}" for o in packed.dropped],
+        )
+    return packed.prompt
+
+
+def _functions_piece(functions_section: str) -> Piece:
+    # Functions are listed most relevant first, so keep whole entries from the start
+    return Piece(
+        "functions_section", functions_section, priority=50, separator="\n## Filename"
+    )
 
+
+def build_stub_prompt(filename, task, functions_section="", llm=None) -> str:
+    return _clean_prompt(
+        _pack(
+            STUB_STEP_PROMPT,
+            [Piece("prompt", task, priority=100), _functions_piece(functions_section)],
+            llm,
+            filename=filename,
+            examples="",
+        )
+    )
+
+
+def build_red_prompt(filename, task, functions_section: str, llm=None) -> str:
+    return _clean_prompt(
+        _pack(
+            RED_STEP_PROMPT,
+            [Piece("prompt", task, priority=100), _functions_piece(functions_section)],
+            llm,
+            test_library="pytest",
+            filename=filename,
+            examples="",
+        )
+    )
+
+
+def build_green_prompt(
+    filename, task, functions_section, test_code, test_results, llm=None
+):
+    return _clean_prompt(
+        _pack(
+            GREEN_STEP_PROMPT,
+            [
+                Piece("prompt", task, priority=100),
+                Piece(
+                    "test_errors",
+                    test_results,
+                    priority=80,
+                    truncate="tail",
+                    summary=summarize_test_output(test_results),
+                ),
+                Piece("tests", test_code, priority=70),
+                _functions_piece(functions_section),
+            ],
+            llm,
+            filename=filename,
+            examples="",
+        )
+    )
+
+
+def build_error_prompt(
+    code, tb_str, functions_section, filename, prompt, llm=None
+) -> str:
+    return _pack(
+        ERROR_PROMPT,
+        [
+            Piece("prompt", prompt, priority=100),
+            Piece("code", code, priority=90),
+            Piece("error", "".join(tb_str), priority=85, truncate="tail"),
+            _functions_piece(functions_section),
+        ],
+        llm,
+        filename=filename,
+        examples="",
+        language="python3",
+    )
+
+
+def get_test_filename(filename: Path) -> Path:
+    return filename.parent / f"tests/test_{filename.name}"
+
+
+@traced(attributes=("name",))
 def green_step(
     filename, task, llm, functions_section, test_code, test_results, name="tdd"
 ):
     print("GREEN STEP")
-    prompt = GREEN_STEP_PROMPT.format(
-        functions_section=functions_section,
-        filename=filename,
-        prompt=task,
-        examples="",
-        tests=test_code,
-        test_errors=test_results,
+    code = generate_code(
+        filename, task, llm, functions_section, test_code, test_results, name=name
+    )
+    return fix_code(filename, task, llm, code, functions_section, name=name)
+
+
+def generate_code(
+    filename, task, llm, functions_section, test_code, test_results, name="tdd"
+) -> str:
+    """Prompts for the code that passes the failing tests"""
+    prompt = build_green_prompt(
+        filename, task, functions_section, test_code, test_results, llm=llm
     )
-    prompt = re.sub(r"\n\n\n([\n]+)", "\n\n\n", prompt)
 
     # generate code
-    code = extract_code_from_response(
-        call_llm(llm, prompt, prefix="human-eval-green", log_dir=f"./logs/{name}")
+    return extract_code_from_response(
+        call_llm(
+            llm,
+            prompt,
+            prefix="human-eval-green",
+            task=name,
+            step="green",
+        )
     )
+
+
+def fix_code(
+    filename, task, llm, code, functions_section, name="tdd"
+) -> tuple[str, bool]:
+    """Fixes the code until it runs, saves it and runs the tests against it"""
     # Run the code to see if it compiles
     code = run_and_fix(
         llm,
@@ -118,35 +700,44 @@ def green_step(
     )
 
     # Save file
-    if not filename.parent.exists():
-        filename.parent.mkdir(exist_ok=True, parents=True)
+    with span("write_file", filename=filename):
+        if not filename.parent.exists():
+            filename.parent.mkdir(exist_ok=True, parents=True)
 
-    with open(filename, "w") as f:
-        f.write(code)
+        with open(filename, "w") as f:
+            f.write(code)
+        record_written(filename)
 
     # Run the tests again
-    test_filename = filename.parent / f"tests/test_{filename.name}"
-    test_results, failed = run_shell_command(f"pytest {test_filename}")
-    return test_results, failed
+    result = run_pytest(get_test_filename(filename))
+    print(f"{result.count('passed')}/{len(result.tests)} tests passed")
+    return result.output, result.failed
 
 
+@traced(attributes=("name",))
 def red_step(filename, task, llm, functions_section: str, name="tdd"):
     print("RED STEP")
-    prompt = RED_STEP_PROMPT.format(
-        test_library="pytest",
-        functions_section=functions_section,
-        filename=filename,
-        prompt=task,
-        examples="",
-    )
-    prompt = re.sub(r"\n\n\n([\n]+)", "\n\n\n", prompt)
+    test_code = generate_tests(filename, task, llm, functions_section, name=name)
+    test_results, _failed = run_red_tests(filename, test_code)
+    return test_code, test_results
+
+
+def generate_tests(filename, task, llm, functions_section: str, name="tdd") -> str:
+    """Prompts for the failing tests of task and fixes them until they compile"""
+    prompt = build_red_prompt(filename, task, functions_section, llm=llm)
 
     # generate code
     test_code = extract_code_from_response(
-        call_llm(llm, prompt, prefix="human-eval-red", log_dir=f"./logs/{name}")
+        call_llm(
+            llm,
+            prompt,
+            prefix="human-eval-red",
+            task=name,
+            step="red",
+        )
     )
     # Run the code to see if it compiles
-    test_code = run_and_fix(
+    return run_and_fix(
         llm,
         test_code,
         max_tries=2,
@@ -157,27 +748,44 @@ def red_step(filename, task, llm, functions_section: str, name="tdd"):
         prompt=task,
     )
 
-    # Save file
-    test_filename = filename.parent / f"tests/test_{filename.name}"
+
+def run_red_tests(filename, test_code) -> tuple[str, bool]:
+    """Saves the tests next to filename and runs them against it"""
+    test_filename = get_test_filename(filename)
     test_results, failed = save_and_run_code(test_filename, test_code, "pytest")
 
     if failed:
         print(f"Created a failing test at: {test_filename}")
     else:
         print(f"Created a passing test at: {test_filename}")
-    return test_code, test_results
+    return test_results, failed
 
 
+@traced(attributes=("name",))
 def stub_step(filename, task, llm, name="tdd", functions_section="") -> tuple[str, str]:
     print("STUB STEP")
-    prompt = STUB_STEP_PROMPT.format(
-        functions_section=functions_section, filename=filename, prompt=task, examples=""
-    )
-    prompt = re.sub(r"\n\n\n([\n]+)", "\n\n\n", prompt)
+    stub_code = generate_stub(filename, task, llm, name, functions_section)
+    return fix_stub(filename, task, llm, stub_code, name, functions_section)
+
+
+def generate_stub(filename, task, llm, name="tdd", functions_section="") -> str:
+    prompt = build_stub_prompt(filename, task, functions_section, llm=llm)
     # generate code
-    stub_code = extract_code_from_response(
-        call_llm(llm, prompt, prefix="human-eval-stub", log_dir=f"./logs/{name}")
+    return extract_code_from_response(
+        call_llm(
+            llm,
+            prompt,
+            prefix="human-eval-stub",
+            task=name,
+            step="stub",
+        )
     )
+
+
+def fix_stub(
+    filename, task, llm, stub_code, name="tdd", functions_section=""
+) -> tuple[str, str]:
+    """Fixes the stub until it runs, saves it and lists its functions"""
     # Run the code to see if it compiles
     stub_code = run_and_fix(
         llm,
@@ -192,7 +800,9 @@ def stub_step(filename, task, llm, name="tdd", functions_section="") -> tuple[st
 
     result, failed = save_and_run_code(filename, stub_code, "python")
 
-    functions_section = create_function_list_for_prompts(filename, stub_code)
+    functions_section = create_function_list_for_prompts(
+        filename, stub_code, query=task
+    )
 
     # TODO add usages to the function definitions
     if failed:
@@ -200,7 +810,22 @@ def stub_step(filename, task, llm, name="tdd", functions_section="") -> tuple[st
     return stub_code, functions_section
 
 
-def create_function_list_for_prompts(filename, stub_code) -> str:
+def create_function_list_for_prompts(
+    filename,
+    stub_code,
+    query: str | None = None,
+    top_k: int | None = None,
+    index: FunctionIndex | None = None,
+    graph: CallGraph | None = None,
+) -> str:
+    """Lists the stub's functions, then those of the index most similar to query
+
+    At most top_k functions are listed, so the prompt stays the same size however
+    large the repository is.  Without a query the stub's functions are listed in order.
+    With a call graph of the repository (P2C_INDEX_ROOT's by default) each function
+    lists what it calls and what calls it across the repository.
+    """
+    top_k = DEFAULT_CONTEXT_TOP_K if top_k is None else top_k
     try:
         function_data, _g = extract_function_definitions(
             stub_code, filename=filename, branch=None
@@ -209,8 +834,32 @@ def create_function_list_for_prompts(filename, stub_code) -> str:
         print(f"Failed to extract function definitions: {e}")
         function_data = []
 
+    stub_path = Path(filename).resolve()
+    if query:
+        if len(function_data) > top_k:
+            function_data = rank_functions(query, function_data, top_k)
+        paths = [stub_path] * len(function_data)
+        index = index or get_default_index()
+        if index is not None and len(function_data) < top_k:
+            # The index has root-relative paths, and a stale copy of the stub's file
+            for f, _score in index.search(query, k=top_k):
+                if len(function_data) == top_k:
+                    break
+                path = (index.root / f.filename).resolve()
+                if path != stub_path:
+                    function_data.append(f)
+                    paths.append(path)
+    else:
+        function_data = function_data[:top_k]
+        paths = [stub_path] * len(function_data)
+
+    graph = graph or get_default_callgraph()
+    if graph is not None:
+        function_data = [
+            _with_usages(f, path, graph) for f, path in zip(function_data, paths)
+        ]
+
     functions = [FUNCTIONS_SECTION]
-    # TODO add common usages to docstring
     # TODO dynamic language
     for f in function_data:
         fn = FUNCTION_MENTION.format(
@@ -218,25 +867,51 @@ def create_function_list_for_prompts(filename, stub_code) -> str:
             name=f.name,
             language="python",
             definition=f.definition,
-            docstring="\n    ...",
+            docstring=_usages_docstring(f.usages),
         )
         functions.append(fn + "\n")
 
     return "\n".join(functions) + "\n" if len(functions) > 1 else ""
 
 
+def _with_usages(f: AvailableMethods, path: Path, graph: CallGraph):
+    """A copy of f with its usages across the repository, f if it is outside of it"""
+    if not path.is_relative_to(graph.root):
+        return f
+    name = graph.qualified_name(path.relative_to(graph.root).as_posix(), f.name)
+    # Cached definitions are shared, so they are copied rather than changed
+    return f.copy(update={"usages": graph.usages(name, k=USAGES_PER_FUNCTION)})
+
+
+def _usages_docstring(usages: dict | None) -> str:
+    lines = []
+    for key, label in (("calls", "Calls"), ("called_by", "Called by")):
+        names = [name for name, _sites in (usages or {}).get(key, [])]
+        if names:
+            lines.append(f"{label}: {', '.join(names)}")
+    if not lines:
+        return "\n    ..."
+    return '\n    """' + "\n    ".join(lines) + '"""\n    ...'
+
+
 def save_and_run_code(filename: Path, code, command) -> tuple[str, bool]:
     """Saves code to filename, runs command and returns stdout and a bool if it had failed"""
     # Save file
-    if not filename.parent.exists():
-        filename.parent.mkdir(exist_ok=True, parents=True)
+    with span("write_file", filename=filename):
+        if not filename.parent.exists():
+            filename.parent.mkdir(exist_ok=True, parents=True)
 
-    with open(filename, "w") as f:
-        f.write(code)
+        with open(filename, "w") as f:
+            f.write(code)
+        record_written(filename)
 
+    if command == "pytest":
+        result = run_pytest(filename)
+        return result.output, result.failed
     return run_shell_command(f"{command} {filename}")
 
 
+@traced(attributes=("name", "count", "strategy"))
 def run_and_fix(
     llm,
     code,
@@ -247,29 +922,62 @@ def run_and_fix(
     functions_section: str = "",
     filename: str = "",
     prompt: str = "",
+    strategy: str | None = None,
+    k: int | None = None,
+    metrics: FixMetrics | None = None,
 ):
+    """Runs code and asks the LLM to fix it until it executes, up to max_tries rounds
+
+    strategy is one of:
+        sequential: generate one fix at a time
+        parallel-k: generate k fixes at once, validate them all and keep the first that runs
+        race: generate k fixes at once and keep whichever runs first, cancelling the
+            other requests at their next streamed chunk (what they used is still billed)
+    """
+    strategy = strategy or DEFAULT_FIX_STRATEGY
+    if strategy not in FIX_STRATEGIES:
+        raise ValueError(f"Unknown fix strategy: {strategy}")
+    if metrics is None:
+        metrics = fix_metrics
+    if strategy != "sequential":
+        return _run_and_fix_concurrently(
+            llm,
+            code,
+            max_tries=max_tries,
+            timeout=timeout,
+            name=name,
+            functions_section=functions_section,
+            filename=filename,
+            prompt=prompt,
+            race=strategy == "race",
+            k=k or DEFAULT_FIX_CANDIDATES,
+            metrics=metrics,
+        )
+
     if count >= max_tries:
         return code
 
-    # Set the signal handler for the alarm signal
+    # Run the code in the sandbox to check that it executes
     tb_str = run_code(code, timeout)
+    if count:
+        metrics.validated += 1
 
     if tb_str is None:
         return code
 
-    new_prompt = ERROR_PROMPT.format(
-        functions_section=functions_section,
-        filename=filename,
-        prompt=prompt,
-        examples="",
-        error="".join(tb_str),
-        code=code,
-        language="python3",
+    new_prompt = build_error_prompt(
+        code, tb_str, functions_section, filename=filename, prompt=prompt, llm=llm
     )
 
+    metrics.rounds += 1
+    metrics.candidates += 1
     code = extract_code_from_response(
         call_llm(
-            llm, new_prompt, prefix=f"human-eval-fix-{count}", log_dir=f"./logs/{name}"
+            llm,
+            new_prompt,
+            prefix=f"human-eval-fix-{count}",
+            task=name,
+            step="fix",
         )
     )
     return run_and_fix(
@@ -282,4 +990,113 @@ def run_and_fix(
         functions_section=functions_section,
         filename=filename,
         prompt=prompt,
+        strategy=strategy,
+        metrics=metrics,
     )
+
+
+def _run_and_fix_concurrently(
+    llm,
+    code,
+    max_tries: int,
+    timeout: float,
+    name: str,
+    functions_section: str,
+    filename: str,
+    prompt: str,
+    race: bool,
+    k: int,
+    metrics: FixMetrics,
+):
+    def generate(new_prompt: str, count: int, i: int, cancel=None) -> str:
+        return extract_code_from_response(
+            call_llm(
+                llm,
+                new_prompt,
+                prefix=f"human-eval-fix-{count}-{i}",
+                # Identical prompts must not all be answered from the cache
+                use_cache=i == 0,
+                task=name,
+                step="fix",
+                cancel=cancel,
+            )
+        )
+
+    def generate_and_validate(new_prompt: str, count: int, i: int, cancel=None):
+        """The candidate and its run, None if cancelled and no run if it lost"""
+        try:
+            candidate = generate(new_prompt, count, i, cancel)
+        except StreamCancelled:
+            return None
+        if cancel is not None and cancel.is_set():
+            return candidate, None
+        return candidate, get_default_pool().run(candidate, timeout=timeout)
+
+    tb_str = run_code(code, timeout)
+    for count in range(max_tries):
+        if tb_str is None:
+            return code
+
+        new_prompt = build_error_prompt(
+            code, tb_str, functions_section, filename=filename, prompt=prompt, llm=llm
+        )
+        metrics.rounds += 1
+        metrics.candidates += k
+        metrics.wasted += k - 1
+
+        cancel = threading.Event() if race else None
+        with ThreadPoolExecutor(max_workers=k) as executor:
+            # Copy the context so candidate spans nest under this round
+            futures = [
+                executor.submit(
+                    copy_context().run,
+                    generate_and_validate,
+                    new_prompt,
+                    count,
+                    i,
+                    cancel,
+                )
+                for i in range(k)
+            ]
+            if race:
+                code, tb_str = _race_candidates(futures, cancel, metrics)
+                continue
+
+            # parallel-k: wait for every candidate and keep the first one that runs
+            results = [future.result() for future in futures]
+        metrics.validated += k
+        passing = [(c, r) for c, r in results if not r.failed]
+        code, result = passing[0] if passing else results[0]
+        tb_str = result.traceback
+    return code
+
+
+def _race_candidates(futures, cancel: threading.Event, metrics: FixMetrics):
+    """The first candidate that runs, or else the first that was validated, and its
+    traceback
+
+    Once a candidate runs the other requests are cancelled, and the executor waits
+    for them to close their streams.
+    """
+    winner = None
+    try:
+        for future in as_completed(futures):
+            outcome = future.result()
+            if outcome is None:
+                metrics.cancelled += 1
+                continue
+            candidate, result = outcome
+            if result is None:
+                # Generated after another candidate had won, so never run
+                continue
+            metrics.validated += 1
+            if winner is not None and not winner[1].failed:
+                continue
+            if winner is None or not result.failed:
+                winner = candidate, result
+            if not result.failed:
+                cancel.set()
+    finally:
+        # Also stops the other requests when a candidate raised
+        cancel.set()
+    return winner[0], winner[1].traceback
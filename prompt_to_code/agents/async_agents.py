@@ -0,0 +1,365 @@
+"""Async variants of the TDD steps in `prompt_to_code.agents.agents`
+
+These keep many LLM requests in flight from a single thread.  Concurrency is bounded
+by an `LLMLimiter` and rate-limit errors are retried with exponential backoff, e.g.
+
+    await asyncio.gather(
+        *(arun_agent("tdd", name, outdir / f"sample_{i}.py", task) for i in range(10))
+    )
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+from pathlib import Path
+
+from prompt_to_code.agents.agents import (
+    DEFAULT_STREAM,
+    build_error_prompt,
+    build_green_prompt,
+    build_llm,
+    build_red_prompt,
+    build_stub_prompt,
+    cached_completion,
+    commit_workspace,
+    create_function_list_for_prompts,
+    extract_code_from_response,
+    get_test_filename,
+    record_cancelled,
+    record_completion,
+)
+from prompt_to_code.agents.cache import LLMCache, get_default_cache
+from prompt_to_code.agents.streaming import (
+    CodeBlockExtractor,
+    StreamCancelled,
+    StreamResult,
+    stream_llm,
+)
+from prompt_to_code.tools.execution import arun_shell_command, run_code
+from prompt_to_code.tools.file_writer import record_written
+from prompt_to_code.tools.test_runner import run_pytest
+from prompt_to_code.tracing import traced
+
+DEFAULT_CONCURRENCY = int(os.environ.get("P2C_LLM_CONCURRENCY", 16))
+
+
+class LLMLimiter:
+    """Bounds the number of concurrent LLM requests and retries rate-limited ones"""
+
+    def __init__(
+        self,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def backoff(self, attempt: int, error: Exception | None = None) -> float:
+        """Seconds to wait before retry `attempt`, honouring any Retry-After header"""
+        headers = getattr(error, "headers", None) or {}
+        retry_after = headers.get("retry-after") or headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_delay)
+            except ValueError:
+                pass
+        delay = min(self.base_delay * 2**attempt, self.max_delay)
+        return delay * random.uniform(0.5, 1.0)
+
+    async def run(self, coro_fn, *args, **kwargs):
+        """Awaits `coro_fn(*args, **kwargs)` under the limit, retrying on rate limits"""
+        retryable = _retryable_errors()
+        attempt = 0
+        while True:
+            async with self._semaphore:
+                try:
+                    return await coro_fn(*args, **kwargs)
+                except retryable as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    error = e
+            # Sleep outside of the semaphore so other requests can proceed
+            delay = self.backoff(attempt, error)
+            print(f"\tLLM {type(error).__name__}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+_default_limiters: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def get_default_limiter() -> LLMLimiter:
+    """Returns the limiter shared by all requests on the running event loop"""
+    loop = asyncio.get_running_loop()
+    if loop not in _default_limiters:
+        _default_limiters[loop] = LLMLimiter()
+    return _default_limiters[loop]
+
+
+def _retryable_errors() -> tuple[type[Exception], ...]:
+    try:
+        import openai.error
+    except ImportError:
+        return (asyncio.TimeoutError,)
+    return (
+        asyncio.TimeoutError,
+        openai.error.RateLimitError,
+        openai.error.ServiceUnavailableError,
+        openai.error.APIConnectionError,
+        openai.error.Timeout,
+        openai.error.TryAgain,
+    )
+
+
+async def _agenerate(llm, prompt: str) -> str:
+    try:
+        if hasattr(llm, "call_as_llm"):
+            from langchain.schema import HumanMessage
+
+            result = await llm.agenerate([[HumanMessage(content=prompt)]])
+        else:
+            result = await llm.agenerate([prompt])
+    except NotImplementedError:
+        # LLMs without async support are run on a worker thread instead
+        if hasattr(llm, "call_as_llm"):
+            return await asyncio.to_thread(llm.call_as_llm, prompt)
+        return await asyncio.to_thread(llm, prompt)
+    return result.generations[0][0].text
+
+
+async def _astream(llm, prompt: str, cancel=None) -> StreamResult:
+    # The OpenAI clients stream synchronously, so read the stream on a worker thread
+    return await asyncio.to_thread(
+        stream_llm, llm, prompt, CodeBlockExtractor.for_prompt(prompt), cancel
+    )
+
+
+@traced("call_llm", attributes=("prefix", "task", "step"))
+async def acall_llm(
+    llm,
+    prompt,
+    prefix="any",
+    log_dir: str | None = None,
+    cache: LLMCache | None = None,
+    use_cache: bool = True,
+    limiter: LLMLimiter | None = None,
+    task: str | None = None,
+    step: str | None = None,
+    stream: bool | None = None,
+    cancel: threading.Event | None = None,
+):
+    """Completes prompt like `call_llm`, awaiting the request instead of blocking"""
+    if not use_cache:
+        cache = None
+    elif cache is None:
+        cache = get_default_cache()
+    if limiter is None:
+        limiter = get_default_limiter()
+    if stream is None:
+        stream = DEFAULT_STREAM or cancel is not None
+
+    cur_time = time.time()
+    result = cached_completion(llm, prompt, prefix, log_dir, cache, task, step)
+    if result is not None:
+        return result
+
+    streamed = None
+    if stream:
+        try:
+            streamed = await limiter.run(_astream, llm, prompt, cancel)
+        except StreamCancelled as e:
+            record_cancelled(
+                llm, prompt, e.partial, cur_time, prefix, log_dir, task, step
+            )
+            raise
+        result = streamed.text
+    else:
+        result = await limiter.run(_agenerate, llm, prompt)
+    record_completion(
+        llm, prompt, result, cur_time, prefix, log_dir, cache, task, step, streamed
+    )
+    return result
+
+
+@traced("run_agent", attributes=("agent", "name"))
+async def arun_agent(
+    agent, name, filename, task: str, request_timeout=180, llm=None, workspace=None
+):
+    if llm is None:
+        llm = build_llm(agent, request_timeout=request_timeout)
+    print(f"Running {agent}: {name} {llm}")
+    if workspace is not None:
+        filename = Path(workspace.path) / filename
+
+    functions_section = create_function_list_for_prompts(filename, "", query=task)
+    _stub_code, functions_section = await astub_step(
+        filename, task, llm, name=name, functions_section=functions_section
+    )
+    test_code, test_results = await ared_step(
+        filename, task, llm, functions_section, name=name
+    )
+    test_results, failed = await agreen_step(
+        filename, task, llm, functions_section, test_code, test_results, name=name
+    )
+    print(test_results, failed)
+    if workspace is not None:
+        await asyncio.to_thread(commit_workspace, workspace, name, failed)
+    return test_results, failed
+
+
+@traced("green_step", attributes=("name",))
+async def agreen_step(
+    filename, task, llm, functions_section, test_code, test_results, name="tdd"
+):
+    print("GREEN STEP")
+    prompt = build_green_prompt(
+        filename, task, functions_section, test_code, test_results, llm=llm
+    )
+    code = extract_code_from_response(
+        await acall_llm(
+            llm,
+            prompt,
+            prefix="human-eval-green",
+            task=name,
+            step="green",
+        )
+    )
+    code = await arun_and_fix(
+        llm,
+        code,
+        max_tries=2,
+        timeout=5,
+        name=name,
+        functions_section=functions_section,
+        filename=filename,
+        prompt=task,
+    )
+
+    _save_code(filename, code)
+    result = await asyncio.to_thread(run_pytest, get_test_filename(filename))
+    print(f"{result.count('passed')}/{len(result.tests)} tests passed")
+    return result.output, result.failed
+
+
+@traced("red_step", attributes=("name",))
+async def ared_step(filename, task, llm, functions_section: str, name="tdd"):
+    print("RED STEP")
+    prompt = build_red_prompt(filename, task, functions_section, llm=llm)
+    test_code = extract_code_from_response(
+        await acall_llm(
+            llm,
+            prompt,
+            prefix="human-eval-red",
+            task=name,
+            step="red",
+        )
+    )
+    test_code = await arun_and_fix(
+        llm,
+        test_code,
+        max_tries=2,
+        timeout=5,
+        name=name,
+        functions_section=functions_section,
+        filename=filename,
+        prompt=task,
+    )
+
+    test_filename = get_test_filename(filename)
+    test_results, failed = await asave_and_run_code(test_filename, test_code, "pytest")
+    if failed:
+        print(f"Created a failing test at: {test_filename}")
+    else:
+        print(f"Created a passing test at: {test_filename}")
+    return test_code, test_results
+
+
+@traced("stub_step", attributes=("name",))
+async def astub_step(
+    filename, task, llm, name="tdd", functions_section=""
+) -> tuple[str, str]:
+    print("STUB STEP")
+    prompt = build_stub_prompt(filename, task, functions_section, llm=llm)
+    stub_code = extract_code_from_response(
+        await acall_llm(
+            llm,
+            prompt,
+            prefix="human-eval-stub",
+            task=name,
+            step="stub",
+        )
+    )
+    stub_code = await arun_and_fix(
+        llm,
+        stub_code,
+        max_tries=2,
+        timeout=5,
+        name=name,
+        functions_section=functions_section,
+        filename=filename,
+        prompt=task,
+    )
+
+    result, failed = await asave_and_run_code(filename, stub_code, "python")
+    functions_section = create_function_list_for_prompts(
+        filename, stub_code, query=task
+    )
+    if failed:
+        print(f"Failed to run the code: {result}")
+    return stub_code, functions_section
+
+
+@traced("write_file", attributes=("filename",))
+def _save_code(filename: Path, code: str):
+    if not filename.parent.exists():
+        filename.parent.mkdir(exist_ok=True, parents=True)
+    with open(filename, "w") as f:
+        f.write(code)
+    record_written(filename)
+
+
+async def asave_and_run_code(filename: Path, code, command) -> tuple[str, bool]:
+    """Saves code to filename, runs command and returns stdout and a bool if it had failed"""
+    _save_code(filename, code)
+    if command == "pytest":
+        result = await asyncio.to_thread(run_pytest, filename)
+        return result.output, result.failed
+    return await arun_shell_command(f"{command} {filename}")
+
+
+@traced("run_and_fix", attributes=("name",))
+async def arun_and_fix(
+    llm,
+    code,
+    max_tries=2,
+    timeout=5,
+    name="tdd",
+    functions_section: str = "",
+    filename: str = "",
+    prompt: str = "",
+):
+    for count in range(max_tries):
+        tb_str = await asyncio.to_thread(run_code, code, timeout)
+        if tb_str is None:
+            return code
+
+        new_prompt = build_error_prompt(
+            code, tb_str, functions_section, filename=filename, prompt=prompt, llm=llm
+        )
+        code = extract_code_from_response(
+            await acall_llm(
+                llm,
+                new_prompt,
+                prefix=f"human-eval-fix-{count}",
+                task=name,
+                step="fix",
+            )
+        )
+    return code
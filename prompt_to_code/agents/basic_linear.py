@@ -1,6 +1,4 @@
 """A prompt to code agent."""
-import re
-
 from langchain import LLMChain, SerpAPIWrapper
 from langchain.agents import (
     AgentExecutor,
@@ -8,10 +6,13 @@ from langchain.agents import (
     LLMSingleActionAgent,
     Tool,
 )
-from langchain.chat_models import ChatOpenAI
 from langchain.prompts import StringPromptTemplate
 from langchain.schema import AgentAction, AgentFinish
+from pydantic import Field
 
+from prompt_to_code.agents.clients import get_client
+from prompt_to_code.agents.scratchpad import Scratchpad
+from prompt_to_code.agents.streaming import parse_agent_action
 from prompt_to_code.tools.codegen import create_codegen_tool
 from prompt_to_code.tools.file_list import list_file_tool
 from prompt_to_code.tools.file_reader import read_file_tool
@@ -49,17 +50,17 @@ class CustomPromptTemplate(StringPromptTemplate):
     template: str
     # The list of tools available
     tools: list[Tool]
+    # Renders the intermediate steps within a token budget
+    scratchpad: Scratchpad = Field(default_factory=Scratchpad)
+
+    class Config:
+        arbitrary_types_allowed = True
 
     def format(self, **kwargs) -> str:
         # Get the intermediate steps (AgentAction, Observation tuples)
-        # Format them in a particular way
         intermediate_steps = kwargs.pop("intermediate_steps")
-        thoughts = ""
-        for action, observation in intermediate_steps:
-            thoughts += action.log
-            thoughts += f"\nObservation: {observation}\nThought: "
-        # Set the agent_scratchpad variable to that value
-        kwargs["agent_scratchpad"] = thoughts
+        # Only new steps are rendered, older ones are shortened and then dropped
+        kwargs["agent_scratchpad"] = self.scratchpad.update(intermediate_steps)
         # Create a tools variable from the list of tools provided
         kwargs["tools"] = "\n".join(
             [
@@ -74,35 +75,8 @@ class CustomPromptTemplate(StringPromptTemplate):
 
 class CustomOutputParser(AgentOutputParser):
     def parse(self, llm_output: str) -> AgentAction | AgentFinish:
-        # Check if agent should finish
-        if "Final Answer:" in llm_output:
-            return AgentFinish(
-                # Return values is generally always a dictionary with a single `output` key
-                # It is not recommended to try anything else at the moment :)
-                return_values={"output": llm_output.split("Final Answer:")[-1].strip()},
-                log=llm_output,
-            )
-        # Parse out the action and action input
-        regex = r"Action: (.*?)[\n]*Action Input:[\s]*(.*)"
-        if match := re.search(regex, llm_output, re.DOTALL):
-            action = match[1].strip()
-            action_input = match[2]
-            # Return the action and action input
-            return AgentAction(
-                tool=action,
-                tool_input=action_input.strip(" ")
-                .strip('"')
-                .strip("'")
-                .strip("```")
-                .strip('"""'),
-                log=llm_output,
-            )
-
-        regex = r"Thought:[\s]*(.*)"
-        if match := re.search(regex, llm_output, re.DOTALL):
-            return AgentAction(tool="Think", tool_input=match[1], log=llm_output)
-        else:
-            raise ValueError(f"Could not parse LLM output: `{llm_output}`")
+        # Shared with the streaming extractor, which stops after the action input
+        return parse_agent_action(llm_output)
 
 
 def build_default_agent(config, logger):
@@ -119,6 +93,12 @@ def build_default_agent(config, logger):
         read_file_tool(config=config, logger=logger),
         relection_tool(config=config, logger=logger),
     ]
+    llm = get_client(temperature=0.7, model_name="gpt-4", max_tokens=3000)
+    return build_agent_executor(llm, tools)
+
+
+def build_agent_executor(llm, tools: list[Tool], verbose: bool = True):
+    """Builds the single action agent that drives `tools` with `llm`"""
     prompt = CustomPromptTemplate(
         template=template,
         tools=tools,
@@ -128,8 +108,6 @@ def build_default_agent(config, logger):
     )
     output_parser = CustomOutputParser()
 
-    llm = ChatOpenAI(temperature=0.7, model="gpt-4", max_tokens=3000)
-
     # LLM chain consisting of the LLM and a prompt
     llm_chain = LLMChain(llm=llm, prompt=prompt)
     tool_names = [tool.name for tool in tools]
@@ -139,4 +117,4 @@ def build_default_agent(config, logger):
         stop=["\nObservation:"],
         allowed_tools=tool_names,
     )
-    return AgentExecutor.from_agent_and_tools(agent=agent, tools=tools, verbose=True)
+    return AgentExecutor.from_agent_and_tools(agent=agent, tools=tools, verbose=verbose)
@@ -0,0 +1,189 @@
+"""A persistent, content-addressed cache of LLM responses backed by SQLite"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import astuple, dataclass
+from pathlib import Path
+
+# Parameters that do not change what the model returns
+IGNORED_PARAMS = {"request_timeout", "max_retries", "stream", "streaming"}
+
+
+def llm_params(llm) -> dict:
+    """Returns the parameters of an LLM that determine its response"""
+    params = getattr(llm, "_identifying_params", None)
+    if params is None:
+        params = {
+            key: getattr(llm, key)
+            for key in ("model_name", "temperature", "max_tokens")
+            if hasattr(llm, key)
+        }
+    params = {k: v for k, v in dict(params).items() if k not in IGNORED_PARAMS}
+    params["_type"] = type(llm).__name__
+    return params
+
+
+def cache_key(params: dict, prompt: str) -> str:
+    payload = json.dumps(params, sort_keys=True, default=str) + "\n" + prompt
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    bypassed: int = 0
+    evictions: int = 0
+
+    def __add__(self, other: "CacheStats") -> "CacheStats":
+        return CacheStats(*(a + b for a, b in zip(astuple(self), astuple(other))))
+
+    def __sub__(self, other: "CacheStats") -> "CacheStats":
+        return CacheStats(*(a - b for a, b in zip(astuple(self), astuple(other))))
+
+    def __str__(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return (
+            f"LLM cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate), "
+            f"{self.bypassed} bypassed, {self.evictions} evicted"
+        )
+
+
+class LLMCache:
+    """Stores LLM responses keyed by a hash of the model parameters and prompt.
+
+    Entries are evicted least-recently-used first once either `max_entries` or
+    `max_bytes` is exceeded.  Calls with a temperature above zero bypass the cache
+    unless `cache_sampled` is set, so that sampling runs stay stochastic.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        max_entries: int | None = 100_000,
+        max_bytes: int | None = 1_000_000_000,
+        cache_sampled: bool = False,
+    ):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.cache_sampled = cache_sampled
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+
+        if not self.path.parent.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )"""
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self._conn.commit()
+
+    def enabled_for(self, llm) -> bool:
+        """Returns False if calls to this llm must not be served from the cache"""
+        temperature = getattr(llm, "temperature", 0) or 0
+        return self.cache_sampled or temperature <= 0
+
+    def get(self, llm, prompt: str) -> str | None:
+        if not self.enabled_for(llm):
+            self.stats.bypassed += 1
+            return None
+
+        key = cache_key(llm_params(llm), prompt)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            self.stats.hits += 1
+        return row[0]
+
+    def put(self, llm, prompt: str, response: str):
+        if not self.enabled_for(llm):
+            return
+
+        key = cache_key(llm_params(llm), prompt)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count, size = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if (self.max_entries is None or count <= self.max_entries) and (
+            self.max_bytes is None or size <= self.max_bytes
+        ):
+            return
+
+        evict = []
+        rows = self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY accessed ASC"
+        )
+        for key, entry_size in rows:
+            if (self.max_entries is None or count <= self.max_entries) and (
+                self.max_bytes is None or size <= self.max_bytes
+            ):
+                break
+            evict.append((key,))
+            count -= 1
+            size -= entry_size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evict)
+        self.stats.evictions += len(evict)
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache: LLMCache | None = None
+
+
+def get_default_cache() -> LLMCache | None:
+    """Returns the process-wide cache, created from P2C_LLM_CACHE if it is set"""
+    global _default_cache
+    if _default_cache is None and os.environ.get("P2C_LLM_CACHE"):
+        _default_cache = LLMCache(
+            os.environ["P2C_LLM_CACHE"],
+            cache_sampled=bool(os.environ.get("P2C_LLM_CACHE_SAMPLED", "")),
+        )
+    return _default_cache
+
+
+def set_default_cache(cache: LLMCache | None):
+    global _default_cache
+    _default_cache = cache
@@ -0,0 +1,141 @@
+"""A process-wide registry of LLM clients sharing one pooled HTTP session
+
+Tools, agents and TDD states ask the registry for a client by its configuration
+instead of constructing their own `ChatOpenAI`.  Clients are created on first use
+and shared by everyone asking for the same configuration, and every OpenAI request
+of the process goes through one `requests.Session`, so connections are kept alive
+and reused across clients and threads.
+
+    llm = get_client(model_name="gpt-4", temperature=0.7, max_tokens=2000)
+    print(get_registry().stats())
+"""
+import os
+import threading
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Connections kept alive per host, more requests than this wait for a free one
+DEFAULT_POOL_SIZE = int(os.environ.get("P2C_HTTP_POOL_SIZE", 32))
+DEFAULT_CHAT_MODELS = ("gpt-4", "gpt-3.5-turbo")
+
+
+@dataclass
+class PoolStats:
+    clients: int
+    requests: int  # HTTP requests sent through the pool
+    connections: int  # connections opened, the rest reused a kept-alive one
+    hosts: int
+
+    @property
+    def reused(self) -> int:
+        return self.requests - self.connections
+
+    def __str__(self):
+        return (
+            f"{self.clients} LLM clients, {self.requests} requests over "
+            f"{self.connections} connections to {self.hosts} hosts "
+            f"({self.reused} reused)"
+        )
+
+
+class ClientRegistry:
+    def __init__(self, pool_size: int = DEFAULT_POOL_SIZE):
+        self.pool_size = pool_size
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._session: requests.Session | None = None
+        self._adapter: HTTPAdapter | None = None
+
+    @property
+    def session(self) -> requests.Session:
+        """The HTTP session of every OpenAI request, created on first use"""
+        with self._lock:
+            if self._session is None:
+                from openai.api_requestor import MAX_CONNECTION_RETRIES
+
+                self._adapter = HTTPAdapter(
+                    pool_connections=self.pool_size,
+                    pool_maxsize=self.pool_size,
+                    max_retries=MAX_CONNECTION_RETRIES,
+                )
+                session = requests.Session()
+                session.mount("https://", self._adapter)
+                session.mount("http://", self._adapter)
+                self._session = session
+            return self._session
+
+    def install(self):
+        """Routes the OpenAI client's requests through the shared session
+
+        openai creates a session per thread on its first request, here every thread
+        gets the same one.  `requests` sessions are safe to share for sending.  Like
+        openai's own sessions it uses `openai.proxy`, as set when a client is created.
+        """
+        import openai
+        import openai.api_requestor
+
+        session = self.session
+        proxies = openai.api_requestor._requests_proxies_arg(openai.proxy)
+        if proxies:
+            session.proxies = proxies
+        openai.api_requestor._make_session = lambda: session
+        # This thread may have made a request already
+        openai.api_requestor._thread_context.session = session
+
+    def get(self, chat: bool | None = None, **config):
+        """The client for config, e.g. model_name, temperature and max_tokens
+
+        `chat` picks `ChatOpenAI` over `OpenAI`, by default for the chat models.
+        """
+        if "model" in config:
+            config["model_name"] = config.pop("model")
+        if chat is None:
+            chat = config.get("model_name", "gpt-4").startswith(DEFAULT_CHAT_MODELS)
+        key = (chat, tuple(sorted(config.items())))
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+
+        self.install()
+        if chat:
+            from langchain.chat_models import ChatOpenAI as Model
+        else:
+            from langchain.llms.openai import OpenAI as Model
+        with self._lock:
+            # Another thread may have created it meanwhile
+            if key not in self._clients:
+                self._clients[key] = Model(**config)
+            return self._clients[key]
+
+    def stats(self) -> PoolStats:
+        requests_sent = connections = hosts = 0
+        if self._adapter is not None:
+            pools = self._adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                hosts += 1
+                requests_sent += pool.num_requests
+                connections += pool.num_connections
+        return PoolStats(len(self._clients), requests_sent, connections, hosts)
+
+    def clear(self):
+        """Forgets the clients and closes the pooled connections"""
+        with self._lock:
+            self._clients.clear()
+            if self._adapter is not None:
+                # Threads keep the session, its adapter opens new connections
+                self._adapter.close()
+
+
+_default_registry = ClientRegistry()
+
+
+def get_registry() -> ClientRegistry:
+    return _default_registry
+
+
+def get_client(chat: bool | None = None, **config):
+    """The shared client for config from the process-wide registry"""
+    return _default_registry.get(chat=chat, **config)
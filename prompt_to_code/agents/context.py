@@ -0,0 +1,180 @@
+"""Fits the variable parts of a prompt into the model's context window
+
+A prompt is a template with fixed fields (filename, instructions) and `Piece`s of
+context (the task, available functions, tests, test failures, failing code) that
+can be arbitrarily long.  `ContextPacker` keeps the highest priority pieces whole
+and shortens the rest to fit a token budget: first to their summary if they have
+one, then truncated at a separator, otherwise dropped.
+
+    packer = ContextPacker.for_llm(llm)
+    packed = packer.format(GREEN_STEP_PROMPT, pieces, filename=filename)
+    if packed.dropped:
+        print(packed.report())
+"""
+import os
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from prompt_to_code.agents.metering import count_tokens, get_encoding, model_name
+
+# Context window in tokens, matched on the longest model prefix
+CONTEXT_WINDOWS: dict[str, int] = {
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo-16k": 16384,
+    "gpt-3.5-turbo": 4096,
+    "text-davinci-003": 4097,
+    "text-davinci-002": 4097,
+    "code-davinci": 8001,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+# Tokens left for the completion when the LLM does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 1024
+# A piece is dropped rather than truncated to fewer tokens than this
+MIN_TRUNCATED_TOKENS = 32
+TRUNCATION_MARKER = "\n...\n"
+
+
+@lru_cache(maxsize=4096)
+def cached_count_tokens(text: str, model: str) -> int:
+    """`count_tokens`, remembering the counts of repeated pieces and templates"""
+    return count_tokens(text, model)
+
+
+def context_window(model: str) -> int:
+    matches = [key for key in CONTEXT_WINDOWS if model.startswith(key)]
+    if not matches:
+        return DEFAULT_CONTEXT_WINDOW
+    return CONTEXT_WINDOWS[max(matches, key=len)]
+
+
+@dataclass
+class Piece:
+    """A field of the prompt template that may be shortened to fit"""
+
+    name: str
+    text: str
+    priority: int
+    # "head" keeps the start, "tail" the end (e.g. of a traceback), None all or nothing
+    truncate: str | None = "head"
+    # Truncation cuts just before (head) or after (tail) a separator
+    separator: str = "\n"
+    summary: str | None = None
+
+
+@dataclass
+class Omission:
+    name: str
+    action: str  # summarized, truncated or dropped
+    tokens: int  # before
+    kept: int  # after
+
+
+@dataclass
+class PackedPrompt:
+    prompt: str
+    tokens: int
+    budget: int
+    dropped: list[Omission] = field(default_factory=list)
+
+    def report(self) -> str:
+        omitted = ", ".join(
+            f"{o.name} {o.action} ({o.tokens} -> {o.kept} tokens)" for o in self.dropped
+        )
+        return f"\tPrompt of {self.tokens}/{self.budget} tokens: {omitted}"
+
+
+def truncate_text(text: str, tokens: int, model: str, side: str, separator: str) -> str:
+    """The start or end of text in at most `tokens` tokens, cut at a separator"""
+    encoding = get_encoding(model)
+    if encoding is None:
+        chars = tokens * 4
+        kept = text[:chars] if side == "head" else text[-chars:]
+    else:
+        encoded = encoding.encode(text, disallowed_special=())
+        kept = encoding.decode(
+            encoded[:tokens] if side == "head" else encoded[-tokens:]
+        )
+
+    if side == "head":
+        cut = kept.rfind(separator)
+        return kept[:cut] if cut > 0 else kept
+    cut = kept.find(separator)
+    return kept[cut + len(separator) :] if cut >= 0 else kept
+
+
+class ContextPacker:
+    def __init__(self, budget: int, model: str = "gpt-4"):
+        self.budget = budget
+        self.model = model
+
+    @classmethod
+    def for_llm(cls, llm=None) -> "ContextPacker":
+        """The prompt budget of llm: its context window less its completion tokens
+
+        P2C_PROMPT_TOKEN_BUDGET overrides it, e.g. to keep prompts short and fast.
+        """
+        model = model_name(llm) if llm is not None else "gpt-4"
+        budget = os.environ.get("P2C_PROMPT_TOKEN_BUDGET")
+        if budget:
+            return cls(int(budget), model)
+        completion = getattr(llm, "max_tokens", None) or DEFAULT_COMPLETION_TOKENS
+        if completion < 0:
+            completion = DEFAULT_COMPLETION_TOKENS
+        return cls(context_window(model) - completion, model)
+
+    def count(self, text: str) -> int:
+        return cached_count_tokens(text, self.model)
+
+    def pack(self, pieces: list[Piece], available: int) -> tuple[dict, list[Omission]]:
+        """The text of each piece within `available` tokens, and what was shortened"""
+        texts = {}
+        omissions = []
+        for piece in sorted(pieces, key=lambda p: -p.priority):
+            tokens = self.count(piece.text)
+            if tokens <= available:
+                texts[piece.name] = piece.text
+                available -= tokens
+                continue
+
+            text, action = "", "dropped"
+            if piece.summary is not None and self.count(piece.summary) <= available:
+                text, action = piece.summary, "summarized"
+            elif piece.truncate and available >= MIN_TRUNCATED_TOKENS:
+                marker = self.count(TRUNCATION_MARKER)
+                kept = truncate_text(
+                    piece.text,
+                    available - marker,
+                    self.model,
+                    piece.truncate,
+                    piece.separator,
+                )
+                if piece.truncate == "head":
+                    text = kept + TRUNCATION_MARKER
+                else:
+                    text = TRUNCATION_MARKER + kept
+                action = "truncated"
+
+            kept_tokens = self.count(text) if text else 0
+            texts[piece.name] = text
+            available -= kept_tokens
+            omissions.append(Omission(piece.name, action, tokens, kept_tokens))
+        return texts, omissions
+
+    def format(self, template: str, pieces: list[Piece], **fields) -> PackedPrompt:
+        """Formats template with fields as they are and pieces packed to fit"""
+        fixed = template.format(**fields, **{p.name: "" for p in pieces})
+        texts, omissions = self.pack(pieces, self.budget - self.count(fixed))
+        prompt = template.format(**fields, **texts)
+        return PackedPrompt(prompt, self.count(prompt), self.budget, omissions)
+
+
+def summarize_test_output(output: str) -> str:
+    """The failing assertions and summary lines of a pytest run"""
+    lines = [
+        line
+        for line in output.splitlines()
+        if re.match(r"(E |FAILED|ERROR|_{3,} .* _{3,}|={3,} .* ={3,})", line)
+    ]
+    return "\n".join(lines)
@@ -0,0 +1,124 @@
+"""A deterministic, offline LLM for tests and benchmarks of the agent machinery
+
+`FakeLLM` answers a prompt, in order of preference, with the response recorded for
+that exact prompt (`replay`, e.g. loaded from a run's transcripts), the response of
+the first `rules` pattern found in the prompt, or the next scripted `responses`.
+Every call sleeps for `latency` seconds to stand in for the network.
+
+    llm = FakeLLM.from_transcripts("./logs", latency=0.5)
+    run_agent("tdd", "HumanEval/0", filename, task, llm=llm)
+"""
+import asyncio
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator, Mapping
+
+from langchain.llms.base import LLM
+from langchain.llms.utils import enforce_stop_tokens
+from pydantic import PrivateAttr
+
+from prompt_to_code.agents.metering import count_tokens
+from prompt_to_code.agents.transcripts import read_transcripts
+
+# Canned answers for each step of the TDD agent
+TDD_RULES: list[tuple[str, str]] = [
+    (
+        r"# STUB FILE:",
+        '```python\ndef solution(*args):\n    """Returns the answer"""\n    ...\n```',
+    ),
+    (
+        r"# TESTS \(excluding function implementations\):",
+        "```python\ndef test_solution():\n    assert solution(1) == 1\n```",
+    ),
+    (
+        r"# CODE \(excluding tests\):",
+        "```python\ndef solution(x):\n    return x\n```",
+    ),
+    (r"# CORRECTED CODE:", "def solution(x):\n    return x\n```"),
+]
+
+# Shared by every FakeLLM so that instances stay picklable
+_lock = threading.Lock()
+
+
+class FakeLLM(LLM):
+    responses: list[str] = []
+    rules: list[tuple[str, str]] = []
+    replay: dict[str, str] = {}
+    latency: float = 0.0
+    model_name: str = "fake"
+    temperature: float = 0.0
+    calls: int = 0
+
+    _index: int = PrivateAttr(default=0)
+
+    @classmethod
+    def from_transcripts(
+        cls, path: str | Path, task: str | None = None, **kwargs
+    ) -> "FakeLLM":
+        """Replays the responses recorded in a transcript file or directory"""
+        replay = {t.prompt: t.response for t in read_transcripts(path, task=task)}
+        return cls(replay=replay, **kwargs)
+
+    @classmethod
+    def from_env(cls) -> "FakeLLM":
+        """Replays P2C_FAKE_LLM_TRANSCRIPTS if set, answering other prompts per step"""
+        kwargs = {
+            "rules": TDD_RULES,
+            "latency": float(os.environ.get("P2C_FAKE_LLM_LATENCY", 0)),
+        }
+        transcripts = os.environ.get("P2C_FAKE_LLM_TRANSCRIPTS")
+        if transcripts:
+            return cls.from_transcripts(transcripts, **kwargs)
+        return cls(**kwargs)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    @property
+    def _identifying_params(self) -> Mapping[str, Any]:
+        return {"model_name": self.model_name, "temperature": self.temperature}
+
+    def get_num_tokens(self, text: str) -> int:
+        # The base class loads a GPT-2 tokenizer, which needs the network
+        return count_tokens(text)
+
+    def respond(self, prompt: str) -> str:
+        with _lock:
+            self.calls += 1
+            if prompt in self.replay:
+                return self.replay[prompt]
+            for pattern, response in self.rules:
+                if re.search(pattern, prompt):
+                    return response
+            if not self.responses:
+                raise ValueError(f"FakeLLM has no response for: {prompt[:200]}")
+            response = self.responses[self._index % len(self.responses)]
+            self._index += 1
+            return response
+
+    def _call(self, prompt: str, stop: list[str] | None = None) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        response = self.respond(prompt)
+        return enforce_stop_tokens(response, stop) if stop else response
+
+    def stream(self, prompt: str, stop: list[str] | None = None) -> Iterator[str]:
+        """Yields the response a few characters at a time, as a streaming API would"""
+        if self.latency:
+            time.sleep(self.latency)
+        response = self.respond(prompt)
+        if stop:
+            response = enforce_stop_tokens(response, stop)
+        for match in re.finditer(r"\s*\S{1,4}|\s+$", response):
+            yield match[0]
+
+    async def _acall(self, prompt: str, stop: list[str] | None = None) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        response = self.respond(prompt)
+        return enforce_stop_tokens(response, stop) if stop else response
@@ -0,0 +1,91 @@
+"""A journal of the TDD steps finished for every task and sample of a run
+
+Each (task, sample) gets its own `NodeStore`, where the workflow saves the outputs
+of each step as soon as it finishes (stub code, functions section, tests, test
+results, code), and a completion record once the whole sample is done.  A restarted
+run skips the completed samples and resumes the others after their last finished
+step, so no LLM call whose result was saved is made again.  The samples of a task
+run together, sharing their stub and tests, save their steps in its `shared_store`.
+
+    journal = RunJournal("./examples/human_eval_tdd/.journal")
+    if not journal.is_complete(task_id, sample):
+        run_agent("tdd", task_id, filename, prompt, store=journal.store(task_id, sample))
+        journal.mark_complete(task_id, sample, failed)
+"""
+import json
+import os
+import re
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from prompt_to_code.agents.workflow import NodeStore
+
+COMPLETE = "complete.json"
+
+
+@dataclass
+class JournalSummary:
+    complete: int
+    in_progress: int  # samples, or tasks sharing steps, with some steps finished
+    steps: int  # finished steps of those in progress
+
+    def __str__(self):
+        return (
+            f"{self.complete} samples complete, {self.in_progress} in progress "
+            f"with {self.steps} finished steps"
+        )
+
+
+class RunJournal:
+    def __init__(self, root: Path | str):
+        self.root = Path(root)
+
+    def task_directory(self, task: str) -> Path:
+        return self.root / re.sub(r"[^\w.\-]+", "_", task)
+
+    def directory(self, task: str, sample: int = 0) -> Path:
+        return self.task_directory(task) / f"sample_{sample:04}"
+
+    def store(self, task: str, sample: int = 0) -> NodeStore:
+        return NodeStore(self.directory(task, sample))
+
+    def shared_store(self, task: str) -> NodeStore:
+        """The steps of all of task's samples run together, sharing some of them"""
+        return NodeStore(self.task_directory(task) / "shared")
+
+    def steps(self, task: str, sample: int = 0) -> list[str]:
+        """The steps finished for a sample, in the order they finished"""
+        paths = [
+            path
+            for path in self.directory(task, sample).glob("*.json")
+            if path.name != COMPLETE
+        ]
+        return [path.stem for path in sorted(paths, key=lambda p: p.stat().st_mtime)]
+
+    def is_complete(self, task: str, sample: int = 0) -> bool:
+        return (self.directory(task, sample) / COMPLETE).exists()
+
+    def mark_complete(self, task: str, sample: int = 0, failed: bool | None = None):
+        directory = self.directory(task, sample)
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp = directory / f"{COMPLETE}.{os.getpid()}.tmp"
+        tmp.write_text(json.dumps({"failed": failed, "time": time.time()}))
+        os.replace(tmp, directory / COMPLETE)
+
+    def summary(self) -> JournalSummary:
+        complete = in_progress = steps = 0
+        for directory in self.root.glob("*/sample_*"):
+            if (directory / COMPLETE).exists():
+                complete += 1
+            elif finished := len(list(directory.glob("*.json"))):
+                in_progress += 1
+                steps += finished
+        # The samples of a task run together are all marked complete when it ends
+        for directory in self.root.glob("*/shared"):
+            if any(directory.parent.glob(f"sample_*/{COMPLETE}")):
+                continue
+            if finished := len(list(directory.glob("*.json"))):
+                in_progress += 1
+                steps += finished
+        return JournalSummary(complete, in_progress, steps)
@@ -0,0 +1,211 @@
+"""Token and cost accounting for LLM calls
+
+Every call is recorded as a `UsageRecord` with real tokenizer counts for the prompt
+and completion, attributed to a run, task and step (stub/red/green/fix).  Records
+are kept in memory for summaries and optionally appended to a JSONL ledger.
+"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from pathlib import Path
+
+# USD per 1K tokens as (prompt, completion), matched on the longest model prefix
+PRICING: dict[str, tuple[float, float]] = {
+    "gpt-4-32k": (0.06, 0.12),
+    "gpt-4": (0.03, 0.06),
+    "gpt-3.5-turbo": (0.002, 0.002),
+    "text-davinci": (0.02, 0.02),
+    "code-davinci": (0.02, 0.02),
+    "text-curie": (0.002, 0.002),
+    "text-babbage": (0.0005, 0.0005),
+    "text-ada": (0.0004, 0.0004),
+}
+
+# Tokens added by the chat format: per message, plus priming of the reply
+CHAT_MESSAGE_OVERHEAD = 4
+CHAT_REPLY_OVERHEAD = 3
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """Returns the cached tiktoken encoder for a model, or None if none can be loaded"""
+    try:
+        import tiktoken
+
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"\tNo tokenizer for {model}, estimating token counts: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4") -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        # Roughly four characters per token for English and code
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_prompt_tokens(prompt: str, model: str, chat: bool) -> int:
+    """Counts the prompt tokens billed for a single-message completion or chat call"""
+    tokens = count_tokens(prompt, model)
+    if chat:
+        tokens += CHAT_MESSAGE_OVERHEAD + CHAT_REPLY_OVERHEAD
+    return tokens
+
+
+def price(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    matches = [key for key in PRICING if model.startswith(key)]
+    if not matches:
+        return 0.0
+    prompt_price, completion_price = PRICING[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+def model_name(llm) -> str:
+    return getattr(llm, "model_name", None) or type(llm).__name__
+
+
+@dataclass
+class UsageRecord:
+    run_id: str
+    task: str | None
+    step: str | None
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    cost: float
+    duration: float
+    timestamp: float
+    cached: bool = False
+    first_token: float | None = None  # seconds, when the completion was streamed
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+class Meter:
+    """Records the usage of every LLM call in a run, optionally to a JSONL ledger"""
+
+    def __init__(self, ledger: str | Path | None = None, run_id: str | None = None):
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.ledger = Path(ledger) if ledger else None
+        self.records: list[UsageRecord] = []
+        self._lock = threading.Lock()
+        if self.ledger is not None and not self.ledger.parent.exists():
+            self.ledger.parent.mkdir(parents=True, exist_ok=True)
+
+    def record(
+        self,
+        llm,
+        prompt: str,
+        completion: str,
+        duration: float,
+        task: str | None = None,
+        step: str | None = None,
+        cached: bool = False,
+        first_token: float | None = None,
+    ) -> UsageRecord:
+        model = model_name(llm)
+        chat = hasattr(llm, "call_as_llm")
+        prompt_tokens = count_prompt_tokens(prompt, model, chat)
+        completion_tokens = count_tokens(completion, model)
+        usage = UsageRecord(
+            run_id=self.run_id,
+            task=task,
+            step=step,
+            model=model,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            cost=0.0 if cached else price(model, prompt_tokens, completion_tokens),
+            duration=duration,
+            timestamp=time.time(),
+            cached=cached,
+            first_token=first_token,
+        )
+        with self._lock:
+            self.records.append(usage)
+            if self.ledger is not None:
+                # One short append per line keeps concurrent writers from interleaving
+                with open(self.ledger, "a") as f:
+                    f.write(json.dumps(asdict(usage)) + "\n")
+        return usage
+
+    def summary(
+        self, by: str = "step", task: str | None = None
+    ) -> dict[str, dict[str, float]]:
+        """Totals of calls, tokens, cost and duration grouped by a UsageRecord field"""
+        with self._lock:
+            records = [r for r in self.records if task is None or r.task == task]
+        return summarize(records, by=by)
+
+    def report(self, by: str = "step", task: str | None = None) -> str:
+        return format_summary(self.summary(by=by, task=task), by=by)
+
+
+def summarize(records: list[UsageRecord], by: str = "step"):
+    totals: dict[str, dict[str, float]] = defaultdict(
+        lambda: {
+            "calls": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "cost": 0.0,
+            "duration": 0.0,
+        }
+    )
+    for usage in records:
+        total = totals[str(getattr(usage, by))]
+        total["calls"] += 1
+        total["prompt_tokens"] += usage.prompt_tokens
+        total["completion_tokens"] += usage.completion_tokens
+        total["cost"] += usage.cost
+        total["duration"] += usage.duration
+    return dict(totals)
+
+
+def format_summary(summary: dict[str, dict[str, float]], by: str = "step") -> str:
+    lines = [
+        f"{by:<20} {'calls':>6} {'prompt':>9} {'completion':>11} {'cost':>9} {'seconds':>9}"
+    ]
+    for key, total in sorted(summary.items(), key=lambda x: -x[1]["cost"]):
+        lines.append(
+            f"{key:<20} {total['calls']:>6} {total['prompt_tokens']:>9} "
+            f"{total['completion_tokens']:>11} ${total['cost']:>8.4f} "
+            f"{total['duration']:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def read_ledger(path: str | Path) -> list[UsageRecord]:
+    with open(path) as f:
+        return [UsageRecord(**json.loads(line)) for line in f if line.strip()]
+
+
+_default_meter: Meter | None = None
+_default_meter_lock = threading.Lock()
+
+
+def get_meter() -> Meter:
+    """Returns the process-wide meter, writing to P2C_USAGE_LEDGER if it is set"""
+    global _default_meter
+    with _default_meter_lock:
+        if _default_meter is None:
+            _default_meter = Meter(
+                ledger=os.environ.get("P2C_USAGE_LEDGER") or None,
+                run_id=os.environ.get("P2C_RUN_ID") or None,
+            )
+    return _default_meter
+
+
+def set_meter(meter: Meter | None):
+    global _default_meter
+    _default_meter = meter
@@ -0,0 +1,122 @@
+"""A bounded, incrementally built scratchpad for the single action agent
+
+The scratchpad replays each step's thought/action and the tool's observation into
+the next prompt.  `Scratchpad` renders every step once, keeps the last `keep_recent`
+steps verbatim (with each observation capped at `max_observation_tokens`), shortens
+older steps to their first tokens and drops the oldest ones once the total exceeds
+`budget` tokens, so the prompt stops growing with the number of steps.
+"""
+import os
+from dataclasses import dataclass
+
+from prompt_to_code.agents.context import (
+    TRUNCATION_MARKER,
+    cached_count_tokens,
+    truncate_text,
+)
+
+DEFAULT_SCRATCHPAD_TOKENS = int(os.environ.get("P2C_SCRATCHPAD_TOKENS", 2000))
+
+
+@dataclass
+class _Step:
+    action: object
+    full: str
+    compact: str
+    full_tokens: int
+    compact_tokens: int
+
+
+class Scratchpad:
+    def __init__(
+        self,
+        budget: int = DEFAULT_SCRATCHPAD_TOKENS,
+        keep_recent: int = 2,
+        max_observation_tokens: int = 500,
+        compact_tokens: int = 48,
+        model: str = "gpt-4",
+    ):
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.max_observation_tokens = max_observation_tokens
+        self.compact_tokens = compact_tokens
+        self.model = model
+        self.reset()
+
+    def reset(self):
+        self._steps: list[_Step] = []
+        # Older steps in their compact form, steps before `_start` are dropped
+        self._start = 0
+        self._older = ""
+        self._older_tokens = 0
+
+    def _count(self, text: str) -> int:
+        return cached_count_tokens(text, self.model)
+
+    def _shorten(self, text: str, tokens: int) -> str:
+        if self._count(text) <= tokens:
+            return text
+        kept = truncate_text(text, tokens, self.model, "head", "\n")
+        lines = text.count("\n") - kept.count("\n")
+        marker = f" [{lines} more lines]" if lines else ""
+        return kept + TRUNCATION_MARKER.rstrip("\n") + marker
+
+    def _render(self, action, observation) -> _Step:
+        observation = str(observation)
+        full = (
+            f"{action.log}\nObservation: "
+            f"{self._shorten(observation, self.max_observation_tokens)}\nThought: "
+        )
+        compact = (
+            f"{self._shorten(action.log, self.compact_tokens)}\nObservation: "
+            f"{self._shorten(observation, self.compact_tokens)}\nThought: "
+        )
+        return _Step(action, full, compact, self._count(full), self._count(compact))
+
+    def _append_older(self, step: _Step):
+        self._older += step.compact
+        self._older_tokens += step.compact_tokens
+
+    def update(self, intermediate_steps: list[tuple]) -> str:
+        """The scratchpad for the agent's steps so far, rendering only new steps
+
+        The agent executor passes a list that grows by one step per call.  A list
+        that does not continue the previous one starts a new scratchpad.
+        """
+        steps = self._steps
+        if len(intermediate_steps) < len(steps) or any(
+            step.action is not action
+            for step, (action, _obs) in zip(
+                steps[-1:], intermediate_steps[len(steps) - 1 :]
+            )
+        ):
+            self.reset()
+            steps = self._steps
+
+        for action, observation in intermediate_steps[len(steps) :]:
+            steps.append(self._render(action, observation))
+            # The step leaving the recent window joins the older, compact steps
+            if len(steps) - self._start > self.keep_recent:
+                older = len(steps) - self.keep_recent - 1
+                if older >= self._start:
+                    self._append_older(steps[older])
+
+        recent = steps[max(self._start, len(steps) - self.keep_recent) :]
+        recent_tokens = sum(step.full_tokens for step in recent)
+        first_recent = len(steps) - len(recent)
+        if (
+            self._older_tokens + recent_tokens > self.budget
+            and self._start < first_recent
+        ):
+            # Drop the oldest steps, only rebuilding what remains within the budget
+            while self._start < first_recent and (
+                self._older_tokens + recent_tokens > self.budget
+            ):
+                self._older_tokens -= steps[self._start].compact_tokens
+                self._start += 1
+            self._older = "".join(s.compact for s in steps[self._start : first_recent])
+
+        prefix = ""
+        if self._start:
+            prefix = f"({self._start} earlier steps omitted)\n"
+        return prefix + self._older + "".join(step.full for step in recent)
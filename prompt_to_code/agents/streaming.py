@@ -0,0 +1,235 @@
+"""Streams LLM completions and stops them as soon as the useful part is complete
+
+Models tend to keep explaining after the closing fence of a code block, or after
+the input of an agent action.  An extractor is fed the completion chunk by chunk
+and reports when it has what it needs, at which point `stream_llm` stops reading
+and closes the request, so those tokens are neither waited on nor paid for.
+
+    result = stream_llm(llm, prompt, CodeBlockExtractor.for_prompt(prompt))
+    code = extract_code_from_response(result.text)
+    print(result.first_token, result.seconds, result.stopped_early)
+"""
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Iterator
+
+from langchain.schema import AgentAction, AgentFinish, HumanMessage
+
+FENCE = "```"
+# The action input ends where the model starts to make up the observation
+_ACTION_INPUT_END = re.compile(r"\n\s*(Observation|Thought):")
+
+
+class CodeBlockExtractor:
+    """Incrementally finds the first fenced code block of a completion
+
+    `inside` is for prompts that end with an opening fence, whose completion starts
+    with the code and ends with the closing fence.
+    """
+
+    def __init__(self, inside: bool = False):
+        self.text = ""
+        self.inside = inside
+        self.done = False
+        self._line_start = 0  # of the first line not yet scanned
+        self._end = None
+
+    @classmethod
+    def for_prompt(cls, prompt: str) -> "CodeBlockExtractor":
+        return cls(inside=re.search(r"```[\w\-]*\s*$", prompt) is not None)
+
+    def feed(self, chunk: str) -> bool:
+        """Adds a chunk of the completion, returns True once the block is closed"""
+        if self.done:
+            return True
+        self.text += chunk
+        while not self.done:
+            newline = self.text.find("\n", self._line_start)
+            line = self.text[self._line_start : newline if newline >= 0 else None]
+            fence = line.lstrip().startswith(FENCE)
+            if fence and self.inside:
+                # A closing fence has nothing after the backticks, so it can end
+                # the block before its newline arrives
+                self.done = True
+                self._end = self._line_start + len(line)
+            elif newline < 0:
+                break
+            else:
+                if fence:
+                    self.inside = True
+                self._line_start = newline + 1
+        return self.done
+
+    @property
+    def result(self) -> str:
+        """The completion up to and including the closing fence"""
+        return self.text[: self._end] if self.done else self.text
+
+
+class AgentActionExtractor:
+    """Incrementally reads an agent's `Action Input:` up to where it ends"""
+
+    def __init__(self):
+        self.text = ""
+        self.done = False
+        self._end = None
+
+    def feed(self, chunk: str) -> bool:
+        if self.done:
+            return True
+        self.text += chunk
+        start = self.text.find("Action Input:")
+        if start >= 0 and "Final Answer:" not in self.text:
+            match = _ACTION_INPUT_END.search(self.text, start)
+            if match:
+                self.done = True
+                self._end = match.start()
+        return self.done
+
+    @property
+    def result(self) -> str:
+        return self.text[: self._end] if self.done else self.text
+
+
+def parse_agent_action(llm_output: str) -> AgentAction | AgentFinish:
+    """Parses a completion of the single action agent into its action or answer"""
+    # Check if agent should finish
+    if "Final Answer:" in llm_output:
+        return AgentFinish(
+            # Return values is generally always a dictionary with a single `output` key
+            # It is not recommended to try anything else at the moment :)
+            return_values={"output": llm_output.split("Final Answer:")[-1].strip()},
+            log=llm_output,
+        )
+    # Parse out the action and action input
+    extractor = AgentActionExtractor()
+    extractor.feed(llm_output)
+    regex = r"Action: (.*?)[\n]*Action Input:[\s]*(.*)"
+    if match := re.search(regex, extractor.result, re.DOTALL):
+        action = match[1].strip()
+        action_input = match[2]
+        # Return the action and action input
+        return AgentAction(
+            tool=action,
+            tool_input=action_input.strip(" ")
+            .strip('"')
+            .strip("'")
+            .strip("```")
+            .strip('"""'),
+            log=llm_output,
+        )
+
+    regex = r"Thought:[\s]*(.*)"
+    if match := re.search(regex, llm_output, re.DOTALL):
+        return AgentAction(tool="Think", tool_input=match[1], log=llm_output)
+    else:
+        raise ValueError(f"Could not parse LLM output: `{llm_output}`")
+
+
+@dataclass
+class StreamResult:
+    text: str
+    first_token: float | None  # seconds until the first chunk
+    seconds: float
+    chunks: int
+    stopped_early: bool
+
+
+class StreamCancelled(Exception):
+    """The request was cancelled before its completion was done
+
+    `partial` is what was streamed before the cancel, None if the request was
+    never sent.  Its prompt and the streamed tokens are still billed.
+    """
+
+    def __init__(self, partial: StreamResult | None):
+        super().__init__("LLM request cancelled")
+        self.partial = partial
+
+
+def _chunk_text(chunk) -> str:
+    if isinstance(chunk, str):
+        return chunk
+    choice = chunk["choices"][0]
+    if "delta" in choice:
+        return choice["delta"].get("content", "")
+    return choice.get("text", "")
+
+
+def stream_completion(llm, prompt: str) -> Iterator[str]:
+    """Yields the text of a completion as it arrives
+
+    OpenAI chat and completion models stream through their clients, LLMs with a
+    `stream` method (e.g. `FakeLLM`) through it, and any other LLM yields its whole
+    completion at once.
+    """
+    if hasattr(llm, "_create_message_dicts"):
+        messages, params = llm._create_message_dicts(
+            [HumanMessage(content=prompt)], None
+        )
+        params["stream"] = True
+        chunks = llm.completion_with_retry(messages=messages, **params)
+    elif hasattr(llm, "stream"):
+        chunks = llm.stream(prompt)
+    elif hasattr(llm, "call_as_llm"):
+        chunks = [llm.call_as_llm(prompt)]
+    else:
+        chunks = [llm(prompt)]
+
+    try:
+        for chunk in chunks:
+            text = _chunk_text(chunk)
+            if text:
+                yield text
+    finally:
+        # Stops reading the response when the consumer stops early
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def stream_llm(
+    llm, prompt: str, extractor=None, cancel: threading.Event | None = None
+) -> StreamResult:
+    """Streams a completion into extractor, stopping once it is done
+
+    Setting `cancel` closes the request at its next chunk and raises
+    `StreamCancelled`.  LLMs that do not stream can only be cancelled before the
+    request is sent.
+    """
+    if cancel is not None and cancel.is_set():
+        raise StreamCancelled(None)
+    start = time.perf_counter()
+    first_token = None
+    chunks = 0
+    text = ""
+    stopped_early = cancelled = False
+    stream = stream_completion(llm, prompt)
+    try:
+        for chunk in stream:
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            chunks += 1
+            text += chunk
+            if extractor is not None and extractor.feed(chunk):
+                stopped_early = True
+                break
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                break
+    finally:
+        stream.close()
+    if extractor is not None and not cancelled:
+        text = extractor.result
+    result = StreamResult(
+        text=text,
+        first_token=first_token,
+        seconds=time.perf_counter() - start,
+        chunks=chunks,
+        stopped_early=stopped_early,
+    )
+    if cancelled:
+        raise StreamCancelled(result)
+    return result
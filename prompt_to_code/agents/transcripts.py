@@ -0,0 +1,224 @@
+"""A buffered store of LLM transcripts, one compressed JSONL file per run and process
+
+`TranscriptStore.append` only queues a record; a background thread serializes
+queued records and appends them as one gzip member per batch.  Concatenated gzip
+members form a valid gzip file, so `gzip.open` reads the whole file and a crash
+can only lose the batch that was being written.
+
+    for t in read_transcripts("./logs", task="HumanEval/0", step="green"):
+        print(t.prompt, t.response)
+"""
+import argparse
+import atexit
+import glob
+import gzip
+import json
+import os
+import queue
+import threading
+import zlib
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Iterator
+
+from prompt_to_code.agents.metering import UsageRecord, get_meter
+
+DEFAULT_DIRECTORY = "./logs"
+# Queued to write the current batch now, and to stop the writer thread
+_FLUSH = object()
+_CLOSE = object()
+
+
+@dataclass
+class Transcript:
+    run_id: str
+    task: str | None
+    step: str | None
+    prefix: str
+    model: str
+    prompt: str
+    response: str
+    prompt_tokens: int
+    completion_tokens: int
+    cost: float
+    duration: float
+    timestamp: float
+    cached: bool = False
+
+
+class TranscriptStore:
+    """Appends transcripts to `{directory}/transcripts-{run_id}-{pid}.jsonl.gz`
+
+    Records are written when `batch_size` are queued or `flush_interval` seconds
+    have passed, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path = DEFAULT_DIRECTORY,
+        run_id: str = "run",
+        batch_size: int = 64,
+        flush_interval: float = 1.0,
+    ):
+        self.directory = Path(directory)
+        self.path = self.directory / f"transcripts-{run_id}-{os.getpid()}.jsonl.gz"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._write_loop, name="p2c-transcripts", daemon=True
+        )
+        self._thread.start()
+
+    def append(self, transcript: Transcript):
+        if self._closed:
+            raise RuntimeError("TranscriptStore is closed")
+        self._queue.put(transcript)
+
+    def flush(self):
+        """Blocks until every appended transcript has been written"""
+        if not self._closed:
+            self._queue.put(_FLUSH)
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            # Collect more records until the batch is full or the queue stays quiet
+            while batch[-1] not in (_FLUSH, _CLOSE) and len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=self.flush_interval))
+                except queue.Empty:
+                    break
+            records = [t for t in batch if isinstance(t, Transcript)]
+            try:
+                if records:
+                    self._write(records)
+            except Exception as e:
+                print(f"\tFailed to write {len(records)} transcripts: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if batch[-1] is _CLOSE:
+                return
+
+    def _write(self, records: list[Transcript]):
+        if not self.directory.exists():
+            self.directory.mkdir(parents=True, exist_ok=True)
+        data = "".join(json.dumps(asdict(t)) + "\n" for t in records)
+        with open(self.path, "ab") as f:
+            f.write(gzip.compress(data.encode()))
+
+
+def transcript_files(path: str | Path = DEFAULT_DIRECTORY) -> list[Path]:
+    """The transcript files in a directory, or the file itself"""
+    path = Path(path)
+    if path.is_file():
+        return [path]
+    return [Path(p) for p in sorted(glob.glob(str(path / "transcripts-*.jsonl.gz")))]
+
+
+def _read_lines(path: Path) -> Iterator[str]:
+    try:
+        with gzip.open(path, "rt") as f:
+            yield from f
+    except (EOFError, gzip.BadGzipFile, zlib.error):
+        # The last batch of a process that was killed while writing
+        return
+
+
+def read_transcripts(
+    path: str | Path = DEFAULT_DIRECTORY,
+    task: str | None = None,
+    step: str | None = None,
+    run_id: str | None = None,
+) -> Iterator[Transcript]:
+    """Yields the transcripts in a file or directory, optionally filtered"""
+    for fname in transcript_files(path):
+        for line in _read_lines(fname):
+            if not line.strip():
+                continue
+            try:
+                transcript = Transcript(**json.loads(line))
+            except (ValueError, TypeError):
+                # A line cut short by a truncated batch
+                continue
+            if task is not None and transcript.task != task:
+                continue
+            if step is not None and transcript.step != step:
+                continue
+            if run_id is not None and transcript.run_id != run_id:
+                continue
+            yield transcript
+
+
+def transcript_from_usage(
+    usage: UsageRecord, prefix: str, prompt: str, response: str
+) -> Transcript:
+    return Transcript(
+        run_id=usage.run_id,
+        task=usage.task,
+        step=usage.step,
+        prefix=prefix,
+        model=usage.model,
+        prompt=prompt,
+        response=response,
+        prompt_tokens=usage.prompt_tokens,
+        completion_tokens=usage.completion_tokens,
+        cost=usage.cost,
+        duration=usage.duration,
+        timestamp=usage.timestamp,
+        cached=usage.cached,
+    )
+
+
+_stores: dict[Path, TranscriptStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_transcript_store(directory: str | Path | None = None) -> TranscriptStore:
+    """Returns this process's store for a directory, P2C_TRANSCRIPT_DIR by default"""
+    directory = Path(
+        directory or os.environ.get("P2C_TRANSCRIPT_DIR") or DEFAULT_DIRECTORY
+    ).resolve()
+    with _stores_lock:
+        store = _stores.get(directory)
+        # A forked child inherits the store but not its writer thread
+        if store is None or not store._thread.is_alive():
+            store = TranscriptStore(directory, run_id=get_meter().run_id)
+            _stores[directory] = store
+            atexit.register(store.close)
+    return store
+
+
+def flush_transcripts():
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        store.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print LLM transcripts")
+    parser.add_argument("path", nargs="?", default=DEFAULT_DIRECTORY)
+    parser.add_argument("--task")
+    parser.add_argument("--step")
+    parser.add_argument("--run-id")
+    args = parser.parse_args()
+    for t in read_transcripts(
+        args.path, task=args.task, step=args.step, run_id=args.run_id
+    ):
+        print("=" * 80)
+        print(f"{t.task} {t.step} {t.prefix} {t.model} {t.duration:.1f}s ${t.cost:.4f}")
+        print("=" * 80)
+        print(t.prompt)
+        print("-" * 80)
+        print(t.response)
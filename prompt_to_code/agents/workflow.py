@@ -0,0 +1,221 @@
+"""A small DAG scheduler for agent steps with persisted, resumable node results
+
+A `Workflow` is a set of `Node`s, each a function from its declared inputs to its
+declared outputs (a dict).  A node runs as soon as all of its inputs are known, so
+independent nodes run concurrently on a thread pool.  With a `NodeStore` every
+finished node's outputs are saved, keyed on a hash of its inputs, and a later run
+with the same inputs loads them instead of running the node again.  Nodes with side
+effects (e.g. writing a file) can `restore` them from loaded outputs.
+
+    workflow = Workflow([
+        Node("stub", make_stub, inputs=("task",), outputs=("stub_code",)),
+        Node("tests", make_tests, inputs=("task",), outputs=("test_code",)),
+        Node("code", make_code, inputs=("stub_code", "test_code"), outputs=("code",)),
+    ], store=NodeStore("./runs/task-0"))
+    values = workflow.run(task=task)
+"""
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import copy_context
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+from prompt_to_code.tracing import span
+
+
+@dataclass
+class Node:
+    name: str
+    func: Callable[..., dict]  # called with its inputs as keyword arguments
+    inputs: tuple[str, ...] = ()
+    outputs: tuple[str, ...] = ()
+    # Redoes the node's side effects from outputs loaded from the store
+    restore: Callable[[dict], None] | None = None
+
+    def branch(self, suffix: str, shared: tuple[str, ...] = ()) -> "Node":
+        """A copy of the node for another branch of a fan-out
+
+        Its name and values get the suffix, except the `shared` input values, which
+        are the same for every branch.
+        """
+        inputs = {v if v in shared else v + suffix: v for v in self.inputs}
+        outputs = {v: v + suffix for v in self.outputs}
+
+        def func(**values):
+            results = self.func(**{inputs[k]: value for k, value in values.items()})
+            return {outputs.get(k, k): value for k, value in results.items()}
+
+        restore = None
+        if self.restore is not None:
+
+            def _restore(loaded):
+                self.restore({k: loaded[v] for k, v in outputs.items()})
+
+            restore = _restore
+
+        return Node(
+            self.name + suffix,
+            func,
+            tuple(inputs),
+            tuple(outputs.values()),
+            restore,
+        )
+
+
+@dataclass
+class NodeResult:
+    name: str
+    outputs: dict
+    seconds: float
+    loaded: bool = False  # from the store instead of run
+
+
+def inputs_key(values: dict) -> str:
+    data = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class NodeStore:
+    """Saves each node's outputs as JSON in a directory, one file per node"""
+
+    def __init__(self, directory: Path | str):
+        self.directory = Path(directory)
+
+    def _path(self, name: str) -> Path:
+        return self.directory / f"{name}.json"
+
+    def load(self, name: str, key: str) -> dict | None:
+        """The outputs saved for node name with the same inputs, or None"""
+        try:
+            saved = json.loads(self._path(name).read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return saved["outputs"] if saved.get("key") == key else None
+
+    def save(self, name: str, key: str, outputs: dict, seconds: float):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self._path(name)
+        # Written whole or not at all, a crash must not leave a truncated result
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"key": key, "outputs": outputs, "seconds": seconds}))
+        os.replace(tmp, path)
+
+    def clear(self):
+        for path in self.directory.glob("*.json"):
+            path.unlink()
+
+
+class Workflow:
+    def __init__(
+        self,
+        nodes: list[Node],
+        store: NodeStore | None = None,
+        max_workers: int | None = None,
+    ):
+        self.nodes = {node.name: node for node in nodes}
+        if len(self.nodes) != len(nodes):
+            raise ValueError("Node names must be unique")
+        self.producers = {}
+        for node in nodes:
+            for output in node.outputs:
+                if output in self.producers:
+                    raise ValueError(
+                        f"{output} is an output of both {self.producers[output]} "
+                        f"and {node.name}"
+                    )
+                self.producers[output] = node.name
+        self._check_acyclic()
+        self.store = store
+        self.max_workers = max_workers or len(nodes)
+        self.results: dict[str, NodeResult] = {}
+
+    def _check_acyclic(self):
+        state = {}  # 1 while visiting, 2 once done
+
+        def visit(name, path):
+            if state.get(name) == 2:
+                return
+            if state.get(name) == 1:
+                raise ValueError(f"Cycle in the workflow: {' -> '.join(path)}")
+            state[name] = 1
+            for value in self.nodes[name].inputs:
+                if value in self.producers:
+                    visit(self.producers[value], path + [self.producers[value]])
+            state[name] = 2
+
+        for name in self.nodes:
+            visit(name, [name])
+
+    def _run_node(self, node: Node, inputs: dict) -> NodeResult:
+        key = inputs_key(inputs)
+        if self.store is not None:
+            outputs = self.store.load(node.name, key)
+            if outputs is not None:
+                if node.restore is not None:
+                    node.restore(outputs)
+                return NodeResult(node.name, outputs, 0.0, loaded=True)
+
+        start = time.perf_counter()
+        with span("workflow_node", node=node.name):
+            outputs = node.func(**inputs)
+        seconds = time.perf_counter() - start
+        missing = set(node.outputs) - set(outputs)
+        if missing:
+            raise ValueError(f"Node {node.name} did not return {sorted(missing)}")
+        if self.store is not None:
+            self.store.save(node.name, key, outputs, seconds)
+        return NodeResult(node.name, outputs, seconds)
+
+    def run(self, **values) -> dict:
+        """Runs every node once its inputs are known and returns all the values
+
+        The first node to raise stops the run once the running nodes finish, the
+        results of the nodes that finished are kept in the store.
+        """
+        values = dict(values)
+        missing = {
+            value
+            for node in self.nodes.values()
+            for value in node.inputs
+            if value not in self.producers and value not in values
+        }
+        if missing:
+            raise ValueError(f"Missing workflow inputs: {sorted(missing)}")
+
+        self.results = {}
+        pending = dict(self.nodes)
+        running = {}
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            while pending or running:
+                for name, node in list(pending.items()):
+                    if all(value in values for value in node.inputs):
+                        inputs = {value: values[value] for value in node.inputs}
+                        future = executor.submit(
+                            copy_context().run, self._run_node, node, inputs
+                        )
+                        running[future] = pending.pop(name)
+                if not running:
+                    raise RuntimeError(f"Nodes never ready: {sorted(pending)}")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        # Let the other nodes finish so that their results are saved
+                        wait(running)
+                        raise error
+                    result = future.result()
+                    self.results[result.name] = result
+                    values.update(result.outputs)
+        return values
+
+    def report(self) -> str:
+        lines = []
+        for result in self.results.values():
+            how = "loaded" if result.loaded else f"{result.seconds:.1f}s"
+            lines.append(f"\t{result.name}: {how}")
+        return "\n".join(lines)
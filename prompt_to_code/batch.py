@@ -0,0 +1,276 @@
+"""Runs a JSONL file of prompts concurrently, writing results as they finish
+
+Each line of the requests file is a JSON object with a `prompt` (or `body`) and
+optionally an `id` (or `request_id`), an `agent`, a `language` and a `name` for the
+generated file.  Requests are read as they are needed, at most `concurrency` run at
+once, each in its own directory under `outdir`, and every result is appended to the
+output JSONL and flushed as soon as it is known.  Running the same batch again
+skips the requests that already finished, so an interrupted batch resumes where it
+stopped and only requests that raised an error are retried.
+
+    summary = run_batch("requests.jsonl", outdir="./batch", concurrency=8)
+    print(summary)
+"""
+import dataclasses
+import json
+import logging
+import os
+import re
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+from prompt_to_code.config import PromptToCodeConfig
+from prompt_to_code.logger import create_logger
+
+DEFAULT_BATCH_CONCURRENCY = int(os.environ.get("P2C_BATCH_CONCURRENCY", 4))
+
+
+@dataclass
+class BatchRequest:
+    id: str
+    prompt: str
+    agent: str | None = None  # the batch's agent if None
+    language: str = "python3"
+    name: str | None = None  # of the file written by the TDD agents
+
+
+@dataclass
+class BatchSummary:
+    output: Path
+    passed: int = 0
+    failed: int = 0  # the agent finished but its tests fail
+    errors: int = 0
+    skipped: int = 0  # finished in an earlier run
+    seconds: float = 0.0
+
+    def __str__(self):
+        return (
+            f"{self.passed} passed, {self.failed} failed, {self.errors} errors, "
+            f"{self.skipped} skipped in {self.seconds:.1f}s, results in {self.output}"
+        )
+
+
+def read_requests(path: Path | str) -> Iterator[BatchRequest]:
+    """The requests of a JSONL file, read one line at a time"""
+    with open(path) as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            prompt = data.get("prompt", data.get("body"))
+            if not prompt:
+                raise ValueError(f"{path}:{number} has no prompt")
+            yield BatchRequest(
+                id=str(data.get("id", data.get("request_id", number))),
+                prompt=prompt,
+                agent=data.get("agent"),
+                language=data.get("language", "python3"),
+                name=data.get("name"),
+            )
+
+
+def read_results(path: Path | str) -> dict[str, dict]:
+    """The latest result of each request id, ignoring a line cut short by a crash"""
+    results = {}
+    if not Path(path).exists():
+        return results
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            results[result["id"]] = result
+    return results
+
+
+class ResultWriter:
+    """Appends results to a JSONL file from any thread, one flushed line each"""
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(self.path, "a")
+        if _ends_mid_line(self.path):
+            # End the line a crash cut short, so the next result is a line of its own
+            self._file.write("\n")
+            self._file.flush()
+
+    def write(self, result: dict):
+        line = json.dumps(result) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _ends_mid_line(path: Path) -> bool:
+    with open(path, "rb") as f:
+        if f.seek(0, os.SEEK_END) == 0:
+            return False
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) != b"\n"
+
+
+def request_directory(outdir: Path, request_id: str) -> Path:
+    return outdir / re.sub(r"[^\w.\-]+", "_", request_id)
+
+
+def run_request(
+    request: BatchRequest,
+    outdir: Path,
+    agent: str = "default",
+    config: PromptToCodeConfig | None = None,
+    llm=None,
+    workspaces=None,
+    logger: logging.Logger | None = None,
+) -> dict:
+    """Runs one request in its own directory, returning its result
+
+    With a `WorkspacePool` the directory is the request's own git worktree, and the
+    TDD agents commit their code on the request's branch.  `logger` is the default
+    agent's, shared by the requests of a batch.
+    """
+    agent = request.agent or agent
+    result = {"id": request.id, "agent": agent}
+    start = time.perf_counter()
+    try:
+        with ExitStack() as stack:
+            workspace = None
+            if workspaces is not None:
+                workspace = stack.enter_context(workspaces.workspace(request.id))
+                directory = workspace.path
+                result["branch"] = workspace.branch
+            else:
+                directory = request_directory(outdir, request.id)
+                directory.mkdir(parents=True, exist_ok=True)
+            result["directory"] = str(directory)
+
+            if agent == "default":
+                from prompt_to_code.agent import run
+
+                config = dataclasses.replace(
+                    config or PromptToCodeConfig(), output_directory=directory
+                )
+                output = run(
+                    request.prompt,
+                    request.language,
+                    agent,
+                    config=config,
+                    logger=logger,
+                )
+                result.update(status="ok", output=output)
+            else:
+                from prompt_to_code.agents.agents import run_agent
+
+                filename = Path(f"{request.name or 'main'}.py")
+                if workspace is None:
+                    filename = directory / filename
+                _test_results, failed = run_agent(
+                    agent,
+                    request.id,
+                    filename,
+                    request.prompt,
+                    llm=llm,
+                    workspace=workspace,
+                )
+                result.update(
+                    status="failed" if failed else "ok",
+                    output=str(directory / filename.name),
+                )
+    except Exception as e:
+        result.update(
+            status="error",
+            error=f"{type(e).__name__}: {e}",
+            traceback=traceback.format_exc(),
+        )
+    result["seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def run_batch(
+    requests: Path | str,
+    output: Path | str | None = None,
+    outdir: Path | str = ".",
+    concurrency: int = DEFAULT_BATCH_CONCURRENCY,
+    agent: str = "default",
+    config: PromptToCodeConfig | None = None,
+    resume: bool = True,
+    llm=None,
+    on_result=None,
+    workspaces=None,
+) -> BatchSummary:
+    """Runs every request of a JSONL file, at most `concurrency` at a time
+
+    Results go to `output` (by default `results.jsonl` in `outdir`) as each request
+    finishes.  With `resume`, requests with a result there other than "error" are
+    skipped.  With a `WorkspacePool` each request runs in a worktree of its repo.
+    """
+    outdir = Path(outdir)
+    output = Path(output) if output is not None else outdir / "results.jsonl"
+    summary = BatchSummary(output)
+    done = set()
+    if resume:
+        done = {i for i, r in read_results(output).items() if r["status"] != "error"}
+
+    # Created for the first request of the default agent, each adds its handlers
+    logger = None
+    start = time.perf_counter()
+    with ResultWriter(output) as writer, ThreadPoolExecutor(concurrency) as executor:
+        running = set()
+
+        def finish(futures):
+            for future in futures:
+                result = future.result()
+                writer.write(result)
+                if result["status"] == "ok":
+                    summary.passed += 1
+                elif result["status"] == "failed":
+                    summary.failed += 1
+                else:
+                    summary.errors += 1
+                if on_result is not None:
+                    on_result(result)
+
+        for request in read_requests(requests):
+            if request.id in done:
+                summary.skipped += 1
+                continue
+            # Wait for a free slot before reading on, so a huge file is never held
+            # in memory
+            if len(running) >= concurrency:
+                finished, running = wait(running, return_when=FIRST_COMPLETED)
+                finish(finished)
+            if logger is None and (request.agent or agent) == "default":
+                config = config or PromptToCodeConfig()
+                logger = create_logger(config.logging)
+            running.add(
+                executor.submit(
+                    run_request,
+                    request,
+                    outdir,
+                    agent,
+                    config,
+                    llm,
+                    workspaces,
+                    logger,
+                )
+            )
+        finish(wait(running).done)
+    summary.seconds = time.perf_counter() - start
+    return summary
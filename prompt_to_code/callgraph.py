@@ -0,0 +1,449 @@
+"""A project-wide call graph stored as compressed sparse rows of interned ids
+
+Every function, method, class and module of a repository gets a dotted name
+(`pkg.mod.Class.method`) interned to an integer id.  Calls are resolved across
+modules through `import`/`from ... import` aliases (including relative imports and
+re-exports from `__init__.py`), `self.`/`cls.` attribute calls and module
+attributes, then stored as caller -> callee edges weighted by the number of call
+sites.  Calls on local variables cannot be resolved without types and are dropped.
+
+The edges of each file are kept as integer arrays, so updating one file only
+re-extracts that file (and re-resolves the files that import from it); the CSR
+arrays used by queries are rebuilt from them with a few vectorised NumPy passes.
+
+    graph = CallGraph("path/to/repo")
+    graph.update()
+    graph.callers("pkg.mod.parse", k=5)
+"""
+import ast
+import os
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+
+from prompt_to_code.indexer import PARALLEL_THRESHOLD, iter_source_files
+
+# Re-exports followed when resolving a name, e.g. `pkg.f` -> `pkg.mod.f`
+MAX_ALIAS_HOPS = 8
+
+
+@dataclass
+class FileCalls:
+    """What one file defines, imports and calls, before resolution"""
+
+    path: str
+    module: str
+    definitions: list[str] = field(default_factory=list)
+    classes: set[str] = field(default_factory=set)
+    # Local alias -> dotted name it refers to
+    imports: dict[str, str] = field(default_factory=dict)
+    # (caller, dotted callee expression, enclosing class or None) -> call sites
+    calls: Counter = field(default_factory=Counter)
+    error: str | None = None
+
+    @property
+    def names(self) -> set[str]:
+        """The top-level names defined in the module"""
+        prefix = len(self.module) + 1
+        return {d[prefix:].split(".", 1)[0] for d in self.definitions}
+
+
+def module_name(relpath: str) -> str:
+    """The dotted module of a path relative to the root, e.g. `pkg/__init__.py` -> `pkg`"""
+    parts = Path(relpath).with_suffix("").parts
+    if parts and parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join(parts)
+
+
+def _dotted(node: ast.expr) -> str | None:
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+class CallExtractor(ast.NodeVisitor):
+    def __init__(self, calls: FileCalls, is_package: bool):
+        self.file = calls
+        # The package that relative imports start from
+        self.package = calls.module.split(".")
+        if not is_package:
+            self.package = self.package[:-1]
+        self.scope: list[str] = [calls.module]
+        self.current_class: str | None = None
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            if alias.asname:
+                self.file.imports[alias.asname] = alias.name
+            else:
+                head = alias.name.split(".", 1)[0]
+                self.file.imports[head] = head
+
+    def visit_ImportFrom(self, node):
+        base = node.module or ""
+        if node.level:
+            package = self.package[: len(self.package) - (node.level - 1)]
+            base = ".".join(package + ([node.module] if node.module else []))
+        for alias in node.names:
+            if alias.name != "*":
+                target = f"{base}.{alias.name}" if base else alias.name
+                self.file.imports[alias.asname or alias.name] = target
+
+    def _visit_scope(self, node, is_class: bool):
+        qualname = f"{self.scope[-1]}.{node.name}"
+        self.file.definitions.append(qualname)
+        if is_class:
+            self.file.classes.add(qualname)
+
+        # Decorators, defaults and bases are evaluated in the enclosing scope
+        for child in node.decorator_list:
+            self.visit(child)
+        for child in getattr(node, "bases", []):
+            self.visit(child)
+        if not is_class:
+            self.visit(node.args)
+
+        outer_class = self.current_class
+        self.current_class = qualname if is_class else outer_class
+        self.scope.append(qualname)
+        for child in node.body:
+            self.visit(child)
+        self.scope.pop()
+        self.current_class = outer_class
+
+    def visit_FunctionDef(self, node):
+        self._visit_scope(node, is_class=False)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        self._visit_scope(node, is_class=True)
+
+    def visit_Call(self, node):
+        callee = _dotted(node.func)
+        if callee is not None:
+            # Methods defined directly in a class body call through `self`
+            cls = self.current_class if self.scope[-1] != self.current_class else None
+            self.file.calls[(self.scope[-1], callee, cls)] += 1
+        self.generic_visit(node)
+
+
+def extract_calls(relpath: str, source: str | bytes) -> FileCalls:
+    """Parses one file, recording the error instead of raising"""
+    calls = FileCalls(path=relpath, module=module_name(relpath))
+    try:
+        tree = ast.parse(source, filename=relpath)
+    except (SyntaxError, ValueError, RecursionError) as e:
+        calls.error = f"{type(e).__name__}: {e}"
+        return calls
+    calls.definitions.append(calls.module)
+    CallExtractor(calls, is_package=Path(relpath).stem == "__init__").visit(tree)
+    return calls
+
+
+def _extract_file(root: str, relpath: str) -> FileCalls:
+    """Runs in a worker process"""
+    return extract_calls(relpath, (Path(root) / relpath).read_bytes())
+
+
+class CallGraph:
+    """Resolved caller -> callee edges between the functions of a repository"""
+
+    def __init__(self, root: str | Path, workers: int | None = None):
+        self.root = Path(root).resolve()
+        self.workers = workers
+        # Interned node names, ids are never reused
+        self.names: list[str] = []
+        self.ids: dict[str, int] = {}
+
+        self._files: dict[str, FileCalls] = {}
+        self._modules: dict[str, FileCalls] = {}
+        self._signatures: dict[str, tuple[int, int]] = {}
+        self._definitions: set[str] = set()
+        self._classes: set[str] = set()
+        # Per file: (caller ids, callee ids, call sites) and the modules consulted
+        self._edges: dict[str, tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        self._depends: dict[str, set[str]] = {}
+        self._csr = None
+
+    def intern(self, name: str) -> int:
+        node = self.ids.get(name)
+        if node is None:
+            node = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return node
+
+    # Building
+
+    def update(self, paths: list[str | Path] | None = None) -> list[str]:
+        """Re-extracts the files whose size or mtime changed, returns their paths
+
+        With `paths` (e.g. from a file watcher) only those files are considered.
+        """
+        if paths is None:
+            files = {
+                f.relative_to(self.root).as_posix()
+                for f in iter_source_files(self.root)
+            }
+            candidates = files | set(self._files)
+        else:
+            candidates = {
+                (self.root / p).resolve().relative_to(self.root).as_posix()
+                for p in paths
+            }
+
+        changed, removed = [], []
+        for relpath in sorted(candidates):
+            try:
+                stat = (self.root / relpath).stat()
+            except FileNotFoundError:
+                if relpath in self._files:
+                    removed.append(relpath)
+                continue
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if self._signatures.get(relpath) != signature:
+                self._signatures[relpath] = signature
+                changed.append(relpath)
+
+        self._apply(self._extract(changed), removed)
+        return changed + removed
+
+    def update_source(self, relpath: str, source: str | bytes):
+        """Replaces one file with source that may not be saved yet"""
+        self._apply([extract_calls(relpath, source)], [])
+
+    def remove(self, relpath: str):
+        self._apply([], [relpath])
+
+    def _extract(self, relpaths: list[str]) -> list[FileCalls]:
+        if len(relpaths) < PARALLEL_THRESHOLD or self.workers == 1:
+            return [_extract_file(str(self.root), p) for p in relpaths]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return list(
+                executor.map(
+                    _extract_file,
+                    [str(self.root)] * len(relpaths),
+                    relpaths,
+                    chunksize=32,
+                )
+            )
+
+    def _apply(self, extracted: list[FileCalls], removed: list[str]):
+        modules = set()
+        for relpath in removed:
+            old = self._files.pop(relpath, None)
+            self._signatures.pop(relpath, None)
+            self._edges.pop(relpath, None)
+            self._depends.pop(relpath, None)
+            if old is not None:
+                modules.add(old.module)
+                self._modules.pop(old.module, None)
+        for calls in extracted:
+            old = self._files.get(calls.path)
+            if old is not None:
+                self._modules.pop(old.module, None)
+            self._files[calls.path] = calls
+            self._modules[calls.module] = calls
+            modules.add(calls.module)
+        if not modules:
+            return
+
+        self._definitions = {d for f in self._files.values() for d in f.definitions}
+        self._classes = {c for f in self._files.values() for c in f.classes}
+
+        # Files resolved through a changed module may now resolve differently
+        stale = {c.path for c in extracted}
+        for relpath, depends in self._depends.items():
+            if depends & modules:
+                stale.add(relpath)
+        for relpath in stale:
+            self._resolve_file(self._files[relpath])
+        self._csr = None
+
+    # Resolution
+
+    def _reexport(self, name: str) -> str | None:
+        """What name refers to if its longest known module imports it, e.g. in `__init__`"""
+        parts = name.split(".")
+        for i in range(len(parts) - 1, 0, -1):
+            module = self._modules.get(".".join(parts[:i]))
+            if module is not None:
+                target = module.imports.get(parts[i])
+                return ".".join([target] + parts[i + 1 :]) if target else None
+        return None
+
+    def _canonical(self, name: str, consulted: set[str]) -> str:
+        """Follows re-exports until name is a definition, or gives up"""
+        for _ in range(MAX_ALIAS_HOPS):
+            # Adding any module along the way may change the resolution
+            parts = name.split(".")
+            consulted.update(".".join(parts[:i]) for i in range(1, len(parts)))
+            if name in self._definitions:
+                break
+            target = self._reexport(name)
+            if target is None:
+                break
+            name = target
+        if name in self._classes and f"{name}.__init__" in self._definitions:
+            return f"{name}.__init__"
+        return name
+
+    def _resolve(self, calls: FileCalls, local: set[str], callee: str, cls, consulted):
+        head, _, rest = callee.partition(".")
+        if head in ("self", "cls") and cls and rest:
+            candidate = f"{cls}.{rest}"
+        elif head in calls.imports:
+            candidate = calls.imports[head] + (f".{rest}" if rest else "")
+        elif head in local:
+            candidate = f"{calls.module}.{callee}"
+        elif not rest:
+            # A builtin or a name this file never defines
+            return callee
+        else:
+            return None
+        return self._canonical(candidate, consulted)
+
+    def _resolve_file(self, calls: FileCalls):
+        consulted = {calls.module}
+        local = calls.names
+        callers, callees, weights = [], [], []
+        for (caller, callee, cls), count in calls.calls.items():
+            target = self._resolve(calls, local, callee, cls, consulted)
+            if target is None:
+                continue
+            callers.append(self.intern(caller))
+            callees.append(self.intern(target))
+            weights.append(count)
+        self._edges[calls.path] = (
+            np.array(callers, dtype=np.int64),
+            np.array(callees, dtype=np.int64),
+            np.array(weights, dtype=np.int64),
+        )
+        self._depends[calls.path] = consulted
+
+    # Queries
+
+    def _build_csr(self):
+        """Sums duplicate edges and returns forward and reverse CSR arrays"""
+        n = len(self.names)
+        arrays = list(self._edges.values())
+        if arrays:
+            src = np.concatenate([a[0] for a in arrays])
+            dst = np.concatenate([a[1] for a in arrays])
+            weight = np.concatenate([a[2] for a in arrays])
+        else:
+            src = dst = weight = np.zeros(0, dtype=np.int64)
+
+        def csr(rows, columns):
+            order = np.lexsort((columns, rows))
+            rows, columns, w = rows[order], columns[order], weight[order]
+            if len(rows):
+                starts = np.flatnonzero(
+                    np.r_[True, (np.diff(rows) != 0) | (np.diff(columns) != 0)]
+                )
+                w = np.add.reduceat(w, starts)
+                rows, columns = rows[starts], columns[starts]
+            indptr = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(rows, minlength=n), out=indptr[1:])
+            return indptr, columns.astype(np.int32), w.astype(np.int32)
+
+        return csr(src, dst), csr(dst, src)
+
+    @property
+    def csr(self):
+        """((indptr, indices, weights) of callees, the same of callers)"""
+        if self._csr is None or len(self._csr[0][0]) != len(self.names) + 1:
+            self._csr = self._build_csr()
+        return self._csr
+
+    def _neighbours(self, name: str, reverse: bool, k: int | None):
+        node = self.ids.get(name)
+        if node is None:
+            return []
+        indptr, indices, weights = self.csr[reverse]
+        neighbours = indices[indptr[node] : indptr[node + 1]]
+        w = weights[indptr[node] : indptr[node + 1]]
+        if k is not None and k < len(w):
+            top = np.argpartition(-w, k - 1)[:k]
+            neighbours, w = neighbours[top], w[top]
+        order = np.argsort(-w, kind="stable")
+        return [(self.names[i], int(c)) for i, c in zip(neighbours[order], w[order])]
+
+    def callees(self, name: str, k: int | None = None) -> list[tuple[str, int]]:
+        """What name calls, most call sites first"""
+        return self._neighbours(name, reverse=False, k=k)
+
+    def callers(self, name: str, k: int | None = None) -> list[tuple[str, int]]:
+        """What calls name, most call sites first"""
+        return self._neighbours(name, reverse=True, k=k)
+
+    def usages(
+        self, name: str, k: int | None = None
+    ) -> dict[str, list[tuple[str, int]]]:
+        """In the shape of `AvailableMethods.usages`"""
+        return {"calls": self.callees(name, k), "called_by": self.callers(name, k)}
+
+    def qualified_name(self, path: str, name: str) -> str:
+        """The dotted name of the function name defined in path, relative to the root
+
+        Functions that are not in the graph yet (e.g. a new stub) get the dotted name
+        they will have in their module.
+        """
+        for definition in self.definitions(path):
+            if definition.rsplit(".", 1)[-1] == name:
+                return definition
+        return f"{module_name(path)}.{name}"
+
+    def definitions(self, path: str | None = None) -> list[str]:
+        if path is not None:
+            calls = self._files.get(path)
+            return list(calls.definitions) if calls else []
+        return sorted(self._definitions)
+
+    def errors(self) -> dict[str, str]:
+        return {p: f.error for p, f in self._files.items() if f.error}
+
+    def number_of_nodes(self) -> int:
+        return len(self.names)
+
+    def number_of_edges(self) -> int:
+        return len(self.csr[0][1])
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._definitions
+
+
+_default_graph: CallGraph | None = None
+_default_graph_lock = threading.Lock()
+
+
+def get_default_callgraph() -> CallGraph | None:
+    """The call graph of P2C_INDEX_ROOT, updated on first use, or None if it is not set"""
+    global _default_graph
+    root = os.environ.get("P2C_INDEX_ROOT")
+    if not root:
+        return None
+    with _default_graph_lock:
+        if _default_graph is None or _default_graph.root != Path(root).resolve():
+            _default_graph = CallGraph(root)
+            _default_graph.update()
+        return _default_graph
+
+
+if __name__ == "__main__":
+    graph = CallGraph(sys.argv[1] if len(sys.argv) > 1 else ".")
+    print(f"{len(graph.update())} files")
+    print(f"{graph.number_of_nodes()} nodes, {graph.number_of_edges()} edges")
+    for name in sys.argv[2:]:
+        print(name, graph.usages(name, k=10))
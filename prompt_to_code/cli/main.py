@@ -1,10 +1,14 @@
+"""The `p2c` command line
+
+Commands import what they need when they run (the agents pull in langchain, the
+indexer NumPy and SQLite), so `--help` and `show-config` start quickly.
+"""
+import sys
 from pathlib import Path
 from pprint import pprint
 
-import pyfiglet
 import typer
 
-from prompt_to_code.agent import run
 from prompt_to_code.config import PromptToCodeConfig
 from prompt_to_code.version import VERSION
 
@@ -13,6 +17,8 @@ app = typer.Typer(name="prompt-to-code")
 
 
 def banner():
+    import pyfiglet
+
     banner = pyfiglet.figlet_format("Prompt To Code", font="cybermedium").rstrip()
     banner = "\033[92m" + banner + "\033[0m"
     return f"{banner}  \033[90mv{VERSION}\033[0m"
@@ -28,7 +34,9 @@ def main(
     global config
     if output_directory is not None:
         config.output_directory = Path(output_directory)
-    typer.echo(banner() + "\n")
+    # Rendering the banner loads a font, which scripts have no use for
+    if sys.stdout.isatty():
+        typer.echo(banner() + "\n")
 
 
 @app.command()
@@ -40,11 +48,68 @@ def code(
     ),
 ):
     """Generate code from a prompt and save it to files."""
+    from prompt_to_code.agent import run
+
     global config
     results = run(prompt, language=language or "python3", agent=agent, config=config)
     typer.echo(results)
 
 
+@app.command()
+def batch(
+    requests: str = typer.Argument(..., help="A JSONL file of prompts"),
+    output: str = typer.Option(
+        None, help="The JSONL file of results, results.jsonl in the output directory"
+    ),
+    agent: str = typer.Option("default", help="The agent of requests without one"),
+    concurrency: int = typer.Option(None, help="Requests run at the same time"),
+    resume: bool = typer.Option(True, help="Skip requests that already finished"),
+    repo: str = typer.Option(
+        None, help="Run each request on its own branch in a worktree of this repo"
+    ),
+):
+    """Generate code for every prompt of a JSONL file, each in its own directory."""
+    from contextlib import nullcontext
+
+    from prompt_to_code.batch import DEFAULT_BATCH_CONCURRENCY, run_batch
+
+    global config
+    concurrency = concurrency or DEFAULT_BATCH_CONCURRENCY
+    if repo is not None:
+        from prompt_to_code.workspaces import WorkspacePool
+
+        workspaces = WorkspacePool(repo, size=concurrency)
+    else:
+        workspaces = nullcontext()
+    with workspaces:
+        summary = run_batch(
+            requests,
+            output=output,
+            outdir=config.output_directory,
+            concurrency=concurrency,
+            agent=agent,
+            config=config,
+            resume=resume,
+            on_result=lambda r: typer.echo(
+                f"{r['id']}: {r['status']} ({r['seconds']}s)"
+            ),
+            workspaces=workspaces if repo is not None else None,
+        )
+    typer.echo(summary)
+
+
+@app.command()
+def index(
+    root: str = typer.Argument(".", help="The repository to index"),
+    workers: int = typer.Option(None, help="Processes used to parse changed files"),
+):
+    """Index the functions defined in a repository, re-parsing only changed files."""
+    from prompt_to_code.indexer import FunctionIndex
+
+    with FunctionIndex(root, workers=workers) as function_index:
+        typer.echo(function_index.update())
+
+
 @app.command()
 def show_config():
     global config
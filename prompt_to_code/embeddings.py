@@ -0,0 +1,212 @@
+"""Offline embeddings of code and prompts, and batched top-k cosine search
+
+`HashingEmbedder` maps the identifiers and words of a text (split on snake and
+camel case, plus adjacent pairs) onto a fixed number of dimensions with signed
+feature hashing.  It needs no model or network and two runs always agree.
+
+`VectorStore` keeps the unit vectors of a corpus as rows of one contiguous float32
+matrix, so a batch of queries is scored with a single matrix product.  It can be
+saved as a `.npy` file and loaded memory-mapped.
+"""
+import json
+import math
+import re
+import zlib
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_DIMENSIONS = 512
+# Rows scored per matrix product, bounding the memory of a search
+SEARCH_BLOCK_SIZE = 65536
+
+_WORD = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+_STOP_WORDS = frozenset(
+    "a an and are as be by def for from if in is it of on or return self the "
+    "this to with".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """Lower case words of text, with identifiers split on case and underscores"""
+    return [
+        word
+        for word in (w.lower() for w in _WORD.findall(text))
+        if word not in _STOP_WORDS
+    ]
+
+
+class HashingEmbedder:
+    def __init__(self, dimensions: int = DEFAULT_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def _features(self, text: str) -> Counter:
+        tokens = tokenize(text)
+        features = Counter(tokens)
+        features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+        return features
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Returns a (len(texts), dimensions) float32 matrix of unit vectors"""
+        rows, columns, values = [], [], []
+        for row, text in enumerate(texts):
+            for feature, count in self._features(text).items():
+                h = zlib.crc32(feature.encode("utf-8"))
+                rows.append(row)
+                columns.append(h % self.dimensions)
+                # The top bit picks the sign so that collisions tend to cancel out
+                values.append((1 + math.log(count)) * (-1 if h >> 31 else 1))
+
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        np.add.at(matrix, (rows, columns), values)
+        return normalize(matrix)
+
+
+def normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def top_k(
+    queries: np.ndarray, matrix: np.ndarray, k: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """The indices and cosine scores of the k best rows of matrix for each query
+
+    Both inputs must hold unit vectors.  Returns two (len(queries), min(k, rows))
+    arrays, best first.
+    """
+    k = min(k, len(matrix))
+    if k == 0:
+        empty = np.zeros((len(queries), 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+
+    best_indices = np.zeros((len(queries), 0), dtype=np.int64)
+    best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(matrix), SEARCH_BLOCK_SIZE):
+        block = matrix[start : start + SEARCH_BLOCK_SIZE]
+        scores = queries @ block.T
+        if scores.shape[1] > k:
+            indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            indices = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+        # Merge with the best rows of the previous blocks
+        best_scores = np.hstack([best_scores, np.take_along_axis(scores, indices, 1)])
+        best_indices = np.hstack([best_indices, indices + start])
+        if best_scores.shape[1] > k:
+            keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(best_scores, keep, 1)
+            best_indices = np.take_along_axis(best_indices, keep, 1)
+
+    order = np.argsort(-best_scores, axis=1, kind="stable")
+    return (
+        np.take_along_axis(best_indices, order, 1),
+        np.take_along_axis(best_scores, order, 1),
+    )
+
+
+class VectorStore:
+    """Unit vectors for a list of ids, stored as one contiguous float32 matrix"""
+
+    def __init__(
+        self,
+        ids: list[str] | None = None,
+        matrix: np.ndarray | None = None,
+        embedder: HashingEmbedder | None = None,
+        fingerprint: str | None = None,
+    ):
+        self.embedder = embedder or HashingEmbedder()
+        # Identifies the corpus the vectors were built from, to detect stale files
+        self.fingerprint = fingerprint
+        self.ids = list(ids or [])
+        if matrix is None:
+            matrix = np.zeros((0, self.embedder.dimensions), dtype=np.float32)
+        self.matrix = matrix
+        if len(self.ids) != len(self.matrix):
+            raise ValueError(f"{len(self.ids)} ids for {len(self.matrix)} vectors")
+
+    @classmethod
+    def from_texts(
+        cls, ids: list[str], texts: list[str], embedder: HashingEmbedder | None = None
+    ) -> "VectorStore":
+        embedder = embedder or HashingEmbedder()
+        return cls(ids, embedder.embed(texts), embedder=embedder)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, queries: list[str], k: int = 10) -> list[list[tuple[str, float]]]:
+        """The k most similar ids and their scores for each query, best first"""
+        indices, scores = top_k(self.embedder.embed(queries), self.matrix, k)
+        return [
+            [(self.ids[i], float(s)) for i, s in zip(row_indices, row_scores)]
+            for row_indices, row_scores in zip(indices, scores)
+        ]
+
+    def save(self, path: str | Path):
+        """Writes `{path}.npy` with the matrix and `{path}.json` with the ids"""
+        path = Path(path)
+        np.save(path.with_suffix(".npy"), np.ascontiguousarray(self.matrix))
+        with open(path.with_suffix(".json"), "w") as f:
+            meta = {
+                "dimensions": self.embedder.dimensions,
+                "fingerprint": self.fingerprint,
+                "ids": self.ids,
+            }
+            json.dump(meta, f)
+
+    @classmethod
+    def load(cls, path: str | Path, mmap: bool = True) -> "VectorStore":
+        path = Path(path)
+        with open(path.with_suffix(".json")) as f:
+            meta = json.load(f)
+        matrix = np.load(path.with_suffix(".npy"), mmap_mode="r" if mmap else None)
+        return cls(
+            meta["ids"],
+            matrix,
+            embedder=HashingEmbedder(meta["dimensions"]),
+            fingerprint=meta.get("fingerprint"),
+        )
+
+
+def function_text(function) -> str:
+    """The text embedded for an `AvailableMethods`"""
+    return "\n".join(
+        part
+        for part in (
+            function.name,
+            function.definition,
+            function.description,
+            function.filename,
+        )
+        if part
+    )
+
+
+def embed_functions(functions: list, embedder: HashingEmbedder | None = None):
+    """A matrix with a row per function, reusing the `embedding` already set on one"""
+    embedder = embedder or HashingEmbedder()
+    missing = [
+        i
+        for i, f in enumerate(functions)
+        if f.embedding is None or len(f.embedding) != embedder.dimensions
+    ]
+    matrix = np.zeros((len(functions), embedder.dimensions), dtype=np.float32)
+    for i, f in enumerate(functions):
+        if f.embedding is not None and len(f.embedding) == embedder.dimensions:
+            matrix[i] = f.embedding
+    if missing:
+        matrix[missing] = embedder.embed([function_text(functions[i]) for i in missing])
+    return matrix
+
+
+def rank_functions(
+    query: str, functions: list, k: int, embedder: HashingEmbedder | None = None
+) -> list:
+    """The k functions most similar to query, best first"""
+    embedder = embedder or HashingEmbedder()
+    indices, _scores = top_k(
+        embedder.embed([query]), embed_functions(functions, embedder), k
+    )
+    return [functions[i] for i in indices[0]]
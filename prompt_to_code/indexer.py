@@ -0,0 +1,342 @@
+"""An incremental, on-disk index of the functions defined across a repository
+
+`FunctionIndex.update` walks the repository, skips files whose size and mtime are
+unchanged since the last update (or whose content hash is unchanged, e.g. after a
+checkout), parses the rest in a process pool and stores their `AvailableMethods`
+in SQLite.  An update of an unchanged repository only costs the directory walk.
+
+    with FunctionIndex("path/to/repo") as index:
+        print(index.update())
+        functions = index.functions(name="run_agent")
+        matches = index.search("parse the function definitions", k=5)
+
+The functions are also embedded (see `prompt_to_code.embeddings`) into a float32
+matrix saved next to the database, which is memory-mapped by later processes and
+rebuilt only after the indexed files change.
+"""
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator
+
+from prompt_to_code.agents.models import AvailableMethods
+from prompt_to_code.embeddings import HashingEmbedder, VectorStore, embed_functions
+from prompt_to_code.parsers import extract_function_definitions
+
+DEFAULT_INDEX_PATH = Path(".p2c") / "index.sqlite"
+IGNORED_DIRECTORIES = {
+    ".git",
+    ".hg",
+    ".p2c",
+    ".tox",
+    ".nox",
+    ".venv",
+    "venv",
+    "node_modules",
+    "__pycache__",
+    "build",
+    "dist",
+    "site-packages",
+}
+# Below this many changed files, parsing in-process beats starting a pool
+PARALLEL_THRESHOLD = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS functions (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL REFERENCES files(path) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS functions_path ON functions(path);
+CREATE INDEX IF NOT EXISTS functions_name ON functions(name);
+"""
+
+
+@dataclass
+class IndexStats:
+    files: int = 0
+    parsed: int = 0
+    unchanged: int = 0
+    removed: int = 0
+    failed: int = 0
+    functions: int = 0
+    seconds: float = 0.0
+
+    def __str__(self):
+        return (
+            f"Indexed {self.files} files in {self.seconds:.3f}s: {self.parsed} parsed, "
+            f"{self.unchanged} unchanged, {self.removed} removed, {self.failed} failed, "
+            f"{self.functions} functions"
+        )
+
+
+def iter_source_files(
+    root: Path, suffixes: tuple[str, ...] = (".py",)
+) -> Iterator[Path]:
+    """Yields the source files below root, skipping hidden and build directories"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [
+            d
+            for d in dirnames
+            if d not in IGNORED_DIRECTORIES and not d.startswith(".")
+        ]
+        for filename in filenames:
+            if filename.endswith(suffixes):
+                yield Path(dirpath) / filename
+
+
+def _content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _parse_file(path: str, data: bytes, branch: str | None):
+    """Runs in a worker process, returns the function records or the error"""
+    try:
+        functions, _G = extract_function_definitions(
+            data.decode("utf-8"), filename=path, branch=branch
+        )
+    except (SyntaxError, ValueError, UnicodeDecodeError, RecursionError) as e:
+        return [], f"{type(e).__name__}: {e}"
+    return [(f.name, f.json()) for f in functions], None
+
+
+class FunctionIndex:
+    """The functions defined in a repository, kept up to date incrementally"""
+
+    def __init__(
+        self,
+        root: str | Path,
+        path: str | Path | None = None,
+        branch: str | None = None,
+        workers: int | None = None,
+    ):
+        self.root = Path(root).resolve()
+        if path is None:
+            path = os.environ.get("P2C_INDEX_PATH") or self.root / DEFAULT_INDEX_PATH
+        self.path = Path(path)
+        self.branch = branch
+        self.workers = workers
+        if not self.path.parent.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        self._vectors: VectorStore | None = None
+        self._vectors_lock = threading.Lock()
+
+    def _relative(self, path: Path) -> str:
+        return path.relative_to(self.root).as_posix()
+
+    def update(self, paths: list[str | Path] | None = None) -> IndexStats:
+        """Re-indexes changed files, or only `paths` (e.g. from a file watcher)"""
+        start = time.perf_counter()
+        stats = IndexStats()
+        known = {
+            row[0]: row[1:]
+            for row in self._conn.execute(
+                "SELECT path, mtime_ns, size, content_hash FROM files"
+            )
+        }
+
+        if paths is None:
+            files = list(iter_source_files(self.root))
+            removed = set(known) - {self._relative(f) for f in files}
+        else:
+            files = [(self.root / p).resolve() for p in paths]
+            removed = {self._relative(f) for f in files if not f.exists()}
+            files = [f for f in files if f.exists()]
+        stats.files = len(files)
+
+        # Only files whose size or mtime changed are read, and only those whose
+        # content changed are parsed
+        changed: list[tuple[str, int, int, str, bytes]] = []
+        touched: list[tuple[int, int, str]] = []
+        for file in files:
+            relpath = self._relative(file)
+            stat = file.stat()
+            previous = known.get(relpath)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if previous is not None and previous[:2] == signature:
+                stats.unchanged += 1
+                continue
+            data = file.read_bytes()
+            content_hash = _content_hash(data)
+            if previous is not None and previous[2] == content_hash:
+                stats.unchanged += 1
+                touched.append((stat.st_mtime_ns, stat.st_size, relpath))
+                continue
+            changed.append(
+                (relpath, stat.st_mtime_ns, stat.st_size, content_hash, data)
+            )
+
+        results = self._parse(changed)
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE files SET mtime_ns = ?, size = ? WHERE path = ?", touched
+            )
+            self._conn.executemany(
+                "DELETE FROM files WHERE path = ?", [(p,) for p in removed]
+            )
+            for (relpath, mtime_ns, size, content_hash, _data), (records, error) in zip(
+                changed, results
+            ):
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                    (relpath, mtime_ns, size, content_hash, error),
+                )
+                self._conn.execute("DELETE FROM functions WHERE path = ?", (relpath,))
+                self._conn.executemany(
+                    "INSERT INTO functions (path, name, record) VALUES (?, ?, ?)",
+                    [(relpath, name, record) for name, record in records],
+                )
+                stats.failed += error is not None
+        if changed or removed:
+            with self._vectors_lock:
+                self._vectors = None
+        stats.parsed = len(changed)
+        stats.removed = len(removed)
+        stats.functions = len(self)
+        stats.seconds = time.perf_counter() - start
+        return stats
+
+    def _parse(self, changed) -> list[tuple[list[tuple[str, str]], str | None]]:
+        args = [(relpath, data, self.branch) for relpath, *_, data in changed]
+        if len(args) < PARALLEL_THRESHOLD or self.workers == 1:
+            return [_parse_file(*a) for a in args]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(_parse_file, *zip(*args), chunksize=8))
+
+    def functions(
+        self, path: str | None = None, name: str | None = None
+    ) -> list[AvailableMethods]:
+        """The indexed functions, optionally only those in a file or with a name"""
+        query = "SELECT record FROM functions"
+        clauses, params = [], []
+        if path is not None:
+            clauses.append("path = ?")
+            params.append(path)
+        if name is not None:
+            clauses.append("name = ?")
+            params.append(name)
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        rows = self._conn.execute(query + " ORDER BY id", params)
+        return [AvailableMethods.parse_raw(row[0]) for row in rows]
+
+    @property
+    def vectors_path(self) -> Path:
+        return self.path.with_name(self.path.stem + "-vectors")
+
+    def _fingerprint(self) -> str:
+        digest = hashlib.sha256()
+        for path, content_hash in self._conn.execute(
+            "SELECT path, content_hash FROM files ORDER BY path"
+        ):
+            digest.update(f"{path}\0{content_hash}\n".encode())
+        return digest.hexdigest()
+
+    def vectors(self) -> VectorStore:
+        """The embeddings of the indexed functions, keyed by their row id"""
+        # Concurrent first searches load (or embed) the functions once
+        with self._vectors_lock:
+            if self._vectors is None:
+                self._vectors = self._load_vectors()
+            return self._vectors
+
+    def _load_vectors(self) -> VectorStore:
+        fingerprint = self._fingerprint()
+        try:
+            store = VectorStore.load(self.vectors_path)
+            if store.fingerprint == fingerprint:
+                return store
+        except (OSError, ValueError, KeyError):
+            pass
+
+        rows = self._conn.execute("SELECT id, record FROM functions ORDER BY id")
+        ids, functions = [], []
+        for row_id, record in rows:
+            ids.append(str(row_id))
+            functions.append(AvailableMethods.parse_raw(record))
+        embedder = HashingEmbedder()
+        store = VectorStore(
+            ids,
+            embed_functions(functions, embedder),
+            embedder=embedder,
+            fingerprint=fingerprint,
+        )
+        store.save(self.vectors_path)
+        return store
+
+    def search(self, query: str, k: int = 10) -> list[tuple[AvailableMethods, float]]:
+        """The k indexed functions most similar to query, with their cosine scores"""
+        (matches,) = self.vectors().search([query], k)
+        if not matches:
+            return []
+        placeholders = ",".join("?" * len(matches))
+        records = dict(
+            self._conn.execute(
+                f"SELECT id, record FROM functions WHERE id IN ({placeholders})",
+                [int(i) for i, _score in matches],
+            )
+        )
+        return [
+            (AvailableMethods.parse_raw(records[int(i)]), score)
+            for i, score in matches
+            if int(i) in records
+        ]
+
+    def errors(self) -> dict[str, str]:
+        """The files that could not be parsed and why"""
+        rows = self._conn.execute(
+            "SELECT path, error FROM files WHERE error IS NOT NULL"
+        )
+        return dict(rows)
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM functions").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_default_index: FunctionIndex | None = None
+_default_index_lock = threading.Lock()
+
+
+def get_default_index() -> FunctionIndex | None:
+    """The index of P2C_INDEX_ROOT, updated on first use, or None if it is not set"""
+    global _default_index
+    root = os.environ.get("P2C_INDEX_ROOT")
+    if not root:
+        return None
+    with _default_index_lock:
+        if _default_index is None or _default_index.root != Path(root).resolve():
+            _default_index = FunctionIndex(root)
+            _default_index.update()
+        return _default_index
+
+
+if __name__ == "__main__":
+    with FunctionIndex(sys.argv[1] if len(sys.argv) > 1 else ".") as index:
+        print(index.update())
@@ -1,108 +1,76 @@
 import ast
 import hashlib
-from collections import defaultdict
+import threading
+from collections import OrderedDict
 
 import networkx as nx
 
 from prompt_to_code.agents.models import AvailableMethods
 
+# Number of analysed sources kept by `extract_function_definitions`
+CACHE_SIZE = 256
 
-class FunctionExtractor(ast.NodeVisitor):
-    def __init__(
-        self,
-        source_lines,
-        filename=None,
-        branch=None,
-        usages: dict[str, dict[str, list[tuple[str, int]]]] | None = None,
-    ):
+
+class FunctionAnalyzer(ast.NodeVisitor):
+    """Collects function definitions and `called_after` call edges in one tree walk
+
+    A call to `g` made after a call to `f` within the same function (or module body)
+    adds the edge g -> f.  Each distinct edge has a weight of 1.
+    """
+
+    def __init__(self, source_lines):
         super().__init__()
-        self.function_data: list[AvailableMethods] = []
         self.source_lines = source_lines
-        self.filename = filename
-        self.branch = branch
-        self.usages = usages
+        # (name, args, kwargs, return_type, definition, code_hash) per function
+        self.functions: list[tuple] = []
+        # Dicts preserve the order in which edges were first seen
+        self.edges: dict[tuple[str, str], None] = {}
+        self.called_functions: list[str] = []
 
     def visit_FunctionDef(self, node):
-        name = node.name
         args = [arg.arg for arg in node.args.args]
-        kwargs = [
-            (arg.arg, ast.literal_eval(arg.default)) for arg in node.args.kwonlyargs
-        ]
+        kwargs = [arg.arg for arg in node.args.kwonlyargs]
         return_type = getattr(node.returns, "id", None)
 
         start_line = node.lineno - 1
         end_line = node.body[0].lineno - 1
         function_source = "".join(self.source_lines[start_line:end_line]).strip()
 
-        start_line = node.lineno - 1
         end_line = node.end_lineno
         function_code = "".join(self.source_lines[start_line:end_line]).strip()
         code_hash = hashlib.md5(function_code.encode("utf-8")).hexdigest()
         # todo add embedding
 
-        self.function_data.append(
-            AvailableMethods(
-                name=name,
-                definition=function_source,
-                description=None,
-                parameters=(args, kwargs),
-                return_type=return_type,
-                filename=str(self.filename),
-                branch=self.branch,
-                code_hash=code_hash,
-                embedding=None,
-                usages=self.usages.get(name, {}),
-            )
+        self.functions.append(
+            (node.name, args, kwargs, return_type, function_source, code_hash)
         )
-        self.generic_visit(node)
-
 
-class FunctionCallGraph(ast.NodeVisitor):
-    def __init__(self):
-        self.graph = defaultdict(
-            lambda: {"called_after": set(), "called_inside": set()}
-        )
+        # Reset the list of called functions when entering a new function
         self.called_functions = []
+        self.generic_visit(node)
 
     def visit_Call(self, node):
         if isinstance(node.func, ast.Name):
             function_name = node.func.id
             if self.called_functions:
-                # Add edges for called_after and called_inside relationships
-                self.graph[function_name]["called_after"].add(self.called_functions[-1])
-                self.graph[self.called_functions[-1]]["called_inside"].add(
-                    function_name
-                )
-
-            # Update the list of called functions
+                self.edges[(function_name, self.called_functions[-1])] = None
             self.called_functions.append(function_name)
 
-        # Visit child nodes
-        self.generic_visit(node)
-
-    def visit_FunctionDef(self, node):
-        # Reset the list of called functions when entering a new function
-        self.called_functions = []
         self.generic_visit(node)
 
 
-def create_function_call_graph(content):
-    tree = ast.parse(content)
-    visitor = FunctionCallGraph()
-    visitor.visit(tree)
-
+def _build_graph(edges) -> nx.DiGraph:
     G = nx.DiGraph()
-    for function_name, function_data in visitor.graph.items():
-        for called_function in function_data["called_after"]:
-            if (function_name, called_function) in G.edges:
-                G[function_name][called_function]["weight"] += 1
-            else:
-                G.add_edge(
-                    function_name, called_function, label="called_after", weight=1
-                )
+    G.add_edges_from(edges, label="called_after", weight=1)
     return G
 
 
+def create_function_call_graph(content):
+    analyzer = FunctionAnalyzer(content.splitlines(True))
+    analyzer.visit(ast.parse(content))
+    return _build_graph(analyzer.edges)
+
+
 def build_usages_from_graph(G):
     return {
         node: {
@@ -125,20 +93,56 @@ def build_usages_from_graph(G):
     }
 
 
+_cache: OrderedDict[tuple, tuple[list[AvailableMethods], nx.DiGraph]] = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
 def extract_function_definitions(
     content, filename=None, branch=None
 ) -> tuple[list[AvailableMethods], nx.DiGraph]:
-    G = create_function_call_graph(content)
+    """Returns the functions defined in content and their `called_after` graph
+
+    Results are cached on a hash of the content, so the returned graph is a
+    read-only view and the returned definitions must not be modified.
+    """
+    key = (hashlib.sha256(content.encode("utf-8")).digest(), str(filename), branch)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            function_data, G = _cache[key]
+            return list(function_data), G
+
+    analyzer = FunctionAnalyzer(content.splitlines(True))
+    analyzer.visit(ast.parse(content))
+    G = _build_graph(analyzer.edges).copy(as_view=True)
     usages = build_usages_from_graph(G)
 
-    source_lines = content.splitlines(True)
-    tree = ast.parse(content)
-    extractor = FunctionExtractor(
-        source_lines, filename=filename, branch=branch, usages=usages
-    )
-    extractor.visit(tree)
-
-    return extractor.function_data, G
+    function_data = [
+        AvailableMethods(
+            name=name,
+            definition=definition,
+            description=None,
+            parameters=(args, kwargs),
+            return_type=return_type,
+            filename=str(filename),
+            branch=branch,
+            code_hash=code_hash,
+            embedding=None,
+            usages=usages.get(name, {}),
+        )
+        for name, args, kwargs, return_type, definition, code_hash in analyzer.functions
+    ]
+
+    with _cache_lock:
+        _cache[key] = (function_data, G)
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return list(function_data), G
 
 
 if __name__ == "__main__":
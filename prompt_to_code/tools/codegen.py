@@ -3,9 +3,9 @@ import logging
 
 from langchain import LLMChain
 from langchain.agents import Tool
-from langchain.chat_models import ChatOpenAI
 from langchain.prompts import PromptTemplate
 
+from prompt_to_code.agents.clients import get_client
 from prompt_to_code.config import PromptToCodeConfig
 
 
@@ -14,7 +14,7 @@ def _codegen_wrapper(
     config: PromptToCodeConfig,
     logger: logging.Logger,
 ):
-    llm = ChatOpenAI(temperature=0.7, model="gpt-4", max_tokens=3000)
+    llm = get_client(temperature=0.7, model_name="gpt-4", max_tokens=3000)
 
     prompt = PromptTemplate(
         input_variables=["input"],
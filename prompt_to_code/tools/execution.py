@@ -1,49 +1,44 @@
-import signal
+import asyncio
 import subprocess
-import traceback
 
+from prompt_to_code.tools.sandbox import ExecutionResult, get_default_pool
+from prompt_to_code.tracing import traced
 
-def timeout_handler_wrapper(timeout=5):
-    msg = f"Execution took longer than {format} seconds"
 
-    def timeout_handler(_signum, _frame):
-        raise TimeoutError(msg)
-
-    return timeout_handler
+def run_code_in_sandbox(code, timeout=60) -> ExecutionResult:
+    """Runs code in a warm worker interpreter and returns the structured result"""
+    return get_default_pool().run(code, timeout=timeout)
 
 
 def run_code(code, timeout=60):
-    signal.signal(signal.SIGALRM, timeout_handler_wrapper(timeout=timeout))
-    tb_str = None
-    try:
-        # Set an alarm for 10 seconds
-        signal.alarm(timeout)
-        exec(code)
-    except TimeoutError as te:
-        error = f"TimeoutError: Execution took longer than {timeout} seconds"
-        tb_str = traceback.format_exception(type(te), value=error, tb=te.__traceback__)
-    except Exception as e:
-        tb_str = traceback.format_exception(type(e), value=e, tb=e.__traceback__)
-    finally:
-        # Cancel the alarm if it didn't go off
-        signal.alarm(0)
-        # Remove the signal handler and set it to the default behavior
-        signal.signal(signal.SIGALRM, signal.SIG_DFL)
-    return tb_str
+    """Runs code in the sandbox and returns its formatted traceback, or None on success"""
+    return run_code_in_sandbox(code, timeout=timeout).traceback
+
 
+@traced(attributes=("command",))
+def run_shell_command(command, timeout=60, cwd=None) -> tuple[str, bool]:
+    """Returns stdout of command and a boolean indicating if there was an error
 
-def run_shell_command(command, timeout=60) -> tuple[str, bool]:
-    """Returns stdout of command and a boolean indicating if there was an error"""
+    The command runs in `cwd`, e.g. a task's worktree, or else the current directory.
+    """
     try:
-        signal.alarm(timeout)
         result = subprocess.run(
-            command, capture_output=True, text=True, check=True, shell=True
+            command,
+            capture_output=True,
+            text=True,
+            check=True,
+            shell=True,
+            timeout=timeout,
+            cwd=cwd,
         )
         return result.stdout.strip(), False
-    except TimeoutError as te:
+    except subprocess.TimeoutExpired as te:
         error = f"TimeoutError: Execution took longer than {timeout} seconds {command}. Error: {te}"
         if te.stdout:
-            error += "\n" + te.stdout.strip()
+            stdout = te.stdout
+            if isinstance(stdout, bytes):
+                stdout = stdout.decode("utf-8", errors="replace")
+            error += "\n" + stdout.strip()
         return error, True
     except subprocess.CalledProcessError as e:
         if e.stdout:
@@ -51,8 +46,27 @@ def run_shell_command(command, timeout=60) -> tuple[str, bool]:
         return f"Command failed: {command}. Error: {e}", True
     except Exception as e:
         raise RuntimeError(f"Command failed: {command}. Error: {e}") from e
-    finally:
-        # Cancel the alarm if it didn't go off
-        signal.alarm(0)
-        # Remove the signal handler and set it to the default behavior
-        signal.signal(signal.SIGALRM, signal.SIG_DFL)
+
+
+@traced("run_shell_command", attributes=("command",))
+async def arun_shell_command(command, timeout=60, cwd=None) -> tuple[str, bool]:
+    """Async version of `run_shell_command` that does not block the event loop"""
+    process = await asyncio.create_subprocess_shell(
+        command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=cwd,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.communicate()
+        return (
+            f"TimeoutError: Execution took longer than {timeout} seconds {command}",
+            True,
+        )
+    stdout = stdout.decode("utf-8", errors="replace").strip()
+    if process.returncode != 0:
+        return stdout or f"Command failed: {command}. Error: {stderr.decode()}", True
+    return stdout, False
@@ -1,10 +1,39 @@
 import logging
+import threading
 from pathlib import Path
 
 from langchain.agents import Tool
 
 from prompt_to_code.config import PromptToCodeConfig
 
+# Files written by the agents and not yet committed, so that a commit only stages
+# them instead of scanning the whole working tree
+_written: set[Path] = set()
+_written_lock = threading.Lock()
+
+
+def record_written(path: Path | str):
+    with _written_lock:
+        _written.add(Path(path).resolve())
+
+
+def written_files(root: Path | str) -> list[Path]:
+    """The files written under root, relative to it"""
+    root = Path(root).resolve()
+    with _written_lock:
+        written = list(_written)
+    return sorted(p.relative_to(root) for p in written if p.is_relative_to(root))
+
+
+def forget_written(root: Path | str, paths: list[Path | str] | None = None):
+    """Forgets paths relative to root, e.g. once committed, or all files under it"""
+    root = Path(root).resolve()
+    with _written_lock:
+        if paths is None:
+            _written.difference_update([p for p in _written if p.is_relative_to(root)])
+        else:
+            _written.difference_update((root / p).resolve() for p in paths)
+
 
 def _write_to_file_wrapper(config: PromptToCodeConfig, logger: logging.Logger):
     fdir = Path(config.output_directory)
@@ -22,6 +51,7 @@ def _write_to_file_wrapper(config: PromptToCodeConfig, logger: logging.Logger):
             code = file_path.read_text() + "\n" + code
             logger.info(f"File {filename} already exists, appending to it")
         file_path.write_text(code)
+        record_written(file_path)
 
     return file_wrapper
 
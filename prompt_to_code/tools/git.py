@@ -0,0 +1,164 @@
+"""Answers questions about a git repository with as few git processes as possible
+
+The state of the working tree (whether it is one, its branch, whether it is dirty)
+comes from a single `git status --porcelain=v2 --branch`, and the branch names from
+one `git for-each-ref` that is cached until the refs change on disk.  Git runs
+directly rather than through a shell, and commits stage only the given paths.
+
+    git = GitRepository(path)
+    status = git.status()
+    if status.inside and not status.dirty and "feature" not in git.branches():
+        git.create_branch("feature")
+"""
+import os
+import subprocess
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from prompt_to_code.tracing import span
+
+
+class GitError(RuntimeError):
+    pass
+
+
+class NothingToCommit(GitError):
+    def __init__(self):
+        super().__init__("No changes to commit")
+
+
+@dataclass
+class GitStatus:
+    inside: bool  # whether the directory is in a working tree
+    head: str | None = None  # the branch, None when detached or outside
+    oid: str | None = None  # the commit, None before the first one
+    upstream: str | None = None
+    ahead: int = 0
+    behind: int = 0
+    changed: list[str] = field(default_factory=list)  # staged or not
+    untracked: list[str] = field(default_factory=list)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.changed or self.untracked)
+
+
+def parse_status(output: str) -> GitStatus:
+    """Parses the NUL separated output of `git status --porcelain=v2 --branch -z`"""
+    status = GitStatus(inside=True)
+    entries = iter(output.split("\0"))
+    for entry in entries:
+        if entry.startswith("# branch.oid "):
+            oid = entry.split(" ", 2)[2]
+            status.oid = None if oid == "(initial)" else oid
+        elif entry.startswith("# branch.head "):
+            head = entry.split(" ", 2)[2]
+            status.head = None if head == "(detached)" else head
+        elif entry.startswith("# branch.upstream "):
+            status.upstream = entry.split(" ", 2)[2]
+        elif entry.startswith("# branch.ab "):
+            ahead, behind = entry.split(" ")[2:4]
+            status.ahead, status.behind = int(ahead), -int(behind)
+        elif entry.startswith("1 "):
+            status.changed.append(entry.split(" ", 8)[8])
+        elif entry.startswith("2 "):
+            status.changed.append(entry.split(" ", 9)[9])
+            next(entries, None)  # the path it was renamed or copied from
+        elif entry.startswith("u "):
+            status.changed.append(entry.split(" ", 10)[10])
+        elif entry.startswith("? "):
+            status.untracked.append(entry[2:])
+    return status
+
+
+class GitRepository:
+    def __init__(self, cwd: Path | str | None = None):
+        self.cwd = Path(cwd) if cwd is not None else None
+        self._git_dir: Path | None = None
+        self._branches: set[str] | None = None
+        self._refs_key = None
+
+    def git(self, *args: str, check: bool = True) -> subprocess.CompletedProcess:
+        with span("git", command=args[0]):
+            result = subprocess.run(
+                ["git", *args], cwd=self.cwd, capture_output=True, text=True
+            )
+        if check and result.returncode != 0:
+            raise GitError(
+                f"git {' '.join(args)} failed: {result.stderr.strip() or result.stdout}"
+            )
+        return result
+
+    def status(self, untracked: bool = True) -> GitStatus:
+        result = self.git(
+            "status",
+            "--porcelain=v2",
+            "--branch",
+            "-z",
+            f"--untracked-files={'normal' if untracked else 'no'}",
+            check=False,
+        )
+        if result.returncode != 0:
+            if "not a git repository" in result.stderr:
+                return GitStatus(inside=False)
+            raise GitError(f"git status failed: {result.stderr.strip()}")
+        return parse_status(result.stdout)
+
+    @property
+    def git_dir(self) -> Path:
+        """The repository's common directory, shared by all of its worktrees"""
+        if self._git_dir is None:
+            output = self.git(
+                "rev-parse", "--path-format=absolute", "--git-common-dir"
+            ).stdout
+            self._git_dir = Path(output.strip())
+        return self._git_dir
+
+    def _refs_changed_key(self) -> tuple:
+        # Creating, moving or deleting a loose branch changes its directory (but only
+        # the subdirectory of names with a slash), packing branches packed-refs
+        key = []
+        for path in (self.git_dir / "refs" / "heads", self.git_dir / "packed-refs"):
+            try:
+                stat = os.stat(path)
+                key.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                key.append(None)
+        return tuple(key)
+
+    def branches(self) -> set[str]:
+        """The local branch names, listed again only once the refs changed"""
+        key = self._refs_changed_key()
+        if self._branches is None or key != self._refs_key:
+            output = self.git(
+                "for-each-ref", "--format=%(refname:short)", "refs/heads/"
+            ).stdout
+            self._branches = set(output.split())
+            self._refs_key = key
+        return set(self._branches)
+
+    def create_branch(self, name: str, start: str | None = None):
+        self.git("checkout", "-b", name, *([start] if start else []))
+        self._branches = None
+
+    def commit(self, message: str, paths: list[Path | str] | None = None):
+        """Commits paths, or everything under the directory when None
+
+        Only the given paths are staged and committed, whatever else is changed or
+        staged in the working tree.
+        """
+        if paths is not None:
+            if not paths:
+                raise NothingToCommit()
+            paths = [str(p) for p in paths]
+            self.git("add", "--", *paths)
+            result = self.git("commit", "-q", "-m", message, "--", *paths, check=False)
+        else:
+            self.git("add", ".")
+            result = self.git("commit", "-q", "-m", message, check=False)
+        if result.returncode != 0:
+            output = result.stdout + result.stderr
+            if "nothing to commit" in output or "no changes added" in output:
+                raise NothingToCommit()
+            raise GitError(f"git commit failed: {output.strip()}")
+        self._branches = None
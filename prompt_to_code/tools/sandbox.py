@@ -0,0 +1,274 @@
+"""A pool of warm worker interpreters that run generated code outside of the agent
+
+Code is sent to a worker over a socket and executed with fresh globals under a
+wall-clock timeout and an address-space (RLIMIT_AS) limit.  Workers are recycled
+after `max_runs` executions, a timeout or a crash, so state leaked by generated
+code (imports, monkeypatching) never reaches the agent's own interpreter.
+"""
+import atexit
+import contextlib
+import io
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from multiprocessing.connection import Connection
+from pathlib import Path
+
+from prompt_to_code.tracing import span
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
+
+DEFAULT_MEMORY_LIMIT = 2 * 1024**3
+PACKAGE_ROOT = Path(__file__).resolve().parents[2]
+
+
+def worker_env() -> dict[str, str]:
+    """Environment for worker interpreters that can import this package"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        p for p in (str(PACKAGE_ROOT), env.get("PYTHONPATH")) if p
+    )
+    return env
+
+
+@dataclass
+class ExecutionResult:
+    traceback: list[str] | None = None
+    stdout: str = ""
+    duration: float = 0.0
+    peak_rss: int = 0  # bytes, the peak of the worker process over its lifetime
+    timed_out: bool = False
+    crashed: bool = False
+
+    @property
+    def failed(self) -> bool:
+        return self.traceback is not None
+
+
+def _peak_rss() -> int:
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if os.uname().sysname == "Darwin" else rss * 1024
+
+
+def _worker_main(conn, memory_limit: int | None):
+    if resource is not None and memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    while True:
+        try:
+            code = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if code is None:
+            break
+
+        stdout = io.StringIO()
+        tb_str = None
+        start = time.perf_counter()
+        try:
+            with contextlib.redirect_stdout(stdout):
+                exec(compile(code, "<generated>", "exec"), {"__name__": "__sandbox__"})
+        except BaseException as e:
+            tb_str = traceback.format_exception(type(e), e, e.__traceback__)
+        duration = time.perf_counter() - start
+        conn.send((tb_str, stdout.getvalue(), duration, _peak_rss()))
+
+
+class _Worker:
+    """A fresh interpreter running `_worker_main`, connected through a socket pair"""
+
+    def __init__(self, memory_limit: int | None):
+        parent_sock, child_sock = socket.socketpair()
+        with parent_sock, child_sock:
+            self.process = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "prompt_to_code.tools.sandbox",
+                    str(child_sock.fileno()),
+                    str(memory_limit or 0),
+                ],
+                pass_fds=[child_sock.fileno()],
+                stdin=subprocess.DEVNULL,
+                env=worker_env(),
+            )
+            self.conn = Connection(os.dup(parent_sock.fileno()))
+        self.runs = 0
+
+    def is_alive(self) -> bool:
+        return self.process.poll() is None
+
+    def kill(self):
+        if self.is_alive():
+            self.process.kill()
+        self.process.wait()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+            self.process.wait(timeout=1)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        self.kill()
+
+
+class SandboxPool:
+    """A thread-safe pool of pre-started interpreters that execute code strings"""
+
+    def __init__(
+        self,
+        size: int | None = None,
+        max_runs: int = 50,
+        memory_limit: int | None = DEFAULT_MEMORY_LIMIT,
+    ):
+        self.size = size or min(4, os.cpu_count() or 1)
+        self.max_runs = max_runs
+        self.memory_limit = memory_limit
+
+        self._idle: list[_Worker] = []
+        self._started = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def warm(self):
+        """Starts workers up to the pool size so the first runs skip interpreter startup"""
+        with self._cond:
+            count = self.size - self._started
+            self._started = self.size
+        workers = [_Worker(self.memory_limit) for _ in range(count)]
+        with self._cond:
+            self._idle.extend(workers)
+            self._cond.notify_all()
+
+    def _acquire(self) -> _Worker:
+        with self._cond:
+            while not self._closed and not self._idle and self._started >= self.size:
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError("SandboxPool is closed")
+            if self._idle:
+                return self._idle.pop()
+            self._started += 1
+        try:
+            return _Worker(self.memory_limit)
+        except Exception:
+            with self._cond:
+                self._started -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, worker: _Worker, recycle: bool = False):
+        worker.runs += 1
+        if recycle or worker.runs >= self.max_runs or not worker.is_alive():
+            if recycle:
+                worker.kill()
+            else:
+                worker.stop()
+            with self._cond:
+                self._started -= 1
+                self._cond.notify()
+            return
+        with self._cond:
+            if self._closed:
+                worker.stop()
+                self._started -= 1
+            else:
+                self._idle.append(worker)
+            self._cond.notify()
+
+    def run(self, code: str, timeout: float = 60) -> ExecutionResult:
+        """Executes `code` in a worker, returning its traceback, stdout and resources"""
+        with span("run_code", timeout=timeout) as s:
+            result = self._run(code, timeout)
+            s.set(
+                failed=result.failed,
+                timed_out=result.timed_out,
+                crashed=result.crashed,
+                peak_rss=result.peak_rss,
+            )
+        return result
+
+    def _run(self, code: str, timeout: float) -> ExecutionResult:
+        worker = self._acquire()
+        start = time.perf_counter()
+        recycle = False
+        try:
+            worker.conn.send(code)
+            if not worker.conn.poll(timeout):
+                recycle = True
+                return ExecutionResult(
+                    traceback=[
+                        f"TimeoutError: Execution took longer than {timeout} seconds\n"
+                    ],
+                    duration=time.perf_counter() - start,
+                    timed_out=True,
+                )
+            tb_str, stdout, duration, peak_rss = worker.conn.recv()
+            return ExecutionResult(tb_str, stdout, duration, peak_rss)
+        except (EOFError, BrokenPipeError, ConnectionResetError):
+            recycle = True
+            with contextlib.suppress(subprocess.TimeoutExpired):
+                worker.process.wait(timeout=1)
+            return ExecutionResult(
+                traceback=[
+                    "RuntimeError: Sandbox worker exited with code "
+                    f"{worker.process.returncode}\n"
+                ],
+                duration=time.perf_counter() - start,
+                crashed=True,
+            )
+        finally:
+            self._release(worker, recycle=recycle)
+
+    def map(self, codes: list[str], timeout: float = 60) -> list[ExecutionResult]:
+        """Executes each code string concurrently, one worker per string"""
+        with ThreadPoolExecutor(max_workers=self.size) as executor:
+            return list(executor.map(lambda code: self.run(code, timeout), codes))
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._started -= len(idle)
+            self._cond.notify_all()
+        for worker in idle:
+            worker.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_default_pool: SandboxPool | None = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool() -> SandboxPool:
+    """Returns the process-wide sandbox, sized by P2C_SANDBOX_WORKERS"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            size = os.environ.get("P2C_SANDBOX_WORKERS")
+            _default_pool = SandboxPool(size=int(size) if size else None)
+            _default_pool.warm()
+            atexit.register(_default_pool.close)
+    return _default_pool
+
+
+if __name__ == "__main__":
+    _worker_main(Connection(int(sys.argv[1])), int(sys.argv[2]))
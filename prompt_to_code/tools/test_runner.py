@@ -0,0 +1,264 @@
+"""A long-lived pytest service that runs test files in forked, pre-warmed workers
+
+Running `pytest {file}` in a shell pays for interpreter startup, pytest imports and
+plugin discovery on every call.  `PytestService` starts one server process that
+imports pytest and its plugins once, then listens on a local socket.  Each request
+is handled by a child forked from the server, so runs start warm, execute in
+parallel and cannot leak state into one another.
+"""
+import atexit
+import contextlib
+import importlib.metadata
+import io
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from multiprocessing.connection import AuthenticationError, Client, Listener
+from pathlib import Path
+
+from prompt_to_code.tools.execution import run_shell_command
+from prompt_to_code.tools.sandbox import worker_env
+from prompt_to_code.tracing import span
+
+
+@dataclass
+class PytestOutcome:
+    nodeid: str
+    outcome: str  # passed, failed, errored or skipped
+    duration: float = 0.0
+    message: str | None = None
+
+
+@dataclass
+class PytestResult:
+    exit_code: int
+    output: str  # the pytest terminal output, as printed by `pytest {file}`
+    duration: float = 0.0
+    tests: list[PytestOutcome] = field(default_factory=list)
+
+    @property
+    def failed(self) -> bool:
+        return self.exit_code != 0
+
+    def count(self, outcome: str) -> int:
+        return sum(test.outcome == outcome for test in self.tests)
+
+
+class _OutcomeCollector:
+    """A pytest plugin that records the outcome of every test"""
+
+    def __init__(self):
+        self.tests: dict[str, PytestOutcome] = {}
+
+    def pytest_collectreport(self, report):
+        if report.failed:
+            self.tests[report.nodeid] = PytestOutcome(
+                report.nodeid, "errored", message=_message(report)
+            )
+
+    def pytest_runtest_logreport(self, report):
+        test = self.tests.setdefault(report.nodeid, PytestOutcome(report.nodeid, ""))
+        test.duration += report.duration
+        if report.when == "call":
+            if test.outcome != "errored":
+                test.outcome = report.outcome
+                test.message = _message(report) if report.failed else None
+        elif report.failed:
+            test.outcome = "errored"
+            test.message = _message(report)
+        elif report.skipped:
+            test.outcome = "skipped"
+        elif report.when == "teardown" and not test.outcome:
+            test.outcome = "passed"
+
+
+def _message(report) -> str | None:
+    crash = getattr(report.longrepr, "reprcrash", None)
+    if crash is not None:
+        return crash.message
+    return str(report.longrepr) if report.longrepr else None
+
+
+def _run_pytest_in_child(conn, path: str, args: list[str], cwd: str, timeout: float):
+    """Runs in a child forked from the server, the result is sent back over conn"""
+    import pytest
+
+    # The child is single threaded, so an alarm can enforce the timeout
+    signal.signal(signal.SIGALRM, signal.SIG_DFL)
+    signal.alarm(max(1, int(timeout)))
+    os.chdir(cwd)
+
+    collector = _OutcomeCollector()
+    output = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        exit_code = int(pytest.main([*args, path], plugins=[collector]))
+    conn.send(
+        PytestResult(
+            exit_code=exit_code,
+            output=output.getvalue().strip(),
+            duration=time.perf_counter() - start,
+            tests=list(collector.tests.values()),
+        )
+    )
+
+
+def _exit_with_owner(address: str):
+    """Removes the server's socket and exits once its owner closes our stdin
+
+    The owner holds the pipe until it exits, including through os._exit or a crash
+    where its atexit handlers never run, as process pool workers do.
+    """
+    # Reads the raw fd so forked children never inherit a held stdin lock
+    while os.read(sys.stdin.fileno(), 1024):
+        pass
+    with contextlib.suppress(OSError):
+        os.unlink(address)
+        os.rmdir(os.path.dirname(address))
+    os._exit(0)
+
+
+def _serve(address: str, authkey: bytes):
+    import pytest  # noqa: F401
+
+    # Import plugins once so that forked children skip plugin discovery
+    for entry_point in importlib.metadata.entry_points(group="pytest11"):
+        with contextlib.suppress(Exception):
+            entry_point.load()
+
+    # Children are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    with Listener(address, family="AF_UNIX", authkey=authkey) as listener:
+        threading.Thread(target=_exit_with_owner, args=(address,), daemon=True).start()
+        # Tell the client it is ready, then detach from its pipe
+        print("ready", flush=True)
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, OSError):
+                continue
+            if os.fork() != 0:
+                conn.close()
+                continue
+
+            # Child process
+            listener.close()
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            try:
+                _run_pytest_in_child(conn, **conn.recv())
+            finally:
+                os._exit(0)
+
+
+class PytestService:
+    """Runs pytest against test files through a pre-warmed server process"""
+
+    def __init__(self, args: list[str] | None = None):
+        self.args = args or []
+        self._dir = tempfile.mkdtemp(prefix="p2c-pytest-")
+        self.address = str(Path(self._dir) / "pytest.sock")
+        self._authkey = secrets.token_bytes(32)
+        self._process = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                return
+            self._process = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "prompt_to_code.tools.test_runner",
+                    self.address,
+                ],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                env=worker_env(),
+            )
+            # stdin stays open, the server exits when it is closed
+            self._process.stdin.write(self._authkey.hex().encode() + b"\n")
+            self._process.stdin.flush()
+            if self._process.stdout.readline().strip() != b"ready":
+                raise RuntimeError("pytest service failed to start")
+            self._process.stdout.close()
+
+    def run(self, path: str | Path, timeout: float = 60) -> PytestResult:
+        self.start()
+        start = time.perf_counter()
+        with Client(self.address, family="AF_UNIX", authkey=self._authkey) as conn:
+            conn.send(
+                {
+                    "path": str(path),
+                    "args": self.args,
+                    "cwd": os.getcwd(),
+                    "timeout": timeout,
+                }
+            )
+            try:
+                if conn.poll(timeout + 1):
+                    return conn.recv()
+            except EOFError:
+                pass
+        # The worker was killed by its alarm or crashed
+        return PytestResult(
+            exit_code=-1,
+            output=f"TimeoutError: Execution took longer than {timeout} seconds pytest {path}",
+            duration=time.perf_counter() - start,
+        )
+
+    def stop(self):
+        with self._lock:
+            if self._process is None:
+                return
+            self._process.stdin.close()
+            self._process.terminate()
+            self._process.wait(timeout=5)
+            self._process = None
+        with contextlib.suppress(OSError):
+            os.unlink(self.address)
+            os.rmdir(self._dir)
+
+
+_default_service: PytestService | None = None
+_default_service_lock = threading.Lock()
+
+
+def get_default_service() -> PytestService:
+    global _default_service
+    with _default_service_lock:
+        if _default_service is None:
+            _default_service = PytestService()
+            atexit.register(_default_service.stop)
+    return _default_service
+
+
+def run_pytest(path: str | Path, timeout: float = 60) -> PytestResult:
+    """Runs pytest on path and returns per-test outcomes and the terminal output"""
+    with span("run_pytest", path=path) as s:
+        if not hasattr(os, "fork"):
+            output, failed = run_shell_command(f"pytest {path}", timeout=timeout)
+            result = PytestResult(exit_code=int(failed), output=output)
+        else:
+            result = get_default_service().run(path, timeout=timeout)
+        s.set(
+            exit_code=result.exit_code,
+            passed=result.count("passed"),
+            failed=result.count("failed"),
+        )
+    return result
+
+
+if __name__ == "__main__":
+    # Serve from the imported module so results unpickle as its classes, not __main__'s
+    from prompt_to_code.tools import test_runner
+
+    test_runner._serve(sys.argv[1], bytes.fromhex(sys.stdin.readline().strip()))
@@ -0,0 +1,241 @@
+"""Nested timing spans for the agent, exported as a Chrome trace
+
+Spans are opened with `span(name, **attributes)` or the `traced` decorator and nest
+through a context variable, so they follow async tasks as well as plain calls.  When
+P2C_TRACE_FILE is set, finished spans are appended to that file in the Chrome
+trace event format, which can be opened in https://ui.perfetto.dev or
+chrome://tracing.  Otherwise tracing is disabled and spans cost almost nothing.
+
+Every process appends its own events to the same file, so a run with worker
+processes produces a single trace with one lane per process and thread.
+"""
+import atexit
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+_current_span: contextvars.ContextVar["Span | None"] = contextvars.ContextVar(
+    "p2c_current_span", default=None
+)
+_span_ids = itertools.count(1)
+
+
+@dataclass
+class Span:
+    name: str
+    start: float  # seconds since the epoch, comparable across processes
+    attributes: dict = field(default_factory=dict)
+    parent: "Span | None" = None
+    duration: float | None = None
+    pid: int = field(default_factory=os.getpid)
+    tid: int = field(default_factory=threading.get_native_id)
+    id: int = field(default_factory=lambda: next(_span_ids))
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_event(self) -> dict:
+        """The span as a Chrome trace complete ("X") event, times in microseconds"""
+        args = {k: _jsonable(v) for k, v in self.attributes.items()}
+        args["span_id"] = self.id
+        if self.parent is not None:
+            args["parent_id"] = self.parent.id
+        return {
+            "name": self.name,
+            "cat": "p2c",
+            "ph": "X",
+            "ts": round(self.start * 1e6),
+            "dur": round((self.duration or 0.0) * 1e6),
+            "pid": self.pid,
+            "tid": self.tid,
+            "args": args,
+        }
+
+
+def _jsonable(value):
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+class _NoopSpan:
+    def set(self, **attributes):
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """Collects finished spans and appends them to a Chrome trace file
+
+    Without a path finished spans are kept in `spans`.  With one they are flushed
+    to the file whenever a root span finishes, so worker processes that exit without
+    running atexit handlers still write everything but their last span.
+    """
+
+    def __init__(self, path: str | Path | None = None, enabled: bool = True):
+        self.path = Path(path) if path else None
+        self.enabled = enabled
+        self.spans: list[Span] = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name: str, /, **attributes):
+        if not self.enabled:
+            yield _NOOP_SPAN
+            return
+
+        span = Span(name, time.time(), attributes, parent=_current_span.get())
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.set(error=type(e).__name__)
+            raise
+        finally:
+            span.duration = time.perf_counter() - start
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(span)
+            if span.parent is None:
+                self.flush()
+
+    def flush(self):
+        """Appends the spans finished since the last flush to the trace file"""
+        if self.path is None:
+            return
+        with self._lock:
+            pending, self.spans = self.spans, []
+        if not pending:
+            return
+
+        if not self.path.parent.exists():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        with contextlib.suppress(FileExistsError):
+            # The first writer opens the JSON array, the closing bracket is optional
+            with open(self.path, "x") as f:
+                f.write("[\n")
+        data = "".join(json.dumps(s.to_event()) + ",\n" for s in pending)
+        # A single append keeps events from concurrent processes whole
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, data.encode())
+        finally:
+            os.close(fd)
+
+
+def read_trace(path: str | Path) -> list[dict]:
+    """Reads the events of a trace file written by one or more tracers"""
+    text = Path(path).read_text().strip()
+    if not text:
+        return []
+    if text.endswith(","):
+        text = text[:-1]
+    if not text.endswith("]"):
+        text += "]"
+    return json.loads(text)
+
+
+def summarize_trace(events: list[dict]) -> dict[str, dict[str, float]]:
+    """Total calls and seconds spent in each span name"""
+    totals: dict[str, dict[str, float]] = defaultdict(
+        lambda: {"calls": 0, "seconds": 0.0}
+    )
+    for event in events:
+        totals[event["name"]]["calls"] += 1
+        totals[event["name"]]["seconds"] += event["dur"] / 1e6
+    return dict(totals)
+
+
+_tracer: Tracer | None = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """Returns the process-wide tracer, enabled when P2C_TRACE_FILE is set"""
+    global _tracer
+    if _tracer is not None:
+        return _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            path = os.environ.get("P2C_TRACE_FILE") or None
+            _tracer = Tracer(path, enabled=path is not None)
+            if path is not None:
+                atexit.register(_tracer.flush)
+    return _tracer
+
+
+def set_tracer(tracer: Tracer | None):
+    global _tracer
+    _tracer = tracer
+
+
+def span(name: str, /, **attributes):
+    """Context manager timing a block as a child of the current span"""
+    return get_tracer().span(name, **attributes)
+
+
+def current_span():
+    """The innermost open span, or a no-op span when there is none"""
+    return _current_span.get() or _NOOP_SPAN
+
+
+def traced(name: str | None = None, attributes: tuple[str, ...] = ()):
+    """Decorator timing every call of a function or coroutine function
+
+    `attributes` names arguments of the function to record on the span.
+    """
+
+    def decorator(func):
+        span_name = name or func.__name__
+        signature = inspect.signature(func)
+
+        def span_attributes(args, kwargs) -> dict:
+            if not attributes:
+                return {}
+            bound = signature.bind_partial(*args, **kwargs)
+            bound.apply_defaults()
+            return {a: bound.arguments.get(a) for a in attributes}
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                tracer = get_tracer()
+                if not tracer.enabled:
+                    return await func(*args, **kwargs)
+                with tracer.span(span_name, **span_attributes(args, kwargs)):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = get_tracer()
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with tracer.span(span_name, **span_attributes(args, kwargs)):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+if __name__ == "__main__":
+    summary = summarize_trace(read_trace(sys.argv[1]))
+    print(f"{'span':<24} {'calls':>6} {'seconds':>9}")
+    for name, total in sorted(summary.items(), key=lambda x: -x[1]["seconds"]):
+        print(f"{name:<24} {total['calls']:>6} {total['seconds']:>9.2f}")
@@ -0,0 +1,194 @@
+"""Isolated git worktrees, so several agents can work on one repository at once
+
+Each task gets a workspace: a `git worktree` of the repository with the task's own
+branch checked out, where its code and tests are written, run and committed without
+touching the main working tree or the other tasks.  Released worktrees are detached
+from their branch and kept warm in a pool of at most `size`, so the next task only
+resets one to the base commit instead of checking out a new tree, and the rest are
+removed.
+
+    pool = WorkspacePool(".")
+    with pool.workspace("HumanEval/0") as workspace:
+        run_agent("tdd", "HumanEval/0", Path("solution.py"), task, workspace=workspace)
+    pool.close()
+"""
+import os
+import re
+import threading
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+from create_branch import GitBranchCRUD
+from prompt_to_code.tools.execution import run_shell_command
+from prompt_to_code.tools.file_writer import forget_written
+from prompt_to_code.tools.git import GitError, GitRepository
+
+# Released worktrees kept for reuse, more are removed
+DEFAULT_WORKTREE_POOL_SIZE = int(os.environ.get("P2C_WORKTREE_POOL_SIZE", 4))
+BRANCH_PREFIX = "p2c-"
+
+
+def branch_name(task: str) -> str:
+    """A valid branch name for a task id, e.g. p2c-HumanEval-0 for HumanEval/0"""
+    return BRANCH_PREFIX + (re.sub(r"[^a-zA-Z0-9\-_]+", "-", task).strip("-") or "task")
+
+
+@dataclass
+class Workspace:
+    path: Path
+    branch: str
+    task: str | None = None
+
+    @property
+    def git(self) -> GitBranchCRUD:
+        return GitBranchCRUD(self.path)
+
+    def run(self, command: str, timeout=60) -> tuple[str, bool]:
+        """Runs a shell command in the worktree"""
+        return run_shell_command(command, timeout=timeout, cwd=self.path)
+
+
+class WorkspacePool:
+    def __init__(
+        self,
+        repo: Path | str = ".",
+        root: Path | str | None = None,
+        size: int = DEFAULT_WORKTREE_POOL_SIZE,
+        base: str = "HEAD",
+    ):
+        """Worktrees of repo in root, by default inside its .git directory
+
+        Tasks branch off `base` of the main working tree, resolved when they start.
+        """
+        self.repo = Path(repo).resolve()
+        self._repository = GitRepository(self.repo)
+        try:
+            common = self._repository.git_dir
+        except GitError:
+            raise RuntimeError(f"Not a git repository: {self.repo}")
+        self.root = Path(root) if root is not None else common / "p2c-worktrees"
+        self.size = size
+        self.base = base
+        self._idle: list[Path] = []
+        self._busy: dict[Path, Workspace] = {}
+        self._lock = threading.Lock()
+        # Adding and removing worktrees writes the repository's shared metadata
+        self._admin_lock = threading.Lock()
+        self._adopt()
+
+    def _git(self, *args: str, cwd: Path | None = None) -> str:
+        repository = self._repository if cwd is None else GitRepository(cwd)
+        return repository.git(*args).stdout.strip()
+
+    def _adopt(self):
+        """Reuses the worktrees left in root by an earlier pool"""
+        with self._admin_lock:
+            self._git("worktree", "prune")
+            listing = self._git("worktree", "list", "--porcelain")
+        root = self.root.resolve()
+        for line in listing.splitlines():
+            if line.startswith("worktree "):
+                path = Path(line[len("worktree ") :])
+                if path.parent == root:
+                    self._idle.append(path)
+
+    def _resolve_base(self) -> str:
+        return self._git("rev-parse", "--verify", f"{self.base}^{{commit}}")
+
+    def _new_worktree(self, commit: str) -> Path:
+        path = self.root / f"worktree-{uuid.uuid4().hex[:8]}"
+        with self._admin_lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            self._git("worktree", "add", "--detach", str(path), commit)
+        return path
+
+    def _remove(self, path: Path):
+        with self._admin_lock:
+            self._git("worktree", "remove", "--force", str(path))
+
+    def acquire(self, task: str, branch: str | None = None) -> Workspace:
+        """A worktree with the task's branch checked out
+
+        An existing branch is continued, otherwise it is created from `base`.  A
+        branch can only be checked out in one worktree at a time.
+        """
+        branch = branch or branch_name(task)
+        commit = self._resolve_base()
+        with self._lock:
+            path = self._idle.pop() if self._idle else None
+        try:
+            if path is None:
+                path = self._new_worktree(commit)
+            else:
+                # Files written by the worktree's previous task are not this one's
+                forget_written(path)
+            # Discards what a previous task left, but keeps the ignored files (e.g.
+            # caches) it built
+            if branch in self._repository.branches():
+                self._git("checkout", "--force", branch, cwd=path)
+            else:
+                self._git("checkout", "--force", "-b", branch, commit, cwd=path)
+            self._git("clean", "-fd", cwd=path)
+        except RuntimeError:
+            if path is not None:
+                self._release_path(path)
+            raise
+        workspace = Workspace(path, branch, task)
+        with self._lock:
+            self._busy[path] = workspace
+        return workspace
+
+    def release(self, workspace: Workspace):
+        """Returns a workspace to the pool, its branch and commits stay in the repo"""
+        with self._lock:
+            self._busy.pop(workspace.path, None)
+        # Detach so the branch can be checked out elsewhere, e.g. to open a PR
+        GitRepository(workspace.path).git(
+            "checkout", "--detach", "--force", check=False
+        )
+        self._release_path(workspace.path)
+
+    def _release_path(self, path: Path):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(path)
+                return
+        self._remove(path)
+
+    @contextmanager
+    def workspace(self, task: str, branch: str | None = None):
+        workspace = self.acquire(task, branch)
+        try:
+            yield workspace
+        finally:
+            self.release(workspace)
+
+    @property
+    def idle(self) -> list[Path]:
+        return list(self._idle)
+
+    @property
+    def busy(self) -> list[Workspace]:
+        return list(self._busy.values())
+
+    def gc(self):
+        """Removes the idle worktrees beyond `size` and forgets deleted ones"""
+        with self._lock:
+            extra, self._idle = self._idle[self.size :], self._idle[: self.size]
+        for path in extra:
+            self._remove(path)
+        with self._admin_lock:
+            self._git("worktree", "prune")
+
+    def close(self):
+        """Removes every idle worktree, busy ones are removed when released"""
+        self.size = 0
+        self.gc()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import openai.error
+
+from prompt_to_code.agents.async_agents import (
+    LLMLimiter,
+    _agenerate,
+    acall_llm,
+    arun_agent,
+)
+from prompt_to_code.agents.cache import LLMCache
+from prompt_to_code.agents.fake_llm import TDD_RULES, FakeLLM
+from prompt_to_code.agents.metering import Meter, set_meter
+from prompt_to_code.agents.streaming import StreamCancelled
+from prompt_to_code.agents.transcripts import flush_transcripts
+from prompt_to_code.tools.execution import arun_shell_command
+
+
+def rate_limited(retry_after="0"):
+    return openai.error.RateLimitError(
+        "slow down", headers={"retry-after": retry_after}
+    )
+
+
+class TestLLMLimiter(unittest.TestCase):
+    def test_bounds_the_calls_in_flight(self):
+        limiter = LLMLimiter(concurrency=3)
+        in_flight = []
+        peak = []
+
+        async def call(i):
+            in_flight.append(i)
+            peak.append(len(in_flight))
+            await asyncio.sleep(0.01)
+            in_flight.remove(i)
+            return i
+
+        async def main():
+            return await asyncio.gather(*(limiter.run(call, i) for i in range(10)))
+
+        self.assertEqual(asyncio.run(main()), list(range(10)))
+        self.assertEqual(max(peak), 3)
+
+    def test_retries_after_the_retry_after_header(self):
+        limiter = LLMLimiter(base_delay=10)
+        attempts = []
+
+        async def call():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise rate_limited()
+            return "done"
+
+        # A backoff of base_delay would take 10s, the header says 0s
+        result = asyncio.run(asyncio.wait_for(limiter.run(call), timeout=5))
+        self.assertEqual((result, len(attempts)), ("done", 3))
+        self.assertEqual(limiter.backoff(0, rate_limited("120")), limiter.max_delay)
+
+    def test_raises_after_max_retries(self):
+        limiter = LLMLimiter(max_retries=2, base_delay=0)
+        attempts = []
+
+        async def call():
+            attempts.append(1)
+            raise rate_limited(None)
+
+        with self.assertRaises(openai.error.RateLimitError):
+            asyncio.run(limiter.run(call))
+        self.assertEqual(len(attempts), 3)
+
+    def test_other_errors_are_not_retried(self):
+        attempts = []
+
+        async def call():
+            attempts.append(1)
+            raise ValueError("bad prompt")
+
+        with self.assertRaises(ValueError):
+            asyncio.run(LLMLimiter().run(call))
+        self.assertEqual(len(attempts), 1)
+
+
+class SyncOnlyLLM:
+    """An LLM without async support"""
+
+    async def agenerate(self, prompts):
+        raise NotImplementedError
+
+    def __call__(self, prompt):
+        return f"{prompt} on {threading.current_thread().name}"
+
+
+class CancellingLLM:
+    """Streams a character at a time, cancelling the request after three"""
+
+    def __init__(self, cancel: threading.Event):
+        self.cancel = cancel
+
+    def stream(self, prompt):
+        for i, char in enumerate("def solution():\n    pass\n"):
+            if i == 3:
+                self.cancel.set()
+            yield char
+
+
+class TestAcallLLM(unittest.TestCase):
+    def setUp(self):
+        self.meter = Meter()
+        set_meter(self.meter)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {"P2C_TRANSCRIPT_DIR": self.tmpdir.name})
+        self.env.start()
+
+    def tearDown(self):
+        set_meter(None)
+        flush_transcripts()
+        self.env.stop()
+        self.tmpdir.cleanup()
+
+    def test_cancelled_requests_meter_their_partial_usage(self):
+        cancel = threading.Event()
+        with self.assertRaises(StreamCancelled):
+            asyncio.run(
+                acall_llm(
+                    CancellingLLM(cancel), "prompt", use_cache=False, cancel=cancel
+                )
+            )
+        (usage,) = self.meter.records
+        self.assertGreater(usage.completion_tokens, 0)
+
+    def test_completions_are_cached(self):
+        llm = FakeLLM(responses=["def add(x, y):\n    return x + y\n"])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = LLMCache(Path(cache_dir) / "cache.sqlite")
+            first = asyncio.run(acall_llm(llm, "def add(x, y): ...", cache=cache))
+            second = asyncio.run(acall_llm(llm, "def add(x, y): ...", cache=cache))
+        self.assertEqual((first, llm.calls), (second, 1))
+        self.assertEqual([usage.cached for usage in self.meter.records], [False, True])
+
+
+class TestAsyncHelpers(unittest.TestCase):
+    def test_sync_llms_run_on_a_worker_thread(self):
+        result = asyncio.run(_agenerate(SyncOnlyLLM(), "prompt"))
+        self.assertTrue(result.startswith("prompt on "))
+        self.assertNotIn(threading.main_thread().name, result)
+
+    def test_arun_shell_command(self):
+        self.assertEqual(asyncio.run(arun_shell_command("echo hi")), ("hi", False))
+        output, failed = asyncio.run(arun_shell_command("exit 3"))
+        self.assertTrue(failed)
+        output, failed = asyncio.run(arun_shell_command("sleep 5", timeout=0.1))
+        self.assertTrue(failed)
+        self.assertIn("TimeoutError", output)
+
+
+class TestArunAgent(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+
+    def tearDown(self):
+        flush_transcripts()
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def test_runs_every_step(self):
+        llm = FakeLLM(rules=TDD_RULES)
+        filename = Path("add.py")
+        test_results, failed = asyncio.run(
+            arun_agent("fake", "add", filename, "def add(x, y): ...", llm=llm)
+        )
+        self.assertGreaterEqual(llm.calls, 3)
+        self.assertIn("return x", filename.read_text())
+        self.assertIn("def test_solution", Path("tests/test_add.py").read_text())
+        self.assertIsInstance(test_results, str)
+        self.assertIsInstance(failed, bool)
+
+
+if __name__ == "__main__":
+    unittest.main()
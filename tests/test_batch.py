@@ -0,0 +1,128 @@
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from prompt_to_code.agents.transcripts import flush_transcripts
+from prompt_to_code.batch import ResultWriter, read_requests, read_results, run_batch
+
+
+def write_requests(path: Path, requests: list[dict]):
+    path.write_text("".join(json.dumps(r) + "\n" for r in requests))
+
+
+class TestReadRequests(unittest.TestCase):
+    def test_reads_ids_and_defaults(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "requests.jsonl"
+            write_requests(
+                path,
+                [
+                    {"request_id": "a", "body": "def add(x, y): ..."},
+                    {"prompt": "def sub(x, y): ...", "agent": "fake"},
+                ],
+            )
+            path.write_text(path.read_text() + "\n")
+            requests = list(read_requests(path))
+        self.assertEqual([r.id for r in requests], ["a", "2"])
+        self.assertEqual(requests[0].prompt, "def add(x, y): ...")
+        self.assertIsNone(requests[0].agent)
+        self.assertEqual(requests[1].agent, "fake")
+
+    def test_results_ignore_a_truncated_line(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "results.jsonl"
+            path.write_text(
+                '{"id": "a", "status": "error"}\n'
+                '{"id": "a", "status": "ok"}\n'
+                '{"id": "b", "sta'
+            )
+            results = read_results(path)
+        self.assertEqual(list(results), ["a"])
+        self.assertEqual(results["a"]["status"], "ok")
+
+    def test_results_after_a_truncated_line_are_kept(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = Path(tmpdir) / "results.jsonl"
+            path.write_text('{"id": "a", "status": "ok"}\n{"id": "b", "sta')
+            with ResultWriter(path) as writer:
+                writer.write({"id": "c", "status": "ok"})
+            self.assertEqual(list(read_results(path)), ["a", "c"])
+
+
+class TestRunBatch(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+        self.requests = Path("requests.jsonl")
+        write_requests(
+            self.requests,
+            [
+                {"id": f"task/{i}", "prompt": f"def f{i}(x): ...", "name": f"f{i}"}
+                for i in range(3)
+            ],
+        )
+
+    def tearDown(self):
+        flush_transcripts()
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def test_runs_each_request_in_its_own_directory(self):
+        seen = []
+        summary = run_batch(
+            self.requests,
+            outdir="out",
+            concurrency=2,
+            agent="fake",
+            on_result=seen.append,
+        )
+        self.assertEqual(summary.passed + summary.failed, 3)
+        self.assertEqual(summary.errors, 0)
+        self.assertEqual(len(seen), 3)
+        results = read_results("out/results.jsonl")
+        self.assertEqual(sorted(results), ["task/0", "task/1", "task/2"])
+        for i in range(3):
+            self.assertTrue(Path(f"out/task_{i}/f{i}.py").exists())
+            self.assertTrue(Path(f"out/task_{i}/tests/test_f{i}.py").exists())
+
+    def test_resumes_and_retries_errors(self):
+        Path("out").mkdir()
+        Path("out/results.jsonl").write_text(
+            '{"id": "task/0", "status": "ok"}\n{"id": "task/1", "status": "error"}\n'
+        )
+        summary = run_batch(self.requests, outdir="out", agent="fake")
+        self.assertEqual((summary.errors, summary.skipped), (0, 1))
+        self.assertFalse(Path("out/task_0").exists())
+        lines = Path("out/results.jsonl").read_text().splitlines()
+        self.assertEqual(len(lines), 4)
+
+    def test_default_agent_requests_share_a_logger(self):
+        with mock.patch("prompt_to_code.agent.run", return_value="done") as run:
+            summary = run_batch(self.requests, outdir="out", concurrency=2)
+        self.assertEqual(summary.passed, 3)
+        loggers = {id(call.kwargs["logger"]) for call in run.call_args_list}
+        self.assertEqual(len(loggers), 1)
+        self.assertIsNotNone(run.call_args.kwargs["logger"])
+
+    def test_records_errors_and_carries_on(self):
+        write_requests(
+            self.requests,
+            [
+                {"id": "bad", "prompt": "x", "agent": "unknown"},
+                {"id": "good", "prompt": "def f(x): ..."},
+            ],
+        )
+        summary = run_batch(self.requests, outdir="out", agent="fake", concurrency=1)
+        self.assertEqual((summary.errors, summary.skipped), (1, 0))
+        results = read_results("out/results.jsonl")
+        self.assertEqual(results["bad"]["status"], "error")
+        self.assertNotEqual(results["good"]["status"], "error")
+        self.assertIn("error", results["bad"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import os
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+from prompt_to_code import callgraph
+from prompt_to_code.agents.agents import create_function_list_for_prompts
+from prompt_to_code.callgraph import (
+    CallGraph,
+    extract_calls,
+    get_default_callgraph,
+    module_name,
+)
+
+CORE = """
+class Parser:
+    def __init__(self, text):
+        self.text = text
+
+    def run(self):
+        return self.helper() + self.helper()
+
+    def helper(self):
+        return len(self.text)
+
+
+def parse(text):
+    return Parser(text).run()
+"""
+
+APP = """
+import pkg.core
+from pkg import parse as p
+
+
+def main():
+    p(1)
+    p(2)
+    pkg.core.parse(3)
+    items = []
+    items.append(4)
+"""
+
+
+class TestCallGraph(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+        (self.root / "pkg").mkdir()
+        (self.root / "pkg" / "__init__.py").write_text("from .core import parse\n")
+        (self.root / "pkg" / "core.py").write_text(CORE)
+        (self.root / "app.py").write_text(APP)
+        self.graph = CallGraph(self.root)
+        self.graph.update()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_module_name(self):
+        self.assertEqual(module_name("pkg/__init__.py"), "pkg")
+        self.assertEqual(module_name("pkg/core.py"), "pkg.core")
+
+    def test_resolves_imports_reexports_and_methods(self):
+        self.assertEqual(self.graph.callees("app.main"), [("pkg.core.parse", 3)])
+        self.assertEqual(
+            self.graph.callees("pkg.core.Parser.run"),
+            [("pkg.core.Parser.helper", 2)],
+        )
+        # Methods of an instance are not resolved, constructors are
+        self.assertEqual(
+            self.graph.callees("pkg.core.parse"), [("pkg.core.Parser.__init__", 1)]
+        )
+        self.assertEqual(self.graph.callers("pkg.core.parse"), [("app.main", 3)])
+        self.assertEqual(
+            self.graph.usages("pkg.core.Parser.helper", k=1),
+            {"calls": [("len", 1)], "called_by": [("pkg.core.Parser.run", 2)]},
+        )
+        self.assertIn("pkg.core.Parser.run", self.graph)
+
+    def test_top_k_by_call_sites(self):
+        self.graph.update_source(
+            "hub.py", "def hub():\n" + "".join(f"    f{i}()\n" * i for i in range(1, 6))
+        )
+        self.assertEqual(self.graph.callees("hub.hub", k=2), [("f5", 5), ("f4", 4)])
+
+    def test_updating_one_file_re_resolves_its_importers(self):
+        (self.root / "pkg" / "core.py").write_text(
+            CORE.replace("def parse(", "def parse_text(")
+        )
+        (self.root / "pkg" / "__init__.py").write_text(
+            "from .core import parse_text as parse\n"
+        )
+        time.sleep(0.01)
+        self.assertEqual(
+            sorted(self.graph.update()), ["pkg/__init__.py", "pkg/core.py"]
+        )
+        self.assertEqual(
+            dict(self.graph.callees("app.main")),
+            {"pkg.core.parse_text": 2, "pkg.core.parse": 1},
+        )
+        self.assertEqual(self.graph.callers("pkg.core.parse"), [("app.main", 1)])
+
+        (self.root / "app.py").unlink()
+        self.assertEqual(self.graph.update(), ["app.py"])
+        self.assertEqual(self.graph.callers("pkg.core.parse_text"), [])
+
+    def test_prompts_list_usages_across_the_repository(self):
+        stub = self.root / "pkg" / "core.py"
+        section = create_function_list_for_prompts(
+            stub, "def parse(text):\n    ...\n", graph=self.graph
+        )
+        self.assertIn("Calls: pkg.core.Parser.__init__", section)
+        self.assertIn("Called by: app.main", section)
+
+        # Files outside of the repository have no usages
+        section = create_function_list_for_prompts(
+            "parse.py", "def parse(text):\n    ...\n", graph=self.graph
+        )
+        self.assertNotIn("Called by", section)
+
+    def test_syntax_errors_are_recorded(self):
+        self.assertIn("SyntaxError", extract_calls("bad.py", "def f(:\n").error)
+
+    def test_concurrent_first_use_builds_one_default_graph(self):
+        updated = []
+
+        def slow_update(graph):
+            time.sleep(0.1)
+            updated.append(graph)
+
+        def first_use(_):
+            # Every thread gets the graph once its update is done
+            graph = get_default_callgraph()
+            return graph, graph in updated
+
+        env = {"P2C_INDEX_ROOT": str(self.root)}
+        update = mock.patch.object(
+            CallGraph, "update", autospec=True, side_effect=slow_update
+        )
+        with mock.patch.dict(os.environ, env), update, mock.patch.object(
+            callgraph, "_default_graph", None
+        ):
+            with ThreadPoolExecutor(8) as executor:
+                graphs, ready = zip(*executor.map(first_use, range(8)))
+        self.assertEqual(len({id(graph) for graph in graphs}), 1)
+        self.assertTrue(all(ready))
+        self.assertEqual(len(updated), 1)
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+import unittest
+
+# Microseconds to import the CLI, well above its usual cost without the agents
+IMPORT_TIME_BUDGET = 500_000
+HEAVY_MODULES = ["langchain", "openai", "numpy", "networkx", "pyfiglet"]
+
+
+def run_python(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args], capture_output=True, text=True, check=True
+    )
+
+
+class TestCliStartup(unittest.TestCase):
+    def test_import_time(self):
+        result = run_python("-X", "importtime", "-c", "import prompt_to_code.cli.main")
+        cumulative = {}
+        for line in result.stderr.splitlines():
+            if line.startswith("import time:") and "|" in line:
+                _self, total, name = line[len("import time:") :].split("|")
+                if total.strip().isdigit():
+                    cumulative[name.strip()] = int(total)
+
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, cumulative)
+        self.assertLess(cumulative["prompt_to_code.cli.main"], IMPORT_TIME_BUDGET)
+
+    def test_show_config_without_the_agents(self):
+        result = run_python(
+            "-c",
+            "import sys\n"
+            "from prompt_to_code.cli.main import show_config\n"
+            "show_config()\n"
+            f"print(sorted(m for m in {HEAVY_MODULES} if m in sys.modules))\n",
+        )
+        self.assertIn("PromptToCodeConfig", result.stdout)
+        self.assertTrue(result.stdout.rstrip().endswith("[]"))
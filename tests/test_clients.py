@@ -0,0 +1,116 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import openai
+
+from prompt_to_code.agents.agent_tdd import TDDMachine
+from prompt_to_code.agents.clients import ClientRegistry
+
+
+class StubOpenAI(BaseHTTPRequestHandler):
+    """Answers chat and completion requests like the OpenAI API, with keep-alive"""
+
+    protocol_version = "HTTP/1.1"
+    paths = []
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.paths.append(self.path)
+        if self.path.endswith("/chat/completions"):
+            choice = {"message": {"role": "assistant", "content": "hello"}}
+        else:
+            choice = {"text": "hello", "finish_reason": "stop"}
+        body = json.dumps(
+            {
+                "id": "stub",
+                "object": "completion",
+                "model": request["model"],
+                "choices": [{"index": 0, **choice}],
+                "usage": {
+                    "prompt_tokens": 1,
+                    "completion_tokens": 1,
+                    "total_tokens": 2,
+                },
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestClientRegistry(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubOpenAI)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        host, port = self.server.server_address
+        patches = [
+            mock.patch.object(openai, "api_base", f"http://{host}:{port}/v1"),
+            mock.patch.object(openai, "api_key", "test"),
+            mock.patch("openai.api_requestor._make_session"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.registry = ClientRegistry(pool_size=4)
+
+    def tearDown(self):
+        self.registry.clear()
+        self.server.shutdown()
+        self.server.server_close()
+        import openai.api_requestor
+
+        if hasattr(openai.api_requestor._thread_context, "session"):
+            del openai.api_requestor._thread_context.session
+
+    def test_clients_are_shared_by_configuration(self):
+        config = {"model": "gpt-4", "temperature": 0.7, "openai_api_key": "test"}
+        llm = self.registry.get(**config)
+        self.assertIs(self.registry.get(**config), llm)
+        self.assertEqual(type(llm).__name__, "ChatOpenAI")
+        self.assertIsNot(self.registry.get(**{**config, "temperature": 0}), llm)
+        completion = self.registry.get(
+            model_name="text-davinci-003", openai_api_key="test"
+        )
+        self.assertEqual(type(completion).__name__, "OpenAI")
+        self.assertEqual(self.registry.stats().clients, 3)
+
+    def test_connections_are_reused_across_clients_and_threads(self):
+        chat = self.registry.get(model_name="gpt-4", openai_api_key="test")
+        completion = self.registry.get(
+            model_name="text-davinci-003", openai_api_key="test"
+        )
+        self.assertEqual(chat.call_as_llm("hi"), "hello")
+        self.assertEqual(completion("hi"), "hello")
+        thread = threading.Thread(target=chat.call_as_llm, args=("hi",))
+        thread.start()
+        thread.join()
+
+        stats = self.registry.stats()
+        self.assertEqual((stats.requests, stats.connections), (3, 1))
+        self.assertEqual(stats.reused, 2)
+        self.assertEqual(
+            StubOpenAI.paths[-3:],
+            ["/v1/chat/completions", "/v1/completions", "/v1/chat/completions"],
+        )
+
+    def test_installed_session_keeps_the_openai_proxy(self):
+        import openai.api_requestor
+
+        proxy = "http://proxy.example:3128"
+        with mock.patch.object(openai, "proxy", proxy):
+            self.registry.install()
+        session = openai.api_requestor._make_session()
+        self.assertIs(session, self.registry.session)
+        self.assertEqual(session.proxies, {"http": proxy, "https": proxy})
+
+    def test_tdd_states_create_clients_lazily(self):
+        self.assertIsInstance(TDDMachine.red.llm_config, dict)
+        self.assertEqual(TDDMachine.red.llm_config["model"], "gpt-4")
@@ -0,0 +1,117 @@
+import os
+import unittest
+from unittest import mock
+
+from prompt_to_code.agents.agents import build_green_prompt
+from prompt_to_code.agents.context import (
+    ContextPacker,
+    Piece,
+    context_window,
+    summarize_test_output,
+)
+from prompt_to_code.agents.fake_llm import FakeLLM
+
+TEMPLATE = "# TASK\n{prompt}\n# FUNCTIONS\n{functions}\n# ERRORS\n{errors}\n"
+
+PYTEST_OUTPUT = (
+    "============================= test session starts ==============================\n"
+    + "collected 1 item\n" * 200
+    + "_________________________________ test_add __________________________________\n"
+    "E       assert 4 == 5\n"
+    "FAILED tests/test_add.py::test_add - assert 4 == 5\n"
+    "============================== 1 failed in 0.01s ===============================\n"
+)
+
+
+def functions(n: int) -> str:
+    return "".join(f"\n## Filename: `f.py`\n### Name: f{i}\n" for i in range(n))
+
+
+class TestContextPacker(unittest.TestCase):
+    def test_everything_fits(self):
+        packed = ContextPacker(1000).format(
+            TEMPLATE,
+            [
+                Piece("prompt", "add two numbers", priority=100),
+                Piece("functions", functions(2), priority=50),
+                Piece("errors", "", priority=80),
+            ],
+        )
+        self.assertEqual(packed.dropped, [])
+        self.assertIn("### Name: f1", packed.prompt)
+        self.assertLessEqual(packed.tokens, 1000)
+
+    def test_lower_priorities_are_shortened_first(self):
+        packer = ContextPacker(300)
+        packed = packer.format(
+            TEMPLATE,
+            [
+                Piece("prompt", "add two numbers " * 20, priority=100),
+                Piece(
+                    "functions", functions(100), priority=50, separator="\n## Filename"
+                ),
+                Piece(
+                    "errors",
+                    PYTEST_OUTPUT,
+                    priority=80,
+                    truncate="tail",
+                    summary=summarize_test_output(PYTEST_OUTPUT),
+                ),
+            ],
+        )
+        self.assertLessEqual(packed.tokens, 300)
+        self.assertEqual(
+            [(o.name, o.action) for o in packed.dropped],
+            [("errors", "summarized"), ("functions", "truncated")],
+        )
+        self.assertIn("add two numbers " * 20, packed.prompt)
+        self.assertIn("E       assert 4 == 5", packed.prompt)
+        self.assertNotIn("collected 1 item", packed.prompt)
+        # Functions are cut between entries, keeping the first ones
+        self.assertIn("### Name: f0\n", packed.prompt)
+        self.assertNotIn("Name: f99", packed.prompt)
+        self.assertRegex(packed.prompt, r"### Name: f\d+\n\n\.\.\.\n")
+        self.assertIn("functions truncated", packed.report())
+
+    def test_tail_truncation_and_dropping(self):
+        packer = ContextPacker(120)
+        packed = packer.format(
+            TEMPLATE,
+            [
+                Piece("prompt", "", priority=100),
+                Piece("errors", PYTEST_OUTPUT, priority=80, truncate="tail"),
+                Piece("functions", functions(50), priority=50, truncate=None),
+            ],
+        )
+        self.assertEqual(
+            [(o.name, o.action) for o in packed.dropped],
+            [("errors", "truncated"), ("functions", "dropped")],
+        )
+        self.assertIn("1 failed in 0.01s", packed.prompt)
+        self.assertNotIn("Name: f0", packed.prompt)
+
+    def test_budget_for_llm(self):
+        self.assertEqual(context_window("gpt-4-0314"), 8192)
+        self.assertEqual(context_window("gpt-4-32k-0314"), 32768)
+        self.assertEqual(
+            ContextPacker.for_llm(
+                mock.Mock(model_name="gpt-4", max_tokens=2000)
+            ).budget,
+            6192,
+        )
+        with mock.patch.dict(os.environ, {"P2C_PROMPT_TOKEN_BUDGET": "500"}):
+            self.assertEqual(ContextPacker.for_llm(FakeLLM()).budget, 500)
+
+    def test_green_prompt_fits_the_budget(self):
+        with mock.patch.dict(os.environ, {"P2C_PROMPT_TOKEN_BUDGET": "400"}):
+            prompt = build_green_prompt(
+                "add.py",
+                "def add(x, y): ...",
+                "# FUNCTIONS:\n" + functions(200),
+                "def test_add():\n    assert add(2, 2) == 5\n",
+                PYTEST_OUTPUT,
+                llm=FakeLLM(),
+            )
+        self.assertIn("def test_add():", prompt)
+        self.assertIn("E       assert 4 == 5", prompt)
+        self.assertLess(len(prompt), 400 * 5)
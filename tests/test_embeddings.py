@@ -0,0 +1,128 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from prompt_to_code import embeddings
+from prompt_to_code.agents.agents import create_function_list_for_prompts
+from prompt_to_code.embeddings import HashingEmbedder, VectorStore, tokenize, top_k
+from prompt_to_code.indexer import FunctionIndex
+
+STUB = '''
+def parse_csv_rows(text: str) -> list[list[str]]:
+    """Split CSV text into rows"""
+
+def send_email(address: str, body: str) -> None:
+    """Send an email"""
+
+def resize_image(path: str, width: int) -> None:
+    """Resize an image file"""
+'''
+
+
+class TestEmbeddings(unittest.TestCase):
+    def test_tokenize_splits_identifiers(self):
+        self.assertEqual(
+            tokenize("def parseHTTPResponse(raw_bytes2):"),
+            ["parse", "http", "response", "raw", "bytes", "2"],
+        )
+
+    def test_embeddings_are_deterministic_unit_vectors(self):
+        embedder = HashingEmbedder(dimensions=64)
+        matrix = embedder.embed(["parse csv rows", "parse csv rows", ""])
+        self.assertEqual((matrix.shape, matrix.dtype), ((3, 64), np.float32))
+        self.assertTrue(matrix.flags["C_CONTIGUOUS"])
+        np.testing.assert_array_equal(matrix[0], matrix[1])
+        self.assertAlmostEqual(float(np.linalg.norm(matrix[0])), 1.0, places=5)
+        self.assertEqual(float(np.linalg.norm(matrix[2])), 0.0)
+
+    def test_top_k_across_blocks(self):
+        rng = np.random.default_rng(0)
+        matrix = embeddings.normalize(rng.normal(size=(100, 16)))
+        queries = embeddings.normalize(rng.normal(size=(3, 16)))
+        expected = np.argsort(-(queries @ matrix.T), axis=1)[:, :5]
+        with mock.patch.object(embeddings, "SEARCH_BLOCK_SIZE", 7):
+            indices, scores = top_k(queries, matrix, 5)
+        np.testing.assert_array_equal(indices, expected)
+        self.assertTrue(np.all(np.diff(scores, axis=1) <= 0))
+        self.assertEqual(top_k(queries, matrix[:2], 5)[0].shape, (3, 2))
+
+    def test_search_and_memory_mapped_reload(self):
+        store = VectorStore.from_texts(
+            ["csv", "email", "image"],
+            ["parse_csv_rows", "send_email", "resize_image"],
+        )
+        results = store.search(["read the csv file rows", "email the user"], k=1)
+        self.assertEqual([r[0][0] for r in results], ["csv", "email"])
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store.save(Path(tmpdir) / "vectors")
+            loaded = VectorStore.load(Path(tmpdir) / "vectors")
+            self.assertIsInstance(loaded.matrix, np.memmap)
+            self.assertEqual(loaded.search(["resize an image"], k=1)[0][0][0], "image")
+
+
+class TestFunctionSelection(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        root = Path(self.tmpdir.name)
+        (root / "csv_utils.py").write_text(
+            "def read_csv_file(path):\n    return open(path).read()\n"
+        )
+        (root / "http.py").write_text("def http_get(url):\n    return url\n")
+        self.index = FunctionIndex(root)
+        self.index.update()
+
+    def tearDown(self):
+        self.index.close()
+        self.tmpdir.cleanup()
+
+    def test_index_search_is_rebuilt_after_changes(self):
+        self.assertEqual(
+            self.index.search("read a csv file", k=1)[0][0].name, "read_csv_file"
+        )
+        self.assertTrue(self.index.vectors_path.with_suffix(".npy").exists())
+
+        (self.index.root / "http.py").write_text("def parse_csv(text):\n    pass\n")
+        self.index.update()
+        reopened = FunctionIndex(self.index.root)
+        try:
+            names = {f.name for f, _ in reopened.search("csv", k=5)}
+        finally:
+            reopened.close()
+        self.assertEqual(names, {"read_csv_file", "parse_csv"})
+
+    def test_prompt_lists_only_the_most_relevant_functions(self):
+        # The stub's own functions come first, then the closest indexed ones
+        section = create_function_list_for_prompts(
+            "tasks.py", STUB, query="parse the csv rows", top_k=4, index=self.index
+        )
+        for name in ["parse_csv_rows", "send_email", "resize_image", "read_csv_file"]:
+            self.assertIn(name, section)
+        self.assertNotIn("http_get", section)
+
+        section = create_function_list_for_prompts(
+            "tasks.py", STUB, query="parse the csv rows", top_k=1, index=self.index
+        )
+        self.assertIn("parse_csv_rows", section)
+        self.assertNotIn("send_email", section)
+        self.assertNotIn("read_csv_file", section)
+
+        # The indexed copy of the file being written is stale
+        stub = self.index.root / "csv_utils.py"
+        section = create_function_list_for_prompts(
+            stub,
+            "def read_csv_file(path, encoding):\n    ...\n",
+            query="read a csv file",
+            top_k=4,
+            index=self.index,
+        )
+        self.assertEqual(section.count("def read_csv_file"), 1)
+        self.assertIn("encoding", section)
+
+        # Without a query the stub's functions are listed in order
+        section = create_function_list_for_prompts("tasks.py", STUB, top_k=2)
+        self.assertIn("send_email", section)
+        self.assertNotIn("resize_image", section)
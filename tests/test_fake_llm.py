@@ -0,0 +1,75 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from prompt_to_code.agents.agents import run_agent
+from prompt_to_code.agents.fake_llm import TDD_RULES, FakeLLM
+from prompt_to_code.agents.transcripts import (
+    Transcript,
+    TranscriptStore,
+    flush_transcripts,
+)
+
+
+class TestFakeLLM(unittest.TestCase):
+    def test_scripted_responses_cycle(self):
+        llm = FakeLLM(responses=["a", "b"])
+        self.assertEqual([llm("x"), llm("y"), llm("z")], ["a", "b", "a"])
+        self.assertEqual(llm.calls, 3)
+
+    def test_replay_then_rules(self):
+        llm = FakeLLM(replay={"known": "recorded"}, rules=[(r"STUB", "stub")])
+        self.assertEqual(llm("known"), "recorded")
+        self.assertEqual(llm("# STUB FILE:"), "stub")
+        with self.assertRaises(ValueError):
+            llm("unknown")
+
+    def test_stop_and_async(self):
+        llm = FakeLLM(responses=["Action: x\nObservation: y"], latency=0.01)
+        self.assertEqual(llm("p", stop=["\nObservation:"]), "Action: x")
+        result = asyncio.run(llm.agenerate(["p"]))
+        self.assertEqual(result.generations[0][0].text, "Action: x\nObservation: y")
+
+    def test_from_transcripts(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = TranscriptStore(tmpdir)
+            store.append(
+                Transcript(
+                    run_id="run",
+                    task="a",
+                    step="stub",
+                    prefix="human-eval-stub",
+                    model="gpt-4",
+                    prompt="prompt",
+                    response="response",
+                    prompt_tokens=1,
+                    completion_tokens=1,
+                    cost=0.0,
+                    duration=1.0,
+                    timestamp=0.0,
+                )
+            )
+            store.close()
+            self.assertEqual(FakeLLM.from_transcripts(tmpdir)("prompt"), "response")
+
+
+class TestRunAgentOffline(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+
+    def tearDown(self):
+        flush_transcripts()
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def test_runs_every_step(self):
+        llm = FakeLLM(rules=TDD_RULES)
+        filename = Path("add.py")
+        run_agent("fake", "add", filename, "def add(x, y): ...", llm=llm)
+        self.assertEqual(llm.calls, 3)
+        self.assertIn("return x", filename.read_text())
+        self.assertTrue(Path("tests/test_add.py").exists())
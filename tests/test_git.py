@@ -0,0 +1,135 @@
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from create_branch import GitBranchCRUD
+from prompt_to_code.tools.file_writer import record_written, written_files
+from prompt_to_code.tools.git import GitError, GitRepository, parse_status
+from tests.test_workspaces import git, make_repo
+
+
+def count_git_processes():
+    return mock.patch("prompt_to_code.tools.git.subprocess.run", wraps=subprocess.run)
+
+
+class TestParseStatus(unittest.TestCase):
+    def test_branch_and_entries(self):
+        output = "\0".join(
+            [
+                "# branch.oid 1234abcd",
+                "# branch.head feature",
+                "# branch.upstream origin/feature",
+                "# branch.ab +2 -1",
+                "1 .M N... 100644 100644 100644 aaaa bbbb src/a file.py",
+                "2 R. N... 100644 100644 100644 aaaa bbbb R100 new.py",
+                "old.py",
+                "? notes.txt",
+                "",
+            ]
+        )
+        status = parse_status(output)
+        self.assertEqual(status.head, "feature")
+        self.assertEqual(status.oid, "1234abcd")
+        self.assertEqual((status.ahead, status.behind), (2, 1))
+        self.assertEqual(status.changed, ["src/a file.py", "new.py"])
+        self.assertEqual(status.untracked, ["notes.txt"])
+        self.assertTrue(status.dirty)
+
+    def test_detached_before_the_first_commit(self):
+        status = parse_status("# branch.oid (initial)\0# branch.head (detached)\0")
+        self.assertIsNone(status.oid)
+        self.assertIsNone(status.head)
+        self.assertFalse(status.dirty)
+
+
+class TestGitRepository(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = make_repo(Path(self.tmpdir.name))
+        self.repo = GitRepository(self.path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_status_outside_a_repository(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            self.assertFalse(GitRepository(tmpdir).status().inside)
+
+    def test_branches_are_cached_until_the_refs_change(self):
+        self.assertEqual(self.repo.branches(), {"main"})
+        with count_git_processes() as run:
+            self.repo.branches()
+        self.assertEqual(run.call_count, 0)
+
+        git(self.path, "branch", "other")
+        self.assertEqual(self.repo.branches(), {"main", "other"})
+        git(self.path, "pack-refs", "--all")
+        git(self.path, "branch", "-D", "other")
+        self.assertEqual(self.repo.branches(), {"main"})
+
+    def test_commits_only_the_given_paths(self):
+        (self.path / "README.md").write_text("# Changed\n")
+        (self.path / "new.py").write_text("x = 1\n")
+        (self.path / "other.py").write_text("y = 2\n")
+        self.repo.commit("Add new.py", ["new.py"])
+
+        committed = git(self.path, "show", "--name-only", "--format=", "HEAD")
+        self.assertEqual(committed, "new.py")
+        self.assertEqual(self.repo.status().changed, ["README.md"])
+        self.assertEqual(self.repo.status().untracked, ["other.py"])
+        with self.assertRaisesRegex(GitError, "No changes"):
+            self.repo.commit("Again", ["new.py"])
+
+
+class TestGitBranchCRUD(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = make_repo(Path(self.tmpdir.name))
+        self.crud = GitBranchCRUD(self.path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_create_branch_in_three_processes(self):
+        self.crud.create_branch("feature")
+        with count_git_processes() as run:
+            # status, the changed branch listing and the checkout
+            self.crud.create_branch("second")
+        self.assertEqual(run.call_count, 3)
+        self.assertEqual(git(self.path, "branch", "--show-current"), "second")
+        with self.assertRaisesRegex(RuntimeError, "already exists"):
+            self.crud.create_branch("main")
+
+    def test_create_branch_checks(self):
+        with self.assertRaisesRegex(RuntimeError, "Invalid"):
+            self.crud.create_branch(".hidden")
+        (self.path / "dirty.py").write_text("")
+        with self.assertRaisesRegex(RuntimeError, "uncommitted"):
+            self.crud.create_branch("feature")
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaisesRegex(RuntimeError, "Not in a git repository"):
+                GitBranchCRUD(tmpdir).create_branch("feature")
+
+    def test_commits_the_written_files(self):
+        (self.path / "scratch.txt").write_text("not the agent's\n")
+        code = self.path / "pkg" / "code.py"
+        code.parent.mkdir()
+        code.write_text("x = 1\n")
+        record_written(code)
+
+        self.crud.commit_changes("Add code")
+        committed = git(self.path, "show", "--name-only", "--format=", "HEAD")
+        self.assertEqual(committed, "pkg/code.py")
+        self.assertEqual(written_files(self.path), [])
+        self.assertIn("scratch.txt", git(self.path, "status", "--porcelain"))
+
+    def test_commits_everything_without_written_files(self):
+        (self.path / "scratch.txt").write_text("x\n")
+        self.crud.commit_changes("Add scratch")
+        self.assertEqual(git(self.path, "status", "--porcelain"), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
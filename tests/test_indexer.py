@@ -0,0 +1,78 @@
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest import mock
+
+from prompt_to_code import indexer
+from prompt_to_code.indexer import FunctionIndex, get_default_index
+
+
+class TestFunctionIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmpdir.name)
+        (self.root / "pkg").mkdir()
+        (self.root / "pkg" / "a.py").write_text("def a(x):\n    return b(x)\n")
+        (self.root / "pkg" / "b.py").write_text("def b(x):\n    return x\n")
+        (self.root / ".venv").mkdir()
+        (self.root / ".venv" / "ignored.py").write_text("def ignored(): pass\n")
+        self.index = FunctionIndex(self.root)
+
+    def tearDown(self):
+        self.index.close()
+        self.tmpdir.cleanup()
+
+    def test_reparses_only_changed_files(self):
+        stats = self.index.update()
+        self.assertEqual((stats.files, stats.parsed, stats.functions), (2, 2, 2))
+        self.assertEqual(self.index.functions(name="a")[0].filename, "pkg/a.py")
+
+        stats = self.index.update()
+        self.assertEqual((stats.parsed, stats.unchanged), (0, 2))
+
+        # A new mtime with the same content is not reparsed
+        os.utime(self.root / "pkg" / "b.py", ns=(1, 1))
+        self.assertEqual(self.index.update().parsed, 0)
+
+        (self.root / "pkg" / "a.py").write_text("def a2():\n    pass\n")
+        stats = self.index.update()
+        self.assertEqual((stats.parsed, stats.unchanged), (1, 1))
+        self.assertEqual(
+            [f.name for f in self.index.functions(path="pkg/a.py")], ["a2"]
+        )
+
+    def test_removed_and_invalid_files(self):
+        self.index.update()
+        (self.root / "pkg" / "b.py").unlink()
+        (self.root / "pkg" / "c.py").write_text("def broken(:\n")
+        stats = self.index.update()
+        self.assertEqual((stats.removed, stats.failed), (1, 1))
+        self.assertEqual(self.index.functions(name="b"), [])
+        self.assertIn("SyntaxError", self.index.errors()["pkg/c.py"])
+
+    def test_update_given_paths_in_a_process_pool(self):
+        paths = []
+        for i in range(20):
+            (self.root / f"m{i}.py").write_text(f"def f{i}():\n    pass\n")
+            paths.append(f"m{i}.py")
+        index = FunctionIndex(self.root, path=self.root / "other.sqlite", workers=2)
+        with index:
+            stats = index.update(paths)
+            self.assertEqual((stats.parsed, len(index)), (20, 20))
+            self.assertEqual(index.functions(name="f7")[0].definition, "def f7():")
+
+    def test_concurrent_first_use_builds_one_default_index(self):
+        env = {"P2C_INDEX_ROOT": str(self.root)}
+        with mock.patch.dict(os.environ, env), mock.patch.object(
+            indexer, "_default_index", None
+        ):
+            with ThreadPoolExecutor(8) as executor:
+                indexes = list(executor.map(lambda _: get_default_index(), range(8)))
+            self.assertEqual(len({id(index) for index in indexes}), 1)
+            vectors = [indexes[0].vectors for _ in range(8)]
+            with ThreadPoolExecutor(8) as executor:
+                stores = list(executor.map(lambda load: load(), vectors))
+            self.assertEqual(len({id(store) for store in stores}), 1)
+            indexes[0].close()
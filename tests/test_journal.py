@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from examples.human_eval_script import run_human_eval
+from prompt_to_code.agents import agents
+from prompt_to_code.agents.journal import RunJournal
+from prompt_to_code.agents.transcripts import flush_transcripts
+
+PROBLEMS = {
+    f"Task/{i}": {"task_id": f"Task/{i}", "prompt": f"def f{i}(x): ..."}
+    for i in range(2)
+}
+
+
+class TestRunJournal(unittest.TestCase):
+    def test_tracks_steps_and_completion(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            journal = RunJournal(tmpdir)
+            journal.store("HumanEval/1", 2).save("stub", "key", {"stub_code": ""}, 1.0)
+            self.assertEqual(journal.steps("HumanEval/1", 2), ["stub"])
+            self.assertFalse(journal.is_complete("HumanEval/1", 2))
+            self.assertEqual(journal.summary().in_progress, 1)
+
+            journal.mark_complete("HumanEval/1", 2, failed=False)
+            self.assertTrue(journal.is_complete("HumanEval/1", 2))
+            self.assertFalse(journal.is_complete("HumanEval/1", 0))
+            self.assertEqual(journal.summary().complete, 1)
+
+    def test_counts_the_steps_samples_share(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            journal = RunJournal(tmpdir)
+            shared = journal.shared_store("HumanEval/1")
+            shared.save("stub", "key", {"stub_code": ""}, 1.0)
+            shared.save("red", "key", {"tests": ""}, 1.0)
+            summary = journal.summary()
+            self.assertEqual((summary.in_progress, summary.steps), (1, 2))
+
+            for sample in range(3):
+                journal.mark_complete("HumanEval/1", sample, failed=False)
+            summary = journal.summary()
+            self.assertEqual((summary.complete, summary.in_progress), (3, 0))
+
+
+class TestResumeHumanEval(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+
+    def tearDown(self):
+        flush_transcripts()
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def run_human_eval(self):
+        with mock.patch.object(agents, "call_llm", wraps=agents.call_llm) as call_llm:
+            run_human_eval(agent="fake", outdir="out", problems=PROBLEMS)
+        return call_llm.call_count
+
+    def test_resumes_at_the_first_unfinished_step(self):
+        crash = mock.patch.object(agents, "fix_code", side_effect=KeyboardInterrupt)
+        with crash, self.assertRaises(KeyboardInterrupt):
+            self.run_human_eval()
+        journal = RunJournal("out/.journal")
+        self.assertIn("green_draft", journal.steps("Task/0"))
+        self.assertFalse(journal.is_complete("Task/0"))
+
+        # Task/0 only fixes its saved code, Task/1 runs from the start
+        self.assertEqual(self.run_human_eval(), 3)
+        self.assertTrue(journal.is_complete("Task/0"))
+        self.assertTrue(Path("out/human_eval_0000_0000.py").exists())
+
+        # Completed samples are skipped
+        self.assertEqual(self.run_human_eval(), 0)
+
+    def test_samples_sharing_the_stub_and_tests(self):
+        with mock.patch.object(agents, "call_llm", wraps=agents.call_llm) as call_llm:
+            run_human_eval(
+                agent="fake",
+                outdir="out",
+                problems=PROBLEMS,
+                num_samples_per_task=3,
+                share="red",
+            )
+        self.assertEqual(call_llm.call_count, 2 * (2 + 3))
+        journal = RunJournal("out/.journal")
+        self.assertEqual(journal.summary().complete, 6)
+        self.assertTrue(Path("out/human_eval_0001_0002.py").exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
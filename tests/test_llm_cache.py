@@ -0,0 +1,56 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from prompt_to_code.agents.cache import LLMCache
+
+
+class FakeLLM:
+    def __init__(self, model_name="gpt-4", temperature=0.0):
+        self.model_name = model_name
+        self.temperature = temperature
+
+
+class TestLLMCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / "cache.sqlite"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_hit_and_miss(self):
+        cache = LLMCache(self.path)
+        llm = FakeLLM()
+        self.assertIsNone(cache.get(llm, "prompt"))
+        cache.put(llm, "prompt", "response")
+        self.assertEqual(cache.get(llm, "prompt"), "response")
+        self.assertIsNone(cache.get(FakeLLM(model_name="gpt-3.5-turbo"), "prompt"))
+        self.assertEqual((cache.stats.hits, cache.stats.misses), (1, 2))
+
+    def test_persists_across_instances(self):
+        LLMCache(self.path).put(FakeLLM(), "prompt", "response")
+        self.assertEqual(LLMCache(self.path).get(FakeLLM(), "prompt"), "response")
+
+    def test_sampled_calls_bypass_cache(self):
+        cache = LLMCache(self.path)
+        llm = FakeLLM(temperature=0.7)
+        cache.put(llm, "prompt", "response")
+        self.assertIsNone(cache.get(llm, "prompt"))
+        self.assertEqual(cache.stats.bypassed, 1)
+
+        cache = LLMCache(self.path, cache_sampled=True)
+        cache.put(llm, "prompt", "response")
+        self.assertEqual(cache.get(llm, "prompt"), "response")
+
+    def test_evicts_least_recently_used(self):
+        cache = LLMCache(self.path, max_entries=2)
+        llm = FakeLLM()
+        cache.put(llm, "a", "1")
+        cache.put(llm, "b", "2")
+        cache.get(llm, "a")
+        cache.put(llm, "c", "3")
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(llm, "b"))
+        self.assertEqual(cache.get(llm, "a"), "1")
+        self.assertEqual(cache.stats.evictions, 1)
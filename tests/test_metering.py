@@ -0,0 +1,57 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from prompt_to_code.agents.metering import Meter, count_tokens, price, read_ledger
+
+
+class FakeLLM:
+    def __init__(self, model_name="gpt-4"):
+        self.model_name = model_name
+
+
+class FakeChatLLM(FakeLLM):
+    def call_as_llm(self, prompt):
+        return ""
+
+
+class TestMeter(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.ledger = Path(self.tmpdir.name) / "usage.jsonl"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_prices_prompt_and_completion_per_model(self):
+        self.assertAlmostEqual(price("gpt-4-0314", 1000, 1000), 0.09)
+        self.assertAlmostEqual(price("gpt-4-32k-0314", 1000, 1000), 0.18)
+        self.assertEqual(price("unknown-model", 1000, 1000), 0.0)
+
+    def test_records_usage_to_ledger(self):
+        meter = Meter(self.ledger, run_id="run")
+        usage = meter.record(
+            FakeChatLLM(), "hello world", "def f(): pass", 1.5, task="t", step="stub"
+        )
+        # Chat calls are billed for the message framing too
+        self.assertEqual(usage.prompt_tokens, count_tokens("hello world") + 7)
+        self.assertEqual(usage.completion_tokens, count_tokens("def f(): pass"))
+        self.assertGreater(usage.cost, 0)
+
+        meter.record(
+            FakeLLM(), "hello", "world", 0.0, task="t", step="red", cached=True
+        )
+        records = read_ledger(self.ledger)
+        self.assertEqual([r.step for r in records], ["stub", "red"])
+        self.assertEqual(records[1].cost, 0.0)
+        self.assertEqual({r.run_id for r in records}, {"run"})
+
+    def test_summary_by_step_and_task(self):
+        meter = Meter(run_id="run")
+        for task, step in [("a", "stub"), ("a", "fix"), ("a", "fix"), ("b", "fix")]:
+            meter.record(FakeLLM(), "prompt", "completion", 1.0, task=task, step=step)
+        summary = meter.summary(by="step")
+        self.assertEqual(summary["fix"]["calls"], 3)
+        self.assertEqual(summary["fix"]["duration"], 3.0)
+        self.assertEqual(meter.summary(by="step", task="a")["fix"]["calls"], 2)
+        self.assertIn("stub", meter.report(by="step"))
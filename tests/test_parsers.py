@@ -0,0 +1,51 @@
+import unittest
+
+from prompt_to_code.parsers import clear_cache, extract_function_definitions
+
+SOURCE = """
+def load(path: str) -> str:
+    return open(path).read()
+
+
+def parse(text, *, strict=False) -> dict:
+    return {}
+
+
+def main():
+    text = load("data.txt")
+    parse(text)
+    parse(load("other.txt"))
+"""
+
+
+class TestExtractFunctionDefinitions(unittest.TestCase):
+    def setUp(self):
+        clear_cache()
+
+    def test_functions_and_call_edges(self):
+        functions, G = extract_function_definitions(SOURCE, filename="main.py")
+        self.assertEqual([f.name for f in functions], ["load", "parse", "main"])
+        self.assertEqual(functions[0].definition, "def load(path: str) -> str:")
+        self.assertEqual(functions[1].parameters, (["text"], ["strict"]))
+        self.assertEqual(functions[1].return_type, "dict")
+        self.assertEqual(functions[0].filename, "main.py")
+
+        # Calls in main: load, parse, parse, load
+        self.assertEqual(
+            list(G.edges), [("parse", "load"), ("parse", "parse"), ("load", "parse")]
+        )
+        self.assertEqual(G["parse"]["load"]["weight"], 1)
+        self.assertEqual(functions[1].usages["before"], [("load", 1), ("parse", 1)])
+        self.assertEqual(functions[2].usages, {})
+
+    def test_cached_on_content(self):
+        functions, G = extract_function_definitions(SOURCE, filename="main.py")
+        again, G_again = extract_function_definitions(SOURCE, filename="main.py")
+        self.assertIs(G, G_again)
+        self.assertIsNot(functions, again)
+        self.assertEqual(functions, again)
+        with self.assertRaises(Exception):
+            G.add_edge("a", "b")
+
+        _, G_other = extract_function_definitions(SOURCE, filename="other.py")
+        self.assertIsNot(G, G_other)
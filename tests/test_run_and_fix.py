@@ -0,0 +1,101 @@
+import itertools
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from prompt_to_code.agents.agents import FixMetrics, run_and_fix
+from prompt_to_code.agents.transcripts import flush_transcripts
+
+
+class ScriptedLLM:
+    """Returns the scripted responses in turn"""
+
+    temperature = 0.2
+
+    def __init__(self, responses):
+        self.responses = itertools.cycle(responses)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def get_num_tokens(self, prompt):
+        return len(prompt) // 4
+
+    def __call__(self, prompt):
+        with self.lock:
+            self.calls += 1
+            return next(self.responses)
+
+
+class StreamingLLM(ScriptedLLM):
+    """Streams the first response at once and the others a character every 10ms"""
+
+    def __init__(self, responses):
+        super().__init__(responses)
+        self.streamed = 0
+
+    def stream(self, prompt):
+        with self.lock:
+            self.calls += 1
+            slow = self.calls > 1
+            response = next(self.responses)
+        for char in response:
+            if slow:
+                time.sleep(0.01)
+            with self.lock:
+                self.streamed += 1
+            yield char
+
+
+class TestRunAndFix(unittest.TestCase):
+    def setUp(self):
+        # call_llm writes its transcripts relative to the working directory
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+
+    def tearDown(self):
+        flush_transcripts()
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def run_and_fix(self, llm, strategy, metrics):
+        return run_and_fix(
+            llm,
+            "raise ValueError()",
+            strategy=strategy,
+            k=3,
+            metrics=metrics,
+        )
+
+    def test_sequential(self):
+        metrics = FixMetrics()
+        llm = ScriptedLLM(["1/0", "x = 1"])
+        self.assertEqual(self.run_and_fix(llm, "sequential", metrics), "x = 1")
+        self.assertEqual((llm.calls, metrics.rounds, metrics.wasted), (2, 2, 0))
+
+    def test_parallel_k_keeps_first_passing_candidate(self):
+        metrics = FixMetrics()
+        llm = ScriptedLLM(["1/0", "x = 1", "y = 2"])
+        self.assertIn(self.run_and_fix(llm, "parallel-k", metrics), ["x = 1", "y = 2"])
+        self.assertEqual((llm.calls, metrics.rounds), (3, 1))
+        self.assertEqual((metrics.validated, metrics.wasted), (3, 2))
+
+    def test_race(self):
+        metrics = FixMetrics()
+        llm = ScriptedLLM(["1/0", "x = 1", "1/0"])
+        self.assertEqual(self.run_and_fix(llm, "race", metrics), "x = 1")
+        self.assertEqual((metrics.rounds, metrics.candidates), (1, 3))
+
+    def test_race_cancels_the_other_requests(self):
+        metrics = FixMetrics()
+        llm = StreamingLLM(["x = 1", "y = 2" + " " * 500, "z = 3" + " " * 500])
+        self.assertEqual(self.run_and_fix(llm, "race", metrics), "x = 1")
+        self.assertEqual((llm.calls, metrics.cancelled, metrics.validated), (3, 2, 1))
+        # The slow completions were closed long before they were done
+        self.assertLess(llm.streamed, 500)
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            self.run_and_fix(ScriptedLLM(["x = 1"]), "fastest", FixMetrics())
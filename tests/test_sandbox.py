@@ -0,0 +1,50 @@
+import time
+import unittest
+
+from prompt_to_code.tools.sandbox import SandboxPool
+
+
+class TestSandboxPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = SandboxPool(size=2, max_runs=3)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+
+    def test_captures_stdout(self):
+        result = self.pool.run("print('hello')", timeout=10)
+        self.assertFalse(result.failed)
+        self.assertEqual(result.stdout, "hello\n")
+        self.assertGreater(result.peak_rss, 0)
+
+    def test_returns_traceback(self):
+        result = self.pool.run("raise ValueError('boom')", timeout=10)
+        self.assertTrue(result.failed)
+        self.assertIn("ValueError: boom\n", result.traceback)
+
+    def test_globals_are_not_shared(self):
+        self.pool.run("x = 1", timeout=10)
+        result = self.pool.run("print(x)", timeout=10)
+        self.assertIn("NameError", result.traceback[-1])
+
+    def test_timeout_recycles_worker(self):
+        result = self.pool.run("while True: pass", timeout=0.5)
+        self.assertTrue(result.timed_out)
+        self.assertFalse(self.pool.run("pass", timeout=10).failed)
+
+    def test_crash_recycles_worker(self):
+        result = self.pool.run("import os; os._exit(3)", timeout=10)
+        self.assertTrue(result.crashed)
+        self.assertFalse(self.pool.run("pass", timeout=10).failed)
+
+    def test_map_runs_concurrently(self):
+        with SandboxPool(size=2) as pool:
+            pool.warm()
+            pool.map(["pass"] * 2, timeout=10)
+            start = time.perf_counter()
+            results = pool.map(["import time; time.sleep(0.5)"] * 2, timeout=10)
+            elapsed = time.perf_counter() - start
+        self.assertEqual([r.failed for r in results], [False, False])
+        self.assertLess(elapsed, 0.95)
@@ -0,0 +1,67 @@
+import unittest
+
+from langchain.schema import AgentAction
+
+from prompt_to_code.agents.basic_linear import CustomPromptTemplate
+from prompt_to_code.agents.scratchpad import Scratchpad
+
+
+def step(i: int, observation: str = "ok"):
+    action = AgentAction(
+        tool="Read file",
+        tool_input=f"file_{i}.py",
+        log=f"Thought: read file {i}\nAction: Read file\nAction Input: file_{i}.py",
+    )
+    return action, observation
+
+
+class TestScratchpad(unittest.TestCase):
+    def test_matches_the_full_format_when_small(self):
+        steps = [step(0), step(1)]
+        expected = "".join(
+            f"{action.log}\nObservation: {observation}\nThought: "
+            for action, observation in steps
+        )
+        self.assertEqual(Scratchpad().update(steps), expected)
+
+    def test_caps_oversized_observations(self):
+        big = "\n".join(f"line {i} of the file" for i in range(2000))
+        text = Scratchpad(max_observation_tokens=50).update([step(0, big)])
+        self.assertIn("line 0 of the file", text)
+        self.assertNotIn("line 1999", text)
+        self.assertRegex(text, r"\.\.\. \[\d+ more lines\]")
+
+    def test_compacts_then_drops_older_steps(self):
+        pad = Scratchpad(budget=200, keep_recent=2, compact_tokens=8)
+        observation = "x = 1\n" * 40
+        steps = []
+        sizes = []
+        for i in range(30):
+            steps.append(step(i, observation))
+            text = pad.update(steps)
+            sizes.append(len(text))
+        # The last two steps are verbatim, the older ones shortened
+        self.assertIn(f"{steps[-1][0].log}\nObservation: {observation}", text)
+        self.assertIn(f"{steps[-2][0].log}\nObservation: {observation}", text)
+        self.assertNotIn(f"{steps[-3][0].log}\nObservation: {observation}", text)
+        self.assertIn("earlier steps omitted", text)
+        self.assertNotIn("read file 0\n", text)
+        # The scratchpad stops growing
+        self.assertEqual(max(sizes[10:]), max(sizes[-5:]))
+
+    def test_a_new_run_starts_a_new_scratchpad(self):
+        pad = Scratchpad()
+        pad.update([step(0), step(1)])
+        self.assertEqual(pad.update([]), "")
+        self.assertNotIn("read file 0", pad.update([step(2)]))
+
+    def test_prompt_template_uses_the_scratchpad(self):
+        prompt = CustomPromptTemplate(
+            template="{input}\n{agent_scratchpad}",
+            tools=[],
+            input_variables=["input", "intermediate_steps"],
+            scratchpad=Scratchpad(max_observation_tokens=10),
+        )
+        text = prompt.format(input="task", intermediate_steps=[step(0, "y " * 500)])
+        self.assertTrue(text.startswith("task\nThought: read file 0"))
+        self.assertLess(len(text), 300)
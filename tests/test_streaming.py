@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from langchain.schema import AgentAction, AgentFinish
+
+from prompt_to_code.agents.agents import call_llm, extract_code_from_response
+from prompt_to_code.agents.basic_linear import CustomOutputParser
+from prompt_to_code.agents.fake_llm import FakeLLM
+from prompt_to_code.agents.metering import Meter, set_meter
+from prompt_to_code.agents.streaming import (
+    AgentActionExtractor,
+    CodeBlockExtractor,
+    stream_llm,
+)
+from prompt_to_code.agents.transcripts import flush_transcripts
+
+RESPONSE = (
+    "Here is the code:\n```python\ndef add(x, y):\n    return x + y\n```\n"
+    "This function adds two numbers. " * 50
+)
+
+
+def feed_chars(extractor, text: str) -> int:
+    """Feeds text one character at a time, returns how many were fed"""
+    for i, char in enumerate(text):
+        if extractor.feed(char):
+            return i + 1
+    return len(text)
+
+
+class TestExtractors(unittest.TestCase):
+    def test_stops_at_the_closing_fence(self):
+        extractor = CodeBlockExtractor()
+        fed = feed_chars(extractor, RESPONSE)
+        self.assertTrue(extractor.done)
+        self.assertTrue(extractor.result.endswith("return x + y\n```"))
+        self.assertEqual(fed, len(extractor.result))
+        self.assertEqual(
+            extract_code_from_response(extractor.result.split("Here is the code:")[1]),
+            "def add(x, y):\n    return x + y",
+        )
+
+    def test_prompt_ending_inside_a_block(self):
+        extractor = CodeBlockExtractor.for_prompt("# CORRECTED CODE:\n```python\n")
+        self.assertTrue(extractor.inside)
+        feed_chars(extractor, "x = 1\n```\nI fixed the bug.")
+        self.assertEqual(extractor.result, "x = 1\n```")
+
+    def test_unfenced_responses_are_read_to_the_end(self):
+        extractor = CodeBlockExtractor()
+        feed_chars(extractor, "def add(x, y):\n    return x + y\n")
+        self.assertFalse(extractor.done)
+        self.assertEqual(extractor.result, "def add(x, y):\n    return x + y\n")
+
+    def test_action_input_ends_before_a_made_up_observation(self):
+        extractor = AgentActionExtractor()
+        text = "Thought: write\nAction: Write\nAction Input: add.py\nx = 1\nObservation: ok"
+        feed_chars(extractor, text)
+        self.assertEqual(
+            extractor.result,
+            "Thought: write\nAction: Write\nAction Input: add.py\nx = 1",
+        )
+
+    def test_output_parser(self):
+        parser = CustomOutputParser()
+        action = parser.parse(
+            "Thought: read\nAction: Read file\nAction Input: 'add.py'\nObservation: x"
+        )
+        self.assertIsInstance(action, AgentAction)
+        self.assertEqual((action.tool, action.tool_input), ("Read file", "add.py"))
+        finish = parser.parse('Thought: done\nFinal Answer: ["add.py"]')
+        self.assertIsInstance(finish, AgentFinish)
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        self.meter = Meter()
+        set_meter(self.meter)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(os.environ, {"P2C_TRANSCRIPT_DIR": self.tmpdir.name})
+        self.env.start()
+
+    def tearDown(self):
+        set_meter(None)
+        flush_transcripts()
+        self.env.stop()
+        self.tmpdir.cleanup()
+
+    def test_stream_stops_reading_early(self):
+        llm = FakeLLM(responses=[RESPONSE])
+        result = stream_llm(llm, "prompt", CodeBlockExtractor())
+        self.assertTrue(result.stopped_early)
+        self.assertTrue(result.text.endswith("```"))
+        self.assertLess(result.chunks, len(RESPONSE) / 8)
+        self.assertIsNotNone(result.first_token)
+
+    def test_call_llm_streams(self):
+        llm = FakeLLM(responses=[RESPONSE])
+        result = call_llm(llm, "write add", use_cache=False, stream=True)
+        self.assertNotIn("This function adds", result)
+        usage = self.meter.records[-1]
+        self.assertIsNotNone(usage.first_token)
+        self.assertLess(usage.completion_tokens, 40)
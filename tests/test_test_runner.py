@@ -0,0 +1,109 @@
+import contextlib
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from prompt_to_code.tools.test_runner import PytestService
+
+TESTS = """
+import pytest
+
+def test_passes():
+    assert 1 == 1
+
+def test_fails():
+    assert 1 == 2, "one is not two"
+
+@pytest.fixture
+def broken():
+    raise RuntimeError("broken fixture")
+
+def test_errors(broken):
+    pass
+"""
+
+# Starts a service, then exits the way a process pool worker does, skipping atexit
+OWNER = """
+import os
+from prompt_to_code.tools.test_runner import PytestService
+
+service = PytestService()
+service.start()
+print(service._process.pid, service._dir, flush=True)
+os._exit(0)
+"""
+
+
+def running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # An exited process stays a zombie until its new parent reaps it
+    with contextlib.suppress(OSError):
+        stat = Path(f"/proc/{pid}/stat").read_text()
+        return stat.rsplit(")", 1)[1].split()[0] != "Z"
+    return True
+
+
+class TestPytestService(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.service = PytestService(args=["-p", "no:cacheprovider"])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.stop()
+        cls.tmpdir.cleanup()
+
+    def write(self, name: str, code: str) -> Path:
+        path = Path(self.tmpdir.name) / name
+        path.write_text(code)
+        return path
+
+    def test_per_test_outcomes(self):
+        result = self.service.run(self.write("test_outcomes.py", TESTS), timeout=30)
+        self.assertTrue(result.failed)
+        outcomes = {test.nodeid.split("::")[-1]: test for test in result.tests}
+        self.assertEqual(outcomes["test_passes"].outcome, "passed")
+        self.assertEqual(outcomes["test_fails"].outcome, "failed")
+        self.assertIn("one is not two", outcomes["test_fails"].message)
+        self.assertEqual(outcomes["test_errors"].outcome, "errored")
+        self.assertIn("1 failed, 1 passed, 1 error", result.output)
+
+    def test_passing_file(self):
+        result = self.service.run(
+            self.write("test_passing.py", "def test_ok():\n    pass\n"), timeout=30
+        )
+        self.assertFalse(result.failed)
+        self.assertEqual(result.count("passed"), 1)
+
+    def test_timeout(self):
+        path = self.write(
+            "test_slow.py", "import time\n\ndef test_slow():\n    time.sleep(30)\n"
+        )
+        result = self.service.run(path, timeout=1)
+        self.assertTrue(result.failed)
+        self.assertIn("TimeoutError", result.output)
+
+    def test_server_exits_with_its_owner(self):
+        owner = subprocess.run(
+            [sys.executable, "-c", OWNER],
+            cwd=Path(__file__).parents[1],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            timeout=60,
+            check=True,
+        )
+        pid, directory = owner.stdout.split()
+        deadline = time.monotonic() + 10
+        while running(int(pid)) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(running(int(pid)))
+        self.assertFalse(Path(directory).exists())
@@ -0,0 +1,78 @@
+import asyncio
+import tempfile
+import unittest
+from pathlib import Path
+
+from prompt_to_code.tracing import (
+    Tracer,
+    read_trace,
+    set_tracer,
+    span,
+    summarize_trace,
+    traced,
+)
+
+
+@traced(attributes=("name",))
+def step(name, attempt=0):
+    with span("inner", attempt=attempt):
+        pass
+
+
+@traced(attributes=("name",))
+async def astep(name):
+    await asyncio.sleep(0.01)
+    with span("inner"):
+        pass
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / "trace.json"
+
+    def tearDown(self):
+        set_tracer(None)
+        self.tmpdir.cleanup()
+
+    def test_spans_nest(self):
+        tracer = Tracer()
+        set_tracer(tracer)
+        with span("run") as root:
+            step("task-1", attempt=2)
+        inner, outer, run = tracer.spans
+        self.assertEqual([s.name for s in tracer.spans], ["inner", "step", "run"])
+        self.assertIs(inner.parent, outer)
+        self.assertIs(outer.parent, root)
+        self.assertEqual(outer.attributes, {"name": "task-1"})
+        self.assertEqual(inner.attributes, {"attempt": 2})
+        self.assertGreaterEqual(run.duration, outer.duration)
+
+    def test_async_tasks_keep_their_own_parent(self):
+        tracer = Tracer()
+        set_tracer(tracer)
+
+        async def main():
+            await asyncio.gather(astep("a"), astep("b"))
+
+        asyncio.run(main())
+        inner = [s for s in tracer.spans if s.name == "inner"]
+        self.assertEqual(sorted(s.parent.attributes["name"] for s in inner), ["a", "b"])
+
+    def test_disabled_tracer_records_nothing(self):
+        tracer = Tracer(enabled=False)
+        set_tracer(tracer)
+        with span("run") as s:
+            s.set(ignored=True)
+            step("task-1")
+        self.assertEqual(tracer.spans, [])
+
+    def test_tracers_append_to_one_chrome_trace(self):
+        for name in ["a", "b"]:
+            set_tracer(Tracer(self.path))
+            step(name)
+        events = read_trace(self.path)
+        self.assertTrue(self.path.read_text().startswith("[\n"))
+        self.assertEqual([e["name"] for e in events], ["inner", "step"] * 2)
+        self.assertEqual({e["ph"] for e in events}, {"X"})
+        self.assertEqual(summarize_trace(events)["step"]["calls"], 2)
@@ -0,0 +1,65 @@
+import gzip
+import tempfile
+import unittest
+from pathlib import Path
+
+from prompt_to_code.agents.transcripts import (
+    Transcript,
+    TranscriptStore,
+    read_transcripts,
+)
+
+
+def transcript(task, step, prompt="prompt"):
+    return Transcript(
+        run_id="run",
+        task=task,
+        step=step,
+        prefix=f"human-eval-{step}",
+        model="gpt-4",
+        prompt=prompt,
+        response="response",
+        prompt_tokens=1,
+        completion_tokens=1,
+        cost=0.0,
+        duration=0.1,
+        timestamp=0.0,
+    )
+
+
+class TestTranscriptStore(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_batches_into_one_file(self):
+        store = TranscriptStore(self.directory, batch_size=4, flush_interval=10)
+        for i in range(10):
+            store.append(transcript("a", "stub", prompt=str(i)))
+        store.flush()
+        self.assertEqual(len(list(self.directory.iterdir())), 1)
+        prompts = [t.prompt for t in read_transcripts(self.directory)]
+        self.assertEqual(prompts, [str(i) for i in range(10)])
+        store.close()
+        with self.assertRaises(RuntimeError):
+            store.append(transcript("a", "stub"))
+
+    def test_query_by_task_and_step(self):
+        store = TranscriptStore(self.directory)
+        for task, step in [("a", "stub"), ("a", "green"), ("b", "green")]:
+            store.append(transcript(task, step))
+        store.close()
+        found = read_transcripts(self.directory, task="a", step="green")
+        self.assertEqual([(t.task, t.step) for t in found], [("a", "green")])
+        self.assertEqual(len(list(read_transcripts(self.directory, step="green"))), 2)
+
+    def test_skips_truncated_batch(self):
+        store = TranscriptStore(self.directory)
+        store.append(transcript("a", "stub"))
+        store.close()
+        with open(store.path, "ab") as f:
+            f.write(gzip.compress(b'{"run_id": "run"}\n' * 100)[:20])
+        self.assertEqual(len(list(read_transcripts(store.path))), 1)
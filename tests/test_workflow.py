@@ -0,0 +1,195 @@
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from prompt_to_code.agents.agents import _retarget, run_agent, run_agent_samples
+from prompt_to_code.agents.fake_llm import TDD_RULES, FakeLLM
+from prompt_to_code.agents.transcripts import flush_transcripts
+from prompt_to_code.agents.workflow import Node, NodeStore, Workflow
+
+
+class TestWorkflow(unittest.TestCase):
+    def test_runs_nodes_in_dependency_order(self):
+        workflow = Workflow(
+            [
+                Node("sum", lambda a, b: {"sum": a + b}, ("a", "b"), ("sum",)),
+                Node("a", lambda x: {"a": x * 2}, ("x",), ("a",)),
+                Node("b", lambda x: {"b": x * 3}, ("x",), ("b",)),
+            ]
+        )
+        self.assertEqual(workflow.run(x=1)["sum"], 5)
+
+    def test_independent_nodes_run_concurrently(self):
+        # Each node waits for the other, so they only finish if run at the same time
+        barrier = threading.Barrier(2, timeout=5)
+
+        def node(output):
+            def run(x):
+                barrier.wait()
+                return {output: x}
+
+            return run
+
+        workflow = Workflow(
+            [
+                Node("a", node("a"), ("x",), ("a",)),
+                Node("b", node("b"), ("x",), ("b",)),
+            ]
+        )
+        self.assertEqual(workflow.run(x=1)["b"], 1)
+
+    def test_invalid_workflows(self):
+        with self.assertRaisesRegex(ValueError, "Cycle"):
+            Workflow(
+                [
+                    Node("a", dict, ("b",), ("a",)),
+                    Node("b", dict, ("a",), ("b",)),
+                ]
+            )
+        with self.assertRaisesRegex(ValueError, "both"):
+            Workflow([Node("a", dict, (), ("x",)), Node("b", dict, (), ("x",))])
+        with self.assertRaisesRegex(ValueError, "Missing workflow inputs"):
+            Workflow([Node("a", dict, ("x",), ("a",))]).run()
+
+    def test_resumes_after_the_finished_nodes(self):
+        calls = []
+        restored = []
+
+        def node(name, fail=False):
+            def run(**inputs):
+                calls.append(name)
+                if fail:
+                    raise RuntimeError("crashed")
+                return {name: sum(inputs.values()) + 1}
+
+            return run
+
+        def nodes(fail):
+            return [
+                Node("a", node("a"), ("x",), ("a",), restore=restored.append),
+                Node("b", node("b", fail), ("a",), ("b",)),
+            ]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = NodeStore(tmpdir)
+            with self.assertRaisesRegex(RuntimeError, "crashed"):
+                Workflow(nodes(fail=True), store=store).run(x=1)
+            calls.clear()
+
+            workflow = Workflow(nodes(fail=False), store=store)
+            self.assertEqual(workflow.run(x=1)["b"], 3)
+            self.assertEqual(calls, ["b"])
+            self.assertEqual(restored, [{"a": 2}])
+            self.assertTrue(workflow.results["a"].loaded)
+
+            # Other inputs are a different run
+            calls.clear()
+            Workflow(nodes(fail=False), store=store).run(x=2)
+            self.assertEqual(calls, ["a", "b"])
+
+    def test_branches_share_the_given_inputs(self):
+        restored = []
+        node = Node(
+            "scale", lambda x, k: {"y": x * k}, ("x", "k"), ("y",), restored.append
+        )
+        branch = node.branch("_1", shared=("k",))
+        self.assertEqual((branch.name, branch.inputs), ("scale_1", ("x_1", "k")))
+        workflow = Workflow([node, branch])
+        values = workflow.run(x=1, x_1=2, k=3)
+        self.assertEqual((values["y"], values["y_1"]), (3, 6))
+        branch.restore({"y_1": 6})
+        self.assertEqual(restored, [{"y": 6}])
+
+
+class TestTDDWorkflow(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+
+    def tearDown(self):
+        flush_transcripts()
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def test_resumes_without_prompting_again(self):
+        store = NodeStore("runs/add")
+        filename = Path("add.py")
+        llm = FakeLLM(rules=TDD_RULES)
+        first = run_agent("fake", "add", filename, "def add(x, y): ...", llm=llm)
+        self.assertEqual(llm.calls, 3)
+
+        llm = FakeLLM(rules=TDD_RULES)
+        run_agent("fake", "add", filename, "def add(x, y): ...", llm=llm, store=store)
+        filename.unlink()
+        Path("tests/test_add.py").unlink()
+        llm = FakeLLM(rules=TDD_RULES)
+        again = run_agent(
+            "fake", "add", filename, "def add(x, y): ...", llm=llm, store=store
+        )
+        self.assertEqual(llm.calls, 0)
+        self.assertEqual(again[1], first[1])
+        # The files of the loaded steps are written again
+        self.assertIn("return x", filename.read_text())
+        self.assertTrue(Path("tests/test_add.py").exists())
+
+        # A crash while the code was being fixed keeps its completion
+        Path("runs/add/green.json").unlink()
+        llm = FakeLLM(rules=TDD_RULES)
+        run_agent("fake", "add", filename, "def add(x, y): ...", llm=llm, store=store)
+        self.assertEqual(llm.calls, 0)
+
+        Path("runs/add/green.json").unlink()
+        Path("runs/add/green_draft.json").unlink()
+        llm = FakeLLM(rules=TDD_RULES)
+        run_agent("fake", "add", filename, "def add(x, y): ...", llm=llm, store=store)
+        self.assertEqual(llm.calls, 1)
+
+    def run_samples(self, share, store=None):
+        filenames = [Path(f"add_{i}.py") for i in range(3)]
+        llm = FakeLLM(rules=TDD_RULES)
+        results = run_agent_samples(
+            "fake",
+            "add",
+            filenames,
+            "def add(x, y): ...",
+            share=share,
+            llm=llm,
+            store=store,
+        )
+        self.assertEqual(len(results), 3)
+        for filename in filenames:
+            self.assertIn("return x", filename.read_text())
+        return llm.calls
+
+    def test_samples_share_the_stub_and_tests(self):
+        # One stub and one test suite, then the code of every sample
+        store = NodeStore("runs/add")
+        self.assertEqual(self.run_samples("red", store), 2 + 3)
+        self.assertTrue(Path("tests/test_add_2.py").exists())
+
+        Path("add_2.py").unlink()
+        Path("tests/test_add_2.py").unlink()
+        self.assertEqual(self.run_samples("red", store), 0)
+        self.assertTrue(Path("tests/test_add_2.py").exists())
+
+    def test_shared_tests_import_their_sample(self):
+        tests = "from pkg.add_0 import add_0_total\nimport add_0\n\n# pkg/add_0.py\n"
+        self.assertEqual(
+            _retarget(tests, Path("pkg/add_0.py"), Path("pkg/add_2.py")),
+            "from pkg.add_2 import add_0_total\nimport add_2\n\n# pkg/add_2.py\n",
+        )
+
+    def test_samples_share_the_stub(self):
+        self.assertEqual(self.run_samples("stub"), 1 + 2 * 3)
+
+    def test_independent_samples(self):
+        self.assertEqual(self.run_samples("none"), 3 * 3)
+        with self.assertRaisesRegex(ValueError, "share"):
+            self.run_samples("green")
+
+
+if __name__ == "__main__":
+    unittest.main()
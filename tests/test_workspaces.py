@@ -0,0 +1,164 @@
+import os
+import subprocess
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from prompt_to_code.agents.fake_llm import TDD_RULES, FakeLLM
+from prompt_to_code.agents.transcripts import flush_transcripts
+from prompt_to_code.workspaces import WorkspacePool, branch_name
+
+
+def git(repo: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", *args], cwd=repo, capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+
+def make_repo(path: Path) -> Path:
+    git(path, "init", "-q", "-b", "main")
+    git(path, "config", "user.email", "p2c@example.com")
+    git(path, "config", "user.name", "p2c")
+    (path / "README.md").write_text("# Repo\n")
+    (path / ".gitignore").write_text("*.cache\n")
+    git(path, "add", ".")
+    git(path, "commit", "-q", "-m", "Initial commit")
+    return path
+
+
+class TestWorkspacePool(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.repo = make_repo(Path(self.tmpdir.name))
+        # Outside of the repository, whose worktrees must stay clean
+        self.transcripts = tempfile.TemporaryDirectory()
+        self.env = mock.patch.dict(
+            os.environ, {"P2C_TRANSCRIPT_DIR": self.transcripts.name}
+        )
+        self.env.start()
+
+    def tearDown(self):
+        flush_transcripts()
+        self.env.stop()
+        self.transcripts.cleanup()
+        self.tmpdir.cleanup()
+
+    def test_branch_name(self):
+        self.assertEqual(branch_name("HumanEval/0"), "p2c-HumanEval-0")
+
+    def test_tasks_commit_on_their_own_branches(self):
+        with WorkspacePool(self.repo, size=2) as pool:
+            workspaces = [pool.acquire(f"task/{i}") for i in range(2)]
+            self.assertNotEqual(workspaces[0].path, workspaces[1].path)
+            for i, workspace in enumerate(workspaces):
+                (workspace.path / "solution.py").write_text(f"x = {i}\n")
+                workspace.git.commit_changes(f"Solve task {i}")
+            for workspace in workspaces:
+                pool.release(workspace)
+
+        self.assertEqual(git(self.repo, "status", "--porcelain"), "")
+        self.assertEqual(git(self.repo, "branch", "--show-current"), "main")
+        for i in range(2):
+            code = git(self.repo, "show", f"p2c-task-{i}:solution.py")
+            self.assertEqual(code, f"x = {i}")
+        # Closing the pool removes its worktrees
+        self.assertEqual(len(git(self.repo, "worktree", "list").splitlines()), 1)
+
+    def test_reuses_a_clean_worktree(self):
+        pool = WorkspacePool(self.repo, size=1)
+        with pool.workspace("a") as workspace:
+            path = workspace.path
+            (path / "scratch.py").write_text("x = 1\n")
+            (path / "build.cache").write_text("warm\n")
+        self.assertEqual(pool.idle, [path])
+
+        with pool.workspace("b") as workspace:
+            self.assertEqual(workspace.path, path)
+            self.assertEqual(workspace.branch, "p2c-b")
+            self.assertFalse((path / "scratch.py").exists())
+            # Ignored files stay warm
+            self.assertTrue((path / "build.cache").exists())
+        pool.close()
+        self.assertFalse(path.exists())
+
+    def test_releases_beyond_size_are_removed(self):
+        pool = WorkspacePool(self.repo, size=1)
+        first, second = pool.acquire("a"), pool.acquire("b")
+        pool.release(first)
+        pool.release(second)
+        self.assertEqual(pool.idle, [first.path])
+        self.assertFalse(second.path.exists())
+        pool.close()
+
+    def test_a_branch_is_only_checked_out_once(self):
+        pool = WorkspacePool(self.repo, size=2)
+        workspace = pool.acquire("a")
+        with self.assertRaises(RuntimeError):
+            pool.acquire("a")
+        pool.release(workspace)
+        # Its worktree went back to the pool
+        self.assertEqual(len(pool.idle), 2)
+        pool.close()
+
+    def test_adopts_worktrees_of_an_earlier_pool(self):
+        pool = WorkspacePool(self.repo, size=2)
+        with pool.workspace("a") as workspace:
+            path = workspace.path
+        self.assertEqual(WorkspacePool(self.repo).idle, [path])
+        pool.close()
+
+    def test_rerunning_a_task_that_writes_the_same_code(self):
+        from prompt_to_code.agents.agents import run_agent
+
+        for _ in range(2):
+            with WorkspacePool(self.repo, size=1) as pool:
+                with pool.workspace("task") as workspace:
+                    run_agent(
+                        "fake",
+                        "task",
+                        Path("solution.py"),
+                        "def f(x): ...",
+                        llm=FakeLLM(rules=TDD_RULES),
+                        workspace=workspace,
+                    )
+        log = git(self.repo, "log", "--format=%s", "p2c-task").splitlines()
+        self.assertEqual(log, ["task: tests fail", "Initial commit"])
+
+    def test_parallel_agents(self):
+        from prompt_to_code.agents.agents import run_agent
+
+        errors = []
+
+        def run(pool, i):
+            try:
+                with pool.workspace(f"task-{i}") as workspace:
+                    llm = FakeLLM(rules=TDD_RULES)
+                    run_agent(
+                        "fake",
+                        f"task-{i}",
+                        Path("solution.py"),
+                        "def f(x): ...",
+                        llm=llm,
+                        workspace=workspace,
+                    )
+            except Exception as e:
+                errors.append(e)
+
+        with WorkspacePool(self.repo, size=3) as pool:
+            threads = [threading.Thread(target=run, args=(pool, i)) for i in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        for i in range(3):
+            files = git(self.repo, "ls-tree", "-r", "--name-only", f"p2c-task-{i}")
+            self.assertIn("solution.py", files.splitlines())
+            self.assertIn("tests/test_solution.py", files.splitlines())
+        self.assertEqual(git(self.repo, "status", "--porcelain"), "")
+
+
+if __name__ == "__main__":
+    unittest.main()